@@ -0,0 +1,28 @@
+"""Allow one summary per article
+
+Revision ID: 3b8e5f0c2d94
+Revises: e71a3c9b5d42
+Create Date: 2026-10-19 10:12:44.518302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b8e5f0c2d94'
+down_revision = 'e71a3c9b5d42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # keep the first summary stored when /cats and the summary workers raced
+    op.execute("DELETE FROM summary WHERE id NOT IN (SELECT MIN(id) FROM summary GROUP BY article_id)")
+    op.drop_index(op.f('ix_summary_article_id'), table_name='summary')
+    op.create_index(op.f('ix_summary_article_id'), 'summary', ['article_id'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_summary_article_id'), table_name='summary')
+    op.create_index(op.f('ix_summary_article_id'), 'summary', ['article_id'], unique=False)
@@ -0,0 +1,40 @@
+"""Add llm_result
+
+Revision ID: 47b9f1bedf8b
+Revises: f35b95cd4b75
+Create Date: 2026-10-18 15:02:41.518730
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '47b9f1bedf8b'
+down_revision = 'f35b95cd4b75'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('llm_result',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('cache_key', sa.String(length=64), nullable=False),
+    sa.Column('model', sa.String(), nullable=False),
+    sa.Column('prompt_version', sa.String(), nullable=False),
+    sa.Column('tags', sa.String(), nullable=False),
+    sa.Column('summary', sa.String(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('last_used_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_llm_result_id'), 'llm_result', ['id'], unique=False)
+    op.create_index(op.f('ix_llm_result_cache_key'), 'llm_result', ['cache_key'], unique=True)
+    op.create_index(op.f('ix_llm_result_last_used_at'), 'llm_result', ['last_used_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_llm_result_last_used_at'), table_name='llm_result')
+    op.drop_index(op.f('ix_llm_result_cache_key'), table_name='llm_result')
+    op.drop_index(op.f('ix_llm_result_id'), table_name='llm_result')
+    op.drop_table('llm_result')
@@ -0,0 +1,35 @@
+"""Add WebSub subscription of feeds
+
+Revision ID: 5d1c7a9e3f21
+Revises: bc0ff6f20c0e
+Create Date: 2026-10-18 18:05:41.227310
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d1c7a9e3f21'
+down_revision = 'bc0ff6f20c0e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('feed', sa.Column('websub_hub', sa.String(), nullable=True))
+    op.add_column('feed', sa.Column('websub_topic', sa.String(), nullable=True))
+    op.add_column('feed', sa.Column('websub_secret', sa.String(length=64), nullable=True))
+    op.add_column('feed', sa.Column('websub_requested_at', sa.DateTime(), nullable=True))
+    op.add_column('feed', sa.Column('websub_lease_expires_at', sa.DateTime(), nullable=True))
+    op.create_index(op.f('ix_feed_websub_lease_expires_at'), 'feed', ['websub_lease_expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_feed_websub_lease_expires_at'), table_name='feed')
+    with op.batch_alter_table('feed') as batch_op:
+        batch_op.drop_column('websub_lease_expires_at')
+        batch_op.drop_column('websub_requested_at')
+        batch_op.drop_column('websub_secret')
+        batch_op.drop_column('websub_topic')
+        batch_op.drop_column('websub_hub')
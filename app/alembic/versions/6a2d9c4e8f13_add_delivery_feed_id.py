@@ -0,0 +1,28 @@
+"""Add the feed of each delivery
+
+Revision ID: 6a2d9c4e8f13
+Revises: 3b8e5f0c2d94
+Create Date: 2026-10-19 11:03:27.640915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a2d9c4e8f13'
+down_revision = '3b8e5f0c2d94'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('delivery') as batch_op:
+        batch_op.add_column(sa.Column('feed_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_delivery_feed_id_feed', 'feed', ['feed_id'], ['id'])
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('delivery') as batch_op:
+        batch_op.drop_constraint('fk_delivery_feed_id_feed', type_='foreignkey')
+        batch_op.drop_column('feed_id')
@@ -0,0 +1,29 @@
+"""Add feed HTTP validators
+
+Revision ID: 7550b8fe096d
+Revises: ba9c3fe16b1d
+Create Date: 2026-10-18 10:03:17.840215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7550b8fe096d'
+down_revision = 'ba9c3fe16b1d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('feed', sa.Column('etag', sa.String(), nullable=True))
+    op.add_column('feed', sa.Column('last_modified', sa.String(), nullable=True))
+    op.add_column('feed', sa.Column('content_hash', sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('feed') as batch_op:
+        batch_op.drop_column('content_hash')
+        batch_op.drop_column('last_modified')
+        batch_op.drop_column('etag')
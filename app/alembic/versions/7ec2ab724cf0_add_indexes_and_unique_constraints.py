@@ -0,0 +1,72 @@
+"""Add indexes and unique constraints for the hot query paths
+
+Revision ID: 7ec2ab724cf0
+Revises: 7550b8fe096d
+Create Date: 2026-10-18 11:26:52.093114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7ec2ab724cf0'
+down_revision = '7550b8fe096d'
+branch_labels = None
+depends_on = None
+
+KEPT_ARTICLES = "SELECT MIN(id) FROM article GROUP BY url"
+# the kept article with the same url as `{table}.article_id`
+KEPT_ARTICLE_OF = """(
+    SELECT MIN(kept.id) FROM article kept
+    WHERE kept.url = (SELECT duplicate.url FROM article duplicate WHERE duplicate.id = {table}.article_id)
+)"""
+
+
+def remove_duplicates() -> None:
+    # Point user data at the first article of each url, drop the derived LLM output of the others
+    for table in ('feed_article', 'requested_article'):
+        op.execute(f"UPDATE {table} SET article_id = {KEPT_ARTICLE_OF.format(table=table)} "
+                   f"WHERE article_id NOT IN ({KEPT_ARTICLES})")
+    for table in ('article_tag', 'summary'):
+        op.execute(f"DELETE FROM {table} WHERE article_id NOT IN ({KEPT_ARTICLES})")
+    op.execute(f"DELETE FROM article WHERE id NOT IN ({KEPT_ARTICLES})")
+
+    for table, columns in (
+            ('feed_article', 'feed_id, article_id'),
+            ('user_feed_subscription', 'user_id, feed_id'),
+            ('requested_article', 'user_id, article_id'),
+    ):
+        op.execute(f"DELETE FROM {table} WHERE id NOT IN (SELECT MIN(id) FROM {table} GROUP BY {columns})")
+
+
+def upgrade() -> None:
+    remove_duplicates()
+
+    op.create_index(op.f('ix_article_url'), 'article', ['url'], unique=True)
+    with op.batch_alter_table('feed_article') as batch_op:
+        batch_op.create_unique_constraint('uq_feed_article_feed_id_article_id', ['feed_id', 'article_id'])
+    op.create_index('ix_feed_article_feed_id_updated_at', 'feed_article', ['feed_id', 'updated_at'], unique=False)
+    op.create_index('ix_feed_article_article_id', 'feed_article', ['article_id'], unique=False)
+    with op.batch_alter_table('user_feed_subscription') as batch_op:
+        batch_op.create_unique_constraint('uq_user_feed_subscription_user_id_feed_id', ['user_id', 'feed_id'])
+    op.create_index('ix_user_feed_subscription_feed_id', 'user_feed_subscription', ['feed_id'], unique=False)
+    with op.batch_alter_table('requested_article') as batch_op:
+        batch_op.create_unique_constraint('uq_requested_article_user_id_article_id', ['user_id', 'article_id'])
+    op.create_index(op.f('ix_article_tag_tag_id'), 'article_tag', ['tag_id'], unique=False)
+    op.create_index(op.f('ix_summary_article_id'), 'summary', ['article_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_summary_article_id'), table_name='summary')
+    op.drop_index(op.f('ix_article_tag_tag_id'), table_name='article_tag')
+    with op.batch_alter_table('requested_article') as batch_op:
+        batch_op.drop_constraint('uq_requested_article_user_id_article_id', type_='unique')
+    op.drop_index('ix_user_feed_subscription_feed_id', table_name='user_feed_subscription')
+    with op.batch_alter_table('user_feed_subscription') as batch_op:
+        batch_op.drop_constraint('uq_user_feed_subscription_user_id_feed_id', type_='unique')
+    op.drop_index('ix_feed_article_article_id', table_name='feed_article')
+    op.drop_index('ix_feed_article_feed_id_updated_at', table_name='feed_article')
+    with op.batch_alter_table('feed_article') as batch_op:
+        batch_op.drop_constraint('uq_feed_article_feed_id_article_id', type_='unique')
+    op.drop_index(op.f('ix_article_url'), table_name='article')
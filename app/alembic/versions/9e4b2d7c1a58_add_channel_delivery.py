@@ -0,0 +1,62 @@
+"""Add channel bindings and delivery outbox
+
+Revision ID: 9e4b2d7c1a58
+Revises: 5d1c7a9e3f21
+Create Date: 2026-10-18 21:12:09.518342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4b2d7c1a58'
+down_revision = '5d1c7a9e3f21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('channel_binding',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('feed_id', sa.Integer(), nullable=False),
+    sa.Column('target_type', sa.String(length=16), nullable=False),
+    sa.Column('target_id', sa.String(length=255), nullable=False),
+    sa.Column('guild_id', sa.String(length=255), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['feed_id'], ['feed.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'feed_id', 'target_type', 'target_id',
+                        name='uq_channel_binding_user_id_feed_id_target')
+    )
+    op.create_index(op.f('ix_channel_binding_id'), 'channel_binding', ['id'], unique=False)
+    op.create_index('ix_channel_binding_feed_id', 'channel_binding', ['feed_id'], unique=False)
+    op.create_table('delivery',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('target_type', sa.String(length=16), nullable=False),
+    sa.Column('target_id', sa.String(length=255), nullable=False),
+    sa.Column('article_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=16), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+    sa.Column('last_error', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['article_id'], ['article.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('target_type', 'target_id', 'article_id', name='uq_delivery_target_article_id')
+    )
+    op.create_index(op.f('ix_delivery_id'), 'delivery', ['id'], unique=False)
+    op.create_index('ix_delivery_status_next_attempt_at', 'delivery', ['status', 'next_attempt_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_delivery_status_next_attempt_at', table_name='delivery')
+    op.drop_index(op.f('ix_delivery_id'), table_name='delivery')
+    op.drop_table('delivery')
+    op.drop_index('ix_channel_binding_feed_id', table_name='channel_binding')
+    op.drop_index(op.f('ix_channel_binding_id'), table_name='channel_binding')
+    op.drop_table('channel_binding')
@@ -0,0 +1,31 @@
+"""Add feed refresh schedule
+
+Revision ID: ba9c3fe16b1d
+Revises: 33488ba3af26
+Create Date: 2026-10-18 09:12:41.527310
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ba9c3fe16b1d'
+down_revision = '33488ba3af26'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('feed', sa.Column('refresh_interval', sa.Integer(), nullable=True))
+    op.add_column('feed', sa.Column('last_refreshed_at', sa.DateTime(), nullable=True))
+    op.add_column('feed', sa.Column('next_refresh_at', sa.DateTime(), nullable=True))
+    op.create_index(op.f('ix_feed_next_refresh_at'), 'feed', ['next_refresh_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_feed_next_refresh_at'), table_name='feed')
+    with op.batch_alter_table('feed') as batch_op:
+        batch_op.drop_column('next_refresh_at')
+        batch_op.drop_column('last_refreshed_at')
+        batch_op.drop_column('refresh_interval')
@@ -0,0 +1,31 @@
+"""Add feed activity for adaptive polling
+
+Revision ID: bc0ff6f20c0e
+Revises: 47b9f1bedf8b
+Create Date: 2026-10-18 16:20:13.804121
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'bc0ff6f20c0e'
+down_revision = '47b9f1bedf8b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('feed', sa.Column('last_new_entry_at', sa.DateTime(), nullable=True))
+    op.add_column('feed', sa.Column('entry_interval', sa.Integer(), nullable=True))
+    op.add_column('feed', sa.Column('poll_hint', sa.Integer(), nullable=True))
+    op.add_column('feed', sa.Column('error_count', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('feed') as batch_op:
+        batch_op.drop_column('error_count')
+        batch_op.drop_column('poll_hint')
+        batch_op.drop_column('entry_interval')
+        batch_op.drop_column('last_new_entry_at')
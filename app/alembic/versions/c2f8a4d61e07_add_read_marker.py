@@ -0,0 +1,31 @@
+"""Add read marker
+
+Revision ID: c2f8a4d61e07
+Revises: 9e4b2d7c1a58
+Create Date: 2026-10-18 23:04:51.730214
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2f8a4d61e07'
+down_revision = '9e4b2d7c1a58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('read_marker',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('last_read_at', sa.DateTime(), nullable=False),
+    sa.Column('last_read_id', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('read_marker')
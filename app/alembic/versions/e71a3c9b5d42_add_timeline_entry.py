@@ -0,0 +1,40 @@
+"""Add materialized timeline
+
+Revision ID: e71a3c9b5d42
+Revises: c2f8a4d61e07
+Create Date: 2026-10-19 00:21:37.904126
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e71a3c9b5d42'
+down_revision = 'c2f8a4d61e07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('timeline_entry',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('feed_id', sa.Integer(), nullable=False),
+    sa.Column('feed_article_id', sa.Integer(), nullable=False),
+    sa.Column('article_id', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['article_id'], ['article.id'], ),
+    sa.ForeignKeyConstraint(['feed_article_id'], ['feed_article.id'], ),
+    sa.ForeignKeyConstraint(['feed_id'], ['feed.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'feed_id', 'feed_article_id', name='uq_timeline_entry_user_id_feed_article')
+    )
+    op.create_index('ix_timeline_entry_user_id_updated_at', 'timeline_entry',
+                    ['user_id', 'updated_at', 'feed_article_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_timeline_entry_user_id_updated_at', table_name='timeline_entry')
+    op.drop_table('timeline_entry')
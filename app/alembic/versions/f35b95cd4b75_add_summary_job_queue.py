@@ -0,0 +1,41 @@
+"""Add summary job queue
+
+Revision ID: f35b95cd4b75
+Revises: 7ec2ab724cf0
+Create Date: 2026-10-18 14:08:25.611873
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f35b95cd4b75'
+down_revision = '7ec2ab724cf0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('summary_job',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('article_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=16), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+    sa.Column('last_error', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['article_id'], ['article.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('article_id')
+    )
+    op.create_index(op.f('ix_summary_job_id'), 'summary_job', ['id'], unique=False)
+    op.create_index('ix_summary_job_status_next_attempt_at', 'summary_job', ['status', 'next_attempt_at'],
+                    unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_summary_job_status_next_attempt_at', table_name='summary_job')
+    op.drop_index(op.f('ix_summary_job_id'), table_name='summary_job')
+    op.drop_table('summary_job')
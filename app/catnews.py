@@ -1,14 +1,17 @@
+import asyncio
 import logging
 import os
 import discord
 from discord.ext import commands
 from dotenv import load_dotenv
-from typing import Optional
-from app import crud, models, schemas
-from app.database import get_db
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from app import crud, models
+from app.database import session_scope
+from app.scheduler import scheduler
 from app.schemas import FeedCreate, FeedRemove
-from app.utils.aiapi import generate_tags, generate_summary
-from app.utils.message import extract_url_from_string
+from app.summarizer import summarize_article
+from app.utils.message import SendQueue, extract_url_from_string, pack_messages
 
 load_dotenv()
 DISCORD_BOT_TOKEN = os.getenv("DISCORD_API")
@@ -17,6 +20,12 @@ COMMAND_PREFIX = "/"
 
 COMMAND_PREFIX2 = "!"
 bot = commands.Bot(command_prefix="!")
+send_queue = SendQueue()
+
+
+async def respond(ctx, blocks, separator: str = "\n") -> None:
+    """Answer with `blocks` packed into as few messages as fit Discord's limit, paced per channel."""
+    await send_queue.send_all(getattr(ctx, "channel_id", None), ctx.respond, pack_messages(blocks, separator))
 
 
 @bot.slash_command(name="sub", description=f"Subscribes by url. Usage: `{COMMAND_PREFIX}sub <url>`")
@@ -28,13 +37,14 @@ async def sub(ctx, url: str):
     :param url: the url you want to subscribe
     :return:
     """
+    # fetching a new feed can take longer than the 3 seconds Discord waits for a response
+    await ctx.defer()
     url = await handle_url(ctx, url)
 
     if url:
         async def func(db, current_user):
             try:
-                feed = FeedCreate(url=url)
-                subscribed_feed = crud.subscribe_to_feed(feed, current_user, db)
+                subscribed_feed = await scheduler.subscribe(FeedCreate(url=url), current_user, db)
                 if subscribed_feed:
                     message = f"Subscribed to {subscribed_feed.url}"
                 else:
@@ -75,22 +85,96 @@ async def unsub(ctx, url: str):
         await login_check_helper(ctx, func)
 
 
+def binding_target(ctx) -> Tuple[str, str, Optional[str]]:
+    """(target_type, target_id, guild_id) of where a command is used: its channel in a server, the user's DMs otherwise."""
+    guild_id = getattr(ctx, "guild_id", None)
+    if guild_id is None:
+        return "dm", str(ctx.author.id), None
+    return "channel", str(ctx.channel_id), str(guild_id)
+
+
+@bot.slash_command(name="bind",
+                   description=f"Posts new articles of a subscription here. Usage: `{COMMAND_PREFIX}bind <url>`")
+async def bind(ctx, url: str):
+    url = await handle_url(ctx, url)
+
+    if url:
+        async def func(db, current_user):
+            target_type, target_id, guild_id = binding_target(ctx)
+            # the bot would post wherever it's asked to, let only those who run the channel ask
+            if target_type == "channel" and not ctx.channel.permissions_for(ctx.author).manage_channels:
+                await ctx.respond("Binding a feed to a channel needs the Manage Channels permission.")
+                return
+            if crud.bind_feed(url, current_user, target_type, target_id, db, guild_id):
+                message = f"New articles of {url} will be posted here."
+            else:
+                message = f"Subscribe to {url} with `{COMMAND_PREFIX}sub` first."
+            await ctx.respond(message)
+
+        await login_check_helper(ctx, func)
+
+
+@bot.slash_command(name="unbind",
+                   description=f"Stops posting new articles of a feed here. Usage: `{COMMAND_PREFIX}unbind <url>`")
+async def unbind(ctx, url: str):
+    url = await handle_url(ctx, url)
+
+    if url:
+        async def func(db, current_user):
+            target_type, target_id, _ = binding_target(ctx)
+            if crud.unbind_feed(url, current_user, target_type, target_id, db):
+                message = f"New articles of {url} won't be posted here anymore."
+            else:
+                message = f"{url} isn't posted here."
+            await ctx.respond(message)
+
+        await login_check_helper(ctx, func)
+
+
 @bot.slash_command(name="list", description=f"list all subscriptions. Usage: `{COMMAND_PREFIX}list`")
 async def list_subs(ctx):
     async def func(db, current_user):
-        subscriptions = crud.list_subscribed_feeds(current_user, db)
+        subscriptions = crud.list_subscribed_feeds(current_user, db, cached=True)
         if subscriptions:
-            message = "Your subscriptions:\n"
-            for subscription in subscriptions:
-                message += f"- {subscription.title} ({subscription.url})\n"
+            await respond(ctx, ["Your subscriptions:"] + [f"- {subscription.title} ({subscription.url})"
+                                                         for subscription in subscriptions])
         else:
-            message = "You have no subscriptions."
-        await ctx.respond(message)
+            await ctx.respond("You have no subscriptions.")
 
     await login_check_helper(ctx, func)
 
 
-@bot.slash_command(name="news", description="get news by page number. Usage: `/news` or `/news <page_number>`")
+NEWS_PAGE_SIZE = 3
+# user id -> {page number: cursor of that page}, least recently used users are dropped first
+news_page_cursors: "OrderedDict[int, Dict[int, Optional[str]]]" = OrderedDict()
+NEWS_PAGE_CURSOR_USERS = 1024
+
+
+def get_news_page(current_user: models.User, db, page: int) -> [models.Article]:
+    """
+    Page `page` of the user's timeline. Slash commands only carry a page number, so the cursors of the pages
+    reached so far are remembered and a new page is walked to from the nearest known one.
+    """
+    cursors = news_page_cursors.pop(current_user.id, None) or {1: None}
+    news_page_cursors[current_user.id] = cursors
+    if len(news_page_cursors) > NEWS_PAGE_CURSOR_USERS:
+        news_page_cursors.popitem(last=False)
+
+    current = max(known for known in cursors if known <= page)
+    while True:
+        articles, next_cursor = crud.get_feed_article_page(current_user, db, cursor=cursors[current],
+                                                           limit=NEWS_PAGE_SIZE)
+        if next_cursor:
+            cursors[current + 1] = next_cursor
+        if current == page:
+            return articles
+        if not next_cursor:
+            return []
+        current += 1
+
+
+@bot.slash_command(name="news", description="get unread news, or news by page number. "
+                                              "Usage: `/news` or `/news <page_number>`")
 async def get_news(ctx, page: int = 1):
     """
 
@@ -98,22 +182,23 @@ async def get_news(ctx, page: int = 1):
     :param page: the page numbers of news
     :return:
     """
-    # TODO: check discord.ext.commands.errors.CommandInvokeError: Command raised an exception: HTTPException: 400 Bad Request (error code: 50035): Invalid Form Body
-    #    In content: Must be 2000 or fewer in length.
     try:
-        page = int(page)
+        page = max(int(page), 1)
     except Exception:
         page = 1
-    limit = 3
-    skip = limit * (page - 1)
 
     async def func(db, current_user):
         try:
-            articles: [models.Article] = crud.get_feed_articles(current_user, db, skip=skip, limit=limit)
+            unread: [models.Article] = []
+            if page == 1:
+                # what is new since the last visit first, then the latest again
+                unread = crud.get_unread_page(current_user, db, NEWS_PAGE_SIZE)
+            articles: [models.Article] = unread or get_news_page(current_user, db, page)
             if articles:
-                for article in articles:
-                    await ctx.send(f"- {article.title}: {article.url}")
-                await ctx.respond(f"Page {page} finished")
+                await respond(ctx, [f"- {article.title}: {article.url}" for article in articles] +
+                              [f"Page {page} finished"])
+                crud.mark_articles_seen(current_user.id, [article.id for article in articles], db,
+                                        advance_marker=page == 1)
             else:
                 message = "No articles found."
                 await ctx.respond(message)
@@ -126,39 +211,29 @@ async def get_news(ctx, page: int = 1):
 
 
 @bot.slash_command(name="cats", description="cat summaries of news by page number")
-async def get_news(ctx, page: int = 1):
+async def get_cats(ctx, page: int = 1):
     """
 
     :param ctx:
     :param page: the page numbers of news
     :return:
     """
-    # TODO: check discord.ext.commands.errors.CommandInvokeError:
-    #    In content: Must be 2000 or fewer in length.
+    # "thinking..." until the first summary is sent as a followup
+    await ctx.defer()
     try:
-        page = int(page)
+        page = max(int(page), 1)
     except Exception:
         page = 1
-    limit = 3
-    skip = limit * (page - 1)
 
     async def func(db, current_user):
         try:
-            articles: [models.Article] = crud.get_feed_articles(current_user, db, skip=skip, limit=limit)
+            articles: [models.Article] = get_news_page(current_user, db, page)
             if articles:
-                await ctx.respond("Please waiting...")
-                for article in articles:
-                    await ctx.send(f"{article.title}: {article.url}")
-                    try:
-                        summary_obj, tags = await handle_tag_summary(article, db)
-                        await ctx.send(
-                            f"Title: {article.title}\n\nTags: {', '.join(tags)}\n\nSummary: {summary_obj.content}")
-                    except Exception as e:
-                        message = "Error when summaries articles."
-                        logging.error(message)
-                        logging.error(e)
-                        await ctx.send(message)
-                await ctx.send(f"Page {page} finished")
+                # each summary as soon as it is ready, the fastest first
+                async for article, result in iter_tag_summaries(articles, db):
+                    await respond(ctx, [cat_message(article, result)])
+                await respond(ctx, [f"Page {page} finished"])
+                crud.mark_articles_seen(current_user.id, [article.id for article in articles], db)
             else:
                 message = "No articles found."
                 await ctx.respond(message)
@@ -170,17 +245,49 @@ async def get_news(ctx, page: int = 1):
     await login_check_helper(ctx, func)
 
 
-async def handle_tag_summary(article, db):
-    tags = crud.get_tags_by_article_id(db, article_id=article.id)
-    summary_obj = crud.get_summary_by_article_id(db, article_id=article.id)
-    if not tags:
-        tags = generate_tags(article.content)
-        crud.associate_tags_with_article(db, article, tags)
-    if not summary_obj:
-        summary = generate_summary(article.content)
-        summary_create = schemas.SummaryCreate(content=summary)
-        summary_obj = crud.create_summary(db, summary_create, article_id=article.id)
-    return summary_obj, tags
+async def handle_tag_summary(article, db, bundle=None):
+    # a pure database read for articles already processed by the summary workers
+    return await summarize_article(article, db, bundle)
+
+
+def cat_message(article, result) -> str:
+    """
+
+    :param result: (summary, tags) of `article`, the exception raised getting them, or None while a summary
+        worker is on it
+    """
+    if result is None:
+        return f"{article.title}: {article.url}\nBeing summarized, try again shortly."
+    if isinstance(result, Exception):
+        message = "Error when summaries articles."
+        logging.error(message)
+        logging.error(result)
+        return f"{article.title}: {article.url}\n{message}"
+    summary_obj, tags = result
+    return f"Title: {article.title}\n{article.url}\n\nTags: {', '.join(tags)}\n\nSummary: {summary_obj.content}"
+
+
+async def iter_tag_summaries(articles, db):
+    """
+    `handle_tag_summary` for every article of a page at once, `ai_client` bounds the completions in flight.
+    The stored tags and summaries of the page are loaded together. Yields `(article, result)` as each article is
+    done, with a failure in place of the (summary, tags) instead of being raised, and None for the articles
+    a summary worker has claimed, rather than a second completion of the same article.
+    """
+    bundles = {bundle.article.id: bundle for bundle in crud.get_article_bundles([a.id for a in articles], db)}
+    missing = [a.id for a in articles if a.id not in bundles or not bundles[a.id].summary or not bundles[a.id].tags]
+    claimed = crud.get_claimed_summary_article_ids(missing, db) if missing else set()
+
+    async def one(article):
+        if article.id in claimed:
+            return article, None
+        try:
+            return article, await handle_tag_summary(article, db, bundles.get(article.id))
+        except Exception as e:
+            return article, e
+
+    for done in asyncio.as_completed([one(article) for article in articles]):
+        yield await done
 
 
 # TODO: Usage: `{COMMAND_PREFIX2}cat` and reply to a message containing the article URL.
@@ -188,6 +295,8 @@ async def handle_tag_summary(article, db):
                    description=f"get tags and summary of an article.")
 async def get_tags_and_summary(ctx, url):
     ref_message = url
+    # the completion can take longer than the 3 seconds Discord waits for a response
+    await ctx.defer()
 
     # TODO: extract check url logic for sub and unsub
     url = extract_url_from_string(ref_message)
@@ -199,8 +308,9 @@ async def get_tags_and_summary(ctx, url):
                 article: models.Article = crud.get_article_by_url(db, url=url)
                 if article:
                     summary_obj, tags = await handle_tag_summary(article, db)
-                    await ctx.respond(
-                        f"Title: {article.title}\n\nTags: {', '.join(tags)}\n\nSummary: {summary_obj.content}")
+                    await respond(ctx, [f"Title: {article.title}\n\nTags: {', '.join(tags)}\n\n"
+                                        f"Summary: {summary_obj.content}"])
+                    crud.mark_articles_seen(current_user.id, [article.id], db)
                 else:
                     message = "Article should be fetch by `news` command first."
                     await ctx.respond(message)
@@ -213,15 +323,15 @@ async def get_tags_and_summary(ctx, url):
 
 
 async def login_check_helper(ctx, func) -> None:
-    db = next(get_db())
-    user_id = str(ctx.author.id)
-    current_user = crud.get_user_by_discord_id(user_id, db)
-    if current_user:
-        await func(db, current_user)
-    else:
-        message = "Please signup with discord first. https://discord-rss-backend-production.up.railway.app/auth/discord"
-        await ctx.respond(message)
-    # return message
+    # the session, and its pooled connection, is released as soon as the command is done
+    with session_scope() as db:
+        user_id = str(ctx.author.id)
+        current_user = crud.get_user_by_subject("Discord", user_id, db)
+        if current_user:
+            await func(db, current_user)
+            return
+    message = "Please signup with discord first. https://discord-rss-backend-production.up.railway.app/auth/discord"
+    await ctx.respond(message)
 
 
 async def handle_url(ctx, text) -> Optional[str]:
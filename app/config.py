@@ -15,7 +15,67 @@ class Settings(BaseSettings):
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     DATABASE_URL: str = os.getenv("DATABASE_URL")
     OPEN_AI_KEY: str = os.getenv("OPEN_AI_KEY")
+    OPEN_AI_BASE_URL: str = os.getenv("OPEN_AI_BASE_URL", "https://api.openai.com/v1")
+    OPEN_AI_MODEL: str = os.getenv("OPEN_AI_MODEL", "text-davinci-003")
+    # completions in flight at once, across all commands
+    OPEN_AI_CONCURRENCY: int = int(os.getenv("OPEN_AI_CONCURRENCY", 4))
+    # token budgets of the article text: truncated to OPEN_AI_INPUT_TOKENS, longer than OPEN_AI_MAP_REDUCE_TOKENS
+    # it is summarized in chunks of OPEN_AI_INPUT_TOKENS first, at most OPEN_AI_MAX_CHUNKS of them
+    OPEN_AI_INPUT_TOKENS: int = int(os.getenv("OPEN_AI_INPUT_TOKENS", 1500))
+    OPEN_AI_MAP_REDUCE_TOKENS: int = int(os.getenv("OPEN_AI_MAP_REDUCE_TOKENS", 4500))
+    OPEN_AI_MAX_CHUNKS: int = int(os.getenv("OPEN_AI_MAX_CHUNKS", 8))
+    OPEN_AI_TIMEOUT: float = float(os.getenv("OPEN_AI_TIMEOUT", 60))
+    # Summarize new articles in the background right after ingestion
+    SUMMARIZE_ON_INGEST: bool = os.getenv("SUMMARIZE_ON_INGEST", "false").lower() in ("1", "true", "yes")
+    SUMMARY_WORKERS: int = int(os.getenv("SUMMARY_WORKERS", 2))
+    SUMMARY_RATE_PER_MINUTE: float = float(os.getenv("SUMMARY_RATE_PER_MINUTE", 20))
+    SUMMARY_MAX_ATTEMPTS: int = int(os.getenv("SUMMARY_MAX_ATTEMPTS", 5))
+    # seconds, doubled on every failed attempt
+    SUMMARY_RETRY_BACKOFF: int = int(os.getenv("SUMMARY_RETRY_BACKOFF", 60))
+    # Tags and summaries by content hash: entries kept in memory, days kept in the database since last use
+    SUMMARY_CACHE_SIZE: int = int(os.getenv("SUMMARY_CACHE_SIZE", 1024))
+    SUMMARY_CACHE_TTL_DAYS: int = int(os.getenv("SUMMARY_CACHE_TTL_DAYS", 30))
+    # Push of new articles to bound Discord channels: channels sent to at once, articles per channel and round
+    DELIVERY_CONCURRENCY: int = int(os.getenv("DELIVERY_CONCURRENCY", 20))
+    DELIVERY_BATCH_SIZE: int = int(os.getenv("DELIVERY_BATCH_SIZE", 20))
+    DELIVERY_MAX_ATTEMPTS: int = int(os.getenv("DELIVERY_MAX_ATTEMPTS", 8))
+    # seconds, doubled on every failed attempt
+    DELIVERY_RETRY_BACKOFF: int = int(os.getenv("DELIVERY_RETRY_BACKOFF", 30))
     DISCORD_REDIRECT_URL: str = os.getenv("DISCORD_REDIRECT_URL")
+    # seconds users and their subscription lists stay cached in each process, 0 to always query
+    USER_CACHE_TTL: float = float(os.getenv("USER_CACHE_TTL", 60))
+    USER_CACHE_SIZE: int = int(os.getenv("USER_CACHE_SIZE", 1024))
+    # "query": timeline pages read from the feed_article rows of the subscribed feeds, "materialized": from the
+    # timeline_entry rows written for every subscriber at ingestion, faster to read with hundreds of subscriptions
+    # but one row per subscriber and article to write. Switching fills or empties the table at the next startup.
+    TIMELINE_MODE: str = os.getenv("TIMELINE_MODE", "query")
+    # Background feed refresher
+    # poll interval of a feed without history, and the bounds of the adaptive interval
+    FEED_REFRESH_INTERVAL: int = int(os.getenv("FEED_REFRESH_INTERVAL", 15 * 60))
+    FEED_REFRESH_MIN_INTERVAL: int = int(os.getenv("FEED_REFRESH_MIN_INTERVAL", 5 * 60))
+    FEED_REFRESH_MAX_INTERVAL: int = int(os.getenv("FEED_REFRESH_MAX_INTERVAL", 24 * 60 * 60))
+    FEED_SCHEDULER_TICK: int = int(os.getenv("FEED_SCHEDULER_TICK", 30))
+    # seconds after a refresh during which `/articles?refresh=true` doesn't fetch the feed again
+    FEED_FRESHNESS_TTL: int = int(os.getenv("FEED_FRESHNESS_TTL", 60))
+    # WebSub: public url of the `/websub` callback route, feeds are only polled when empty
+    WEBSUB_CALLBACK_URL: str = os.getenv("WEBSUB_CALLBACK_URL", "")
+    WEBSUB_LEASE_SECONDS: int = int(os.getenv("WEBSUB_LEASE_SECONDS", 10 * 24 * 60 * 60))
+    # seconds before a lease ends to renew it, also the wait before asking again a hub that didn't verify
+    WEBSUB_RENEW_BEFORE: int = int(os.getenv("WEBSUB_RENEW_BEFORE", 24 * 60 * 60))
+    # Feed fetching
+    FEED_FETCH_TIMEOUT: float = float(os.getenv("FEED_FETCH_TIMEOUT", 10))
+    FEED_FETCH_MAX_CONNECTIONS: int = int(os.getenv("FEED_FETCH_MAX_CONNECTIONS", 100))
+    FEED_FETCH_PER_HOST: int = int(os.getenv("FEED_FETCH_PER_HOST", 4))
+    # bytes of a response body above which it is parsed as it streams in, stopping at the entries already stored
+    FEED_STREAM_THRESHOLD: int = int(os.getenv("FEED_STREAM_THRESHOLD", 1024 * 1024))
+    # entries kept from one streamed response at most, the newest first
+    FEED_STREAM_MAX_ENTRIES: int = int(os.getenv("FEED_STREAM_MAX_ENTRIES", 1000))
+    # requests per second and burst to one host, 0 for no rate limit
+    FEED_FETCH_HOST_RATE: float = float(os.getenv("FEED_FETCH_HOST_RATE", 5))
+    FEED_FETCH_HOST_BURST: int = int(os.getenv("FEED_FETCH_HOST_BURST", 10))
+    # a host is skipped for FEED_FETCH_BREAKER_COOLDOWN seconds after FEED_FETCH_BREAKER_THRESHOLD failures in a row
+    FEED_FETCH_BREAKER_THRESHOLD: int = int(os.getenv("FEED_FETCH_BREAKER_THRESHOLD", 5))
+    FEED_FETCH_BREAKER_COOLDOWN: float = float(os.getenv("FEED_FETCH_BREAKER_COOLDOWN", 300))
 
 
 settings = Settings()
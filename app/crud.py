@@ -1,45 +1,241 @@
-from typing import List, Optional
+import json
+from collections import OrderedDict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
 
 from passlib.context import CryptContext
-from sqlalchemy import desc
-from sqlalchemy.orm import Session
-from app import models, schemas
-from datetime import datetime, timedelta
-import feedparser
+from sqlalchemy import delete, desc, func, insert, inspect, literal, or_, select, true, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, selectinload
+from app import models, schemas, websub
+from app.config import settings
+from datetime import datetime, timedelta, timezone
 
 from app.models import Article, Tag
 from app.schemas import UserCreate, Summary
+from app.utils.cursor import decode_cursor, encode_cursor
+from app.utils import polling
 from app.utils.dateutils import date_from_string
+from app.utils.text import normalize_tag
+from app.utils.ttlcache import TTLCache
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+TAG_ID_CACHE_SIZE = 1024
+# name -> id of the most recently used tags, tags are never renamed or deleted
+tag_id_cache: "OrderedDict[str, int]" = OrderedDict()
+# (token source, subject) -> user, for the lookup behind every authenticated request and bot command
+user_cache = TTLCache(settings.USER_CACHE_SIZE, settings.USER_CACHE_TTL)
+# user id -> subscribed feeds, dropped by (un)subscribing
+subscription_cache = TTLCache(settings.USER_CACHE_SIZE, settings.USER_CACHE_TTL)
+
+
+def _chunks(items: list, size: int = 500):
+    # keeps IN (...) lists under SQLite's bound parameter limit
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _insert_ignore(db: Session, model):
+    """`INSERT ... ON CONFLICT DO NOTHING` for the dialect of `db`."""
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(model).on_conflict_do_nothing()
+    if dialect == "sqlite":
+        return sqlite.insert(model).on_conflict_do_nothing()
+    return insert(model)
+
+
+def _article_from_entry(entry, now: datetime) -> Optional[dict]:
+    url = entry.get("link")
+    if not url:
+        return None
+    try:
+        published_at = date_from_string(entry.get("published") or entry.get("updated"))
+    except (TypeError, ValueError, OverflowError):
+        # missing or malformed, one bad date doesn't cost the rest of the feed
+        published_at = now
+    return dict(
+        title=entry.get("title") or url,
+        url=url,
+        content=entry.get("summary"),
+        published_at=published_at,
+        created_at=now,
+        updated_at=now,
+    )
 
-def update_feed_articles(feed: models.Feed, db: Session):
-    parsed_feed = feedparser.parse(feed.url)
-    for entry in parsed_feed.entries:
-        db_article = db.query(models.Article).filter(models.Article.url == entry.link).first()
-        if db_article is None:
-            db_article = models.Article(
-                title=entry.title,
-                url=entry.link,
-                content=entry.summary,
-                published_at=date_from_string(entry.published),
-                created_at=datetime.utcnow(),
-                updated_at=datetime.utcnow(),
-            )
-            db.add(db_article)
-            db.commit()
-            db.refresh(db_article)
-
-            feed_article = models.FeedArticle(
-                feed_id=feed.id,
-                article_id=db_article.id,
-                created_at=datetime.utcnow(),
-                updated_at=datetime.utcnow(),
-            )
-            db.add(feed_article)
-            db.commit()
-            db.refresh(feed_article)
+
+def ingest_feed_entries(feed: models.Feed, entries: list, db: Session) -> List[int]:
+    """
+    Store the articles of `entries` and link them to `feed` in a fixed number of statements:
+    one lookup of the known urls, one bulk insert of the new articles, one lookup of the existing
+    links and one bulk insert of the new links, then the fan-out of the new links to the channels
+    the feed is bound to. The caller commits.
+
+    :return: ids of the newly inserted articles
+    """
+    now = datetime.utcnow()
+    rows = {}
+    for entry in entries:
+        row = _article_from_entry(entry, now)
+        if row is not None:
+            rows.setdefault(row["url"], row)
+    if not rows:
+        return []
+    urls = list(rows)
+
+    def article_ids_by_url():
+        ids = {}
+        for chunk in _chunks(urls):
+            ids.update(db.execute(select(models.Article.url, models.Article.id)
+                                  .where(models.Article.url.in_(chunk))).all())
+        return ids
+
+    known = article_ids_by_url()
+    new_rows = [row for url, row in rows.items() if url not in known]
+    if new_rows:
+        db.execute(_insert_ignore(db, models.Article), new_rows)
+    article_ids = article_ids_by_url() if new_rows else known
+    new_article_ids = [article_ids[url] for url in urls if url not in known and url in article_ids]
+
+    linked = set()
+    for chunk in _chunks(list(article_ids.values())):
+        linked.update(db.scalars(select(models.FeedArticle.article_id).where(
+            models.FeedArticle.feed_id == feed.id, models.FeedArticle.article_id.in_(chunk))).all())
+    # feeds list the newest entries first, link them last
+    links = [
+        dict(feed_id=feed.id, article_id=article_ids[url], created_at=now, updated_at=now)
+        for url in reversed(urls) if url in article_ids and article_ids[url] not in linked
+    ]
+    if links:
+        db.execute(_insert_ignore(db, models.FeedArticle), links)
+        enqueue_deliveries(feed.id, [link["article_id"] for link in links], db)
+        if settings.TIMELINE_MODE == "materialized":
+            fill_timelines(db, feed_id=feed.id, article_ids=[link["article_id"] for link in links])
+    if settings.SUMMARIZE_ON_INGEST:
+        enqueue_summary_jobs(new_article_ids, db)
+    db.flush()
+    return new_article_ids
+
+
+def get_feed_article_urls(feed: models.Feed, urls: List[str], db: Session) -> Set[str]:
+    """The `urls` among the articles of `feed`."""
+    stored = set()
+    for chunk in _chunks(urls):
+        stored.update(db.scalars(select(models.Article.url).join(models.FeedArticle).where(
+            models.FeedArticle.feed_id == feed.id, models.Article.url.in_(chunk))).all())
+    return stored
+
+
+def get_due_feeds(db: Session, now: datetime) -> List[models.Feed]:
+    return (
+        db.query(models.Feed)
+        .filter(or_(models.Feed.next_refresh_at.is_(None), models.Feed.next_refresh_at <= now))
+        # pushed by their hub, polled again once the lease runs out
+        .filter(or_(models.Feed.websub_lease_expires_at.is_(None), models.Feed.websub_lease_expires_at <= now))
+        .order_by(models.Feed.next_refresh_at)
+        .all()
+    )
+
+
+def schedule_next_refresh(feed: models.Feed, db: Session, failed: bool = False):
+    """Plan the next poll of `feed` from its activity, see `polling.next_poll_interval`."""
+    now = datetime.utcnow()
+    feed.error_count = (feed.error_count or 0) + 1 if failed else 0
+    if feed.refresh_interval:
+        interval = polling.next_poll_interval(feed.refresh_interval, feed.refresh_interval,
+                                              max(feed.refresh_interval, settings.FEED_REFRESH_MAX_INTERVAL),
+                                              error_count=feed.error_count)
+    else:
+        interval = polling.next_poll_interval(
+            settings.FEED_REFRESH_INTERVAL, settings.FEED_REFRESH_MIN_INTERVAL, settings.FEED_REFRESH_MAX_INTERVAL,
+            feed.entry_interval, feed.last_new_entry_at, feed.poll_hint, feed.error_count, now)
+    feed.last_refreshed_at = now
+    feed.next_refresh_at = now + timedelta(seconds=interval)
+    db.commit()
+
+
+def observe_feed_activity(feed: models.Feed, parsed_feed, new_entries: int, now: datetime):
+    """Update the activity of `feed` the polling schedule is based on, after a refresh found `new_entries`."""
+    feed.poll_hint = polling.hint_interval(parsed_feed.get("feed", {}))
+    if not new_entries:
+        return
+    if feed.last_new_entry_at is None:
+        # first refresh: the entries' own dates are all there is
+        published = []
+        for entry in parsed_feed.entries:
+            try:
+                date = date_from_string(entry.get("published") or entry.get("updated"))
+            except (TypeError, ValueError, OverflowError):
+                continue
+            published.append(date.astimezone(timezone.utc).replace(tzinfo=None) if date.tzinfo else date)
+        feed.entry_interval = polling.initial_entry_interval(published)
+        feed.last_new_entry_at = min(max(published), now) if published else now
+    else:
+        feed.entry_interval = polling.update_entry_interval(feed.entry_interval, feed.last_new_entry_at, new_entries,
+                                                            now)
+        feed.last_new_entry_at = now
+
+
+def observe_websub_hub(feed: models.Feed, parsed_feed):
+    """Keep track of the WebSub hub `feed` advertises, a new hub or topic has to be subscribed to again."""
+    found = websub.discover(parsed_feed)
+    if found is None:
+        # a lease still running ends on its own, it just isn't renewed
+        feed.websub_hub = feed.websub_topic = None
+        return
+    hub, topic = found[0], found[1] or feed.url
+    if (hub, topic) != (feed.websub_hub, feed.websub_topic):
+        feed.websub_hub, feed.websub_topic = hub, topic
+        feed.websub_secret = websub.new_secret()
+        feed.websub_requested_at = feed.websub_lease_expires_at = None
+
+
+def refresh_feed(feed: models.Feed, db: Session, parsed_feed, etag: Optional[str] = None,
+                 last_modified: Optional[str] = None, content_hash: Optional[str] = None) -> List[int]:
+    """
+
+    :param parsed_feed: the fetched document, see `app.fetcher.FeedFetcher`
+    """
+    # entries and the next schedule are committed in one transaction by schedule_next_refresh
+    new_article_ids = ingest_feed_entries(feed, parsed_feed.entries, db)
+    observe_feed_activity(feed, parsed_feed, len(new_article_ids), datetime.utcnow())
+    observe_websub_hub(feed, parsed_feed)
+    feed.etag = etag
+    feed.last_modified = last_modified
+    feed.content_hash = content_hash
+    schedule_next_refresh(feed, db)
+    return new_article_ids
+
+
+def ingest_pushed_feed(feed: models.Feed, parsed_feed, db: Session) -> List[int]:
+    """Store the entries a WebSub hub pushed for `feed`, usually only the new ones."""
+    new_article_ids = ingest_feed_entries(feed, parsed_feed.entries, db)
+    observe_feed_activity(feed, parsed_feed, len(new_article_ids), datetime.utcnow())
+    db.commit()
+    return new_article_ids
+
+
+def get_websub_renewals(db: Session, now: datetime) -> List[models.Feed]:
+    """
+    Feeds with a hub whose lease is missing or ends within `WEBSUB_RENEW_BEFORE`,
+    leaving out those whose last request is still waiting for the hub's verification.
+    """
+    window = timedelta(seconds=settings.WEBSUB_RENEW_BEFORE)
+    return (
+        db.query(models.Feed)
+        .filter(models.Feed.websub_hub.is_not(None))
+        .filter(or_(models.Feed.websub_lease_expires_at.is_(None),
+                    models.Feed.websub_lease_expires_at <= now + window))
+        .filter(or_(models.Feed.websub_requested_at.is_(None), models.Feed.websub_requested_at <= now - window))
+        .all()
+    )
+
+
+def clear_websub_requests(feed_ids: List[int], db: Session) -> None:
+    """Forget the requests of `feed_ids` the hub refused or never got, so `get_websub_renewals` retries them."""
+    db.query(models.Feed).filter(models.Feed.id.in_(feed_ids)).update({models.Feed.websub_requested_at: None},
+                                                                      synchronize_session=False)
+    db.commit()
 
 
 def get_password_hash(password: str) -> str:
@@ -82,6 +278,32 @@ def get_user_by_discord_id(discord_id: str, db: Session) -> models.User:
     return db.query(models.User).filter(models.User.discord_id == discord_id).first()
 
 
+def detached(instance):
+    """
+    A copy of the column values of `instance` bound to no session, to be shared between sessions by the caches.
+    Read it, don't add it to a session.
+    """
+    model = type(instance)
+    return model(**{column.key: getattr(instance, column.key) for column in inspect(model).column_attrs})
+
+
+USER_LOOKUPS = {"Password": get_user_by_email, "Discord": get_user_by_discord_id, "Github": get_user_by_github_id}
+
+
+def get_user_by_subject(token_source: str, subject: str, db: Session) -> Optional[models.User]:
+    """
+    The user a token of `token_source` ("Password", "Discord" or "Github") was issued to, through `user_cache`.
+    """
+    key = (token_source, subject)
+    user = user_cache.get(key)
+    if user is None and token_source in USER_LOOKUPS:
+        user = USER_LOOKUPS[token_source](subject, db)
+        if user is not None:
+            user = detached(user)
+            user_cache.set(key, user)
+    return user
+
+
 def create_user(user: schemas.UserCreate, db: Session) -> models.User:
     hashed_password = pwd_context.hash(user.password)
     db_user = models.User(
@@ -140,23 +362,42 @@ def update_discord_token(user_id: int, token: dict, db: Session):
     db.refresh(oauth2_provider)
 
 
-def subscribe_to_feed(feed: schemas.FeedCreate, user: models.User, db: Session):
+def get_feed_by_url(url: str, db: Session) -> models.Feed:
+    return db.query(models.Feed).filter(models.Feed.url == url).first()
+
+
+def subscribe_to_feed(feed: schemas.FeedCreate, user: models.User, db: Session, parsed_feed):
+    """
+
+    :param parsed_feed: the already fetched document of a new feed, see `app.fetcher.FeedFetcher.fetch_feed`,
+        None for a stored one
+    :raise ValueError: the feed isn't stored and `parsed_feed` is None, nothing is fetched from here
+    """
     # Check if the feed exists, create it if not
-    db_feed = db.query(models.Feed).filter(models.Feed.url == feed.url).first()
+    db_feed = get_feed_by_url(feed.url, db)
     if db_feed is None:
-        parsed_feed = feedparser.parse(feed.url)
+        if parsed_feed is None:
+            raise ValueError(f"{feed.url} isn't stored yet, fetch it first")
         db_feed = models.Feed(title=parsed_feed.feed.title, url=feed.url, created_at=datetime.utcnow(),
                               updated_at=datetime.utcnow())
         db.add(db_feed)
         db.commit()
         db.refresh(db_feed)
-
-    # Subscribe the user to the feed
-    subscription = models.UserFeedSubscription(user_id=user.id, feed_id=db_feed.id, created_at=datetime.utcnow(),
-                                               updated_at=datetime.utcnow())
-    db.add(subscription)
-    db.commit()
-    db.refresh(subscription)
+        # We already hold the parsed document, so store its entries now instead of waiting for the scheduler
+        refresh_feed(db_feed, db, parsed_feed)
+
+    # Subscribe the user to the feed, (user_id, feed_id) is unique
+    subscription = db.query(models.UserFeedSubscription).filter(models.UserFeedSubscription.user_id == user.id,
+                                                                models.UserFeedSubscription.feed_id == db_feed.id).first()
+    if subscription is None:
+        subscription = models.UserFeedSubscription(user_id=user.id, feed_id=db_feed.id, created_at=datetime.utcnow(),
+                                                   updated_at=datetime.utcnow())
+        db.add(subscription)
+        if settings.TIMELINE_MODE == "materialized":
+            db.flush()
+            fill_timelines(db, user_id=user.id, feed_id=db_feed.id)
+        db.commit()
+        subscription_cache.invalidate(user.id)
     return db_feed
 
 
@@ -167,37 +408,390 @@ def unsubscribe_from_feed(feed: schemas.FeedRemove, user: models.User, db: Sessi
                                                                     models.UserFeedSubscription.feed_id == db_feed.id).first()
         if subscription is not None:
             db.delete(subscription)
+            # nothing is pushed from a feed the user no longer follows
+            db.query(models.ChannelBinding).filter(models.ChannelBinding.user_id == user.id,
+                                                   models.ChannelBinding.feed_id == db_feed.id).delete()
+            db.query(models.TimelineEntry).filter(models.TimelineEntry.user_id == user.id,
+                                                  models.TimelineEntry.feed_id == db_feed.id).delete()
+            db.execute(unbound_deliveries_statement(db_feed.id))
             db.commit()
+            subscription_cache.invalidate(user.id)
             return db_feed
     return None
 
 
-def list_subscribed_feeds(user: models.User, db: Session):
+def list_subscribed_feeds(user: models.User, db: Session, cached: bool = False):
+    """
+
+    :param cached: read through `subscription_cache`, the feeds are then detached copies
+    """
+    if cached:
+        feeds = subscription_cache.get(user.id)
+        if feeds is not None:
+            return feeds
     subscriptions = db.query(models.Feed).join(models.UserFeedSubscription).filter(
         models.UserFeedSubscription.user_id == user.id).all()
+    if cached:
+        subscriptions = [detached(feed) for feed in subscriptions]
+        subscription_cache.set(user.id, subscriptions)
     return subscriptions
 
 
-def get_feed_articles(user: models.User, db: Session, skip: int = 0, limit: int = 20) -> [Article]:
-    feeds = list_subscribed_feeds(user, db)
-    feed_ids = [feed.id for feed in feeds]
+def bind_feed(url: str, user: models.User, target_type: str, target_id: str, db: Session,
+              guild_id: Optional[str] = None) -> Optional[models.ChannelBinding]:
+    """
+    Push the articles of a subscribed feed to a channel or DM from now on, see app/delivery.py.
+
+    :param target_type: "channel" or "dm"
+    :return: None if `user` isn't subscribed to `url`
+    """
+    feed = db.query(models.Feed).join(models.UserFeedSubscription).filter(
+        models.Feed.url == url, models.UserFeedSubscription.user_id == user.id).first()
+    if feed is None:
+        return None
+    binding = db.query(models.ChannelBinding).filter(
+        models.ChannelBinding.user_id == user.id, models.ChannelBinding.feed_id == feed.id,
+        models.ChannelBinding.target_type == target_type, models.ChannelBinding.target_id == target_id).first()
+    if binding is None:
+        now = datetime.utcnow()
+        binding = models.ChannelBinding(user_id=user.id, feed_id=feed.id, target_type=target_type,
+                                        target_id=target_id, guild_id=guild_id, created_at=now, updated_at=now)
+        db.add(binding)
+        db.commit()
+    return binding
+
+
+def unbind_feed(url: str, user: models.User, target_type: str, target_id: str, db: Session) -> bool:
+    feed_id = db.scalar(select(models.Feed.id).where(models.Feed.url == url))
+    count = db.query(models.ChannelBinding).filter(
+        models.ChannelBinding.user_id == user.id, models.ChannelBinding.feed_id == feed_id,
+        models.ChannelBinding.target_type == target_type, models.ChannelBinding.target_id == target_id,
+    ).delete(synchronize_session=False)
+    if count:
+        db.execute(unbound_deliveries_statement(feed_id))
+    db.commit()
+    return count > 0
+
+
+def unbound_deliveries_statement(feed_id: int):
+    """Drop the pending deliveries of the feed to targets it's no longer bound to, by anyone."""
+    bound = select(models.ChannelBinding.id).where(
+        models.ChannelBinding.feed_id == feed_id, models.ChannelBinding.target_type == models.Delivery.target_type,
+        models.ChannelBinding.target_id == models.Delivery.target_id)
+    return delete(models.Delivery).where(models.Delivery.feed_id == feed_id, models.Delivery.status == "pending",
+                                         ~bound.exists())
+
+
+def enqueue_deliveries(feed_id: int, article_ids: List[int], db: Session):
+    """
+    Queue `article_ids`, newly linked to the feed, for every channel and DM the feed is bound to.
+    Articles already queued for a target are skipped. The caller commits.
+    """
+    targets = db.execute(select(models.ChannelBinding.target_type, models.ChannelBinding.target_id)
+                         .where(models.ChannelBinding.feed_id == feed_id).distinct()).all()
+    if not targets or not article_ids:
+        return
+    now = datetime.utcnow()
+    deliveries = [
+        dict(target_type=target_type, target_id=target_id, article_id=article_id, feed_id=feed_id, status="pending",
+             attempts=0, next_attempt_at=now, created_at=now, updated_at=now)
+        for target_type, target_id in targets for article_id in article_ids
+    ]
+    for chunk in _chunks(deliveries):
+        db.execute(_insert_ignore(db, models.Delivery), chunk)
+
+
+def claim_deliveries(db: Session, now: datetime, targets: int, batch_size: int,
+                     busy: Iterable[Tuple[str, str]] = ()) -> Dict[Tuple[str, str], List[Tuple[int, Article]]]:
+    """
+    The due deliveries of up to `targets` targets, at most `batch_size` each, marked sending.
+    Targets are taken round-robin between the feeds they have deliveries of, each feed's in the order of their
+    oldest due delivery, so a feed bound to thousands of channels doesn't keep the others waiting.
+
+    :param busy: targets still being sent to, left out so the messages of a target stay in order
+    :return: (target_type, target_id) -> [(delivery id, detached article)]
+    """
+    busy = set(busy)
+    due = (models.Delivery.status == "pending", models.Delivery.next_attempt_at <= now)
+    firsts = (
+        select(models.Delivery.feed_id, models.Delivery.target_type, models.Delivery.target_id,
+               func.min(models.Delivery.id).label("first_id")).where(*due)
+        .group_by(models.Delivery.feed_id, models.Delivery.target_type, models.Delivery.target_id)
+        .subquery()
+    )
+    turns = select(firsts.c.target_type, firsts.c.target_id, firsts.c.first_id, func.row_number().over(
+        partition_by=firsts.c.feed_id, order_by=firsts.c.first_id).label("turn")).subquery()
+    candidates = db.execute(
+        select(turns.c.target_type, turns.c.target_id).order_by(turns.c.turn, turns.c.first_id)
+        .limit(targets + len(busy))
+    ).all()
+    batches = {}
+    for target in candidates:
+        target = tuple(target)
+        # a target of several feeds comes up once per feed
+        if target in busy or target in batches:
+            continue
+        if len(batches) == targets:
+            break
+        rows = db.execute(
+            select(models.Delivery.id, Article).join(Article)
+            .where(*due, models.Delivery.target_type == target[0], models.Delivery.target_id == target[1])
+            .order_by(models.Delivery.id).limit(batch_size)
+        ).all()
+        db.execute(update(models.Delivery).where(models.Delivery.id.in_([delivery_id for delivery_id, _ in rows]))
+                   .values(status="sending", updated_at=now))
+        # in the order they were published
+        rows = sorted(rows, key=lambda row: (row[1].published_at, row[0]))
+        batches[target] = [(delivery_id, detached(article)) for delivery_id, article in rows]
+    db.commit()
+    return batches
+
+
+def complete_deliveries(delivery_ids: List[int], db: Session):
+    db.execute(update(models.Delivery).where(models.Delivery.id.in_(delivery_ids)).values(
+        status="sent", attempts=models.Delivery.attempts + 1, last_error=None, updated_at=datetime.utcnow()))
+    db.commit()
+
+
+def fail_deliveries(delivery_ids: List[int], error: str, db: Session) -> int:
+    """
+    Retry with exponential backoff until settings.DELIVERY_MAX_ATTEMPTS.
+
+    :return: deliveries given up on
+    """
+    now = datetime.utcnow()
+    failed = 0
+    for delivery in db.query(models.Delivery).filter(models.Delivery.id.in_(delivery_ids)):
+        delivery.attempts += 1
+        delivery.last_error = error
+        delivery.updated_at = now
+        if delivery.attempts >= settings.DELIVERY_MAX_ATTEMPTS:
+            delivery.status = "failed"
+            failed += 1
+        else:
+            delivery.status = "pending"
+            delivery.next_attempt_at = now + timedelta(
+                seconds=settings.DELIVERY_RETRY_BACKOFF * 2 ** (delivery.attempts - 1))
+    db.commit()
+    return failed
 
-    for feed in feeds:
-        update_feed_articles(feed, db)
 
-    articles = (
-        db.query(models.Article)
+def reset_sending_deliveries(db: Session) -> int:
+    """Deliveries a previous process was sending when it stopped are pending again, and sent again."""
+    count = (
+        db.query(models.Delivery)
+        .filter(models.Delivery.status == "sending")
+        .update({models.Delivery.status: "pending"})
+    )
+    db.commit()
+    return count
+
+
+def fill_timelines(db: Session, user_id: Optional[int] = None, feed_id: Optional[int] = None,
+                   article_ids: Optional[List[int]] = None):
+    """
+    Copy `feed_article` rows to the `timeline_entry` rows of the subscribers of their feeds with INSERT ... SELECT,
+    entries already there are skipped. The caller commits.
+
+    :param user_id: only into the timeline of this user
+    :param feed_id: only the entries of this feed
+    :param article_ids: only these articles of `feed_id`
+    """
+    columns = ["user_id", "feed_id", "feed_article_id", "article_id", "updated_at"]
+    # SQLite needs a WHERE before ON CONFLICT to tell it from the ON of the join
+    statement = select(models.UserFeedSubscription.user_id, models.FeedArticle.feed_id, models.FeedArticle.id,
+                       models.FeedArticle.article_id, models.FeedArticle.updated_at).join(
+        models.UserFeedSubscription, models.UserFeedSubscription.feed_id == models.FeedArticle.feed_id).where(true())
+    if user_id is not None:
+        statement = statement.where(models.UserFeedSubscription.user_id == user_id)
+    if feed_id is not None:
+        statement = statement.where(models.FeedArticle.feed_id == feed_id)
+    for chunk in (_chunks(article_ids) if article_ids is not None else [None]):
+        selected = statement if chunk is None else statement.where(models.FeedArticle.article_id.in_(chunk))
+        db.execute(_insert_ignore(db, models.TimelineEntry).from_select(columns, selected))
+
+
+def prepare_timelines(db: Session) -> int:
+    """
+    Match `timeline_entry` to settings.TIMELINE_MODE at startup: filled from scratch when switching to "materialized",
+    emptied in "query" mode, where ingestion doesn't keep it up to date.
+
+    :return: entries written or deleted
+    """
+    if settings.TIMELINE_MODE == "materialized":
+        if db.query(models.TimelineEntry.id).first() is not None:
+            return 0
+        fill_timelines(db)
+        count = db.query(models.TimelineEntry).count()
+    else:
+        count = db.query(models.TimelineEntry).delete()
+    db.commit()
+    return count
+
+
+def timeline_entry_page_statement(user_id: int, cursor: Optional[str] = None, limit: int = 20, skip: int = 0):
+    """`feed_article_page_statement` over the "materialized" timeline, a range of one index."""
+    statement = (
+        select(models.Article, models.TimelineEntry.updated_at, models.TimelineEntry.feed_article_id)
+        .join(models.TimelineEntry, models.TimelineEntry.article_id == models.Article.id)
+        .where(models.TimelineEntry.user_id == user_id)
+    )
+    if cursor:
+        statement = statement.where(
+            tuple_(models.TimelineEntry.updated_at, models.TimelineEntry.feed_article_id) < decode_cursor(cursor))
+    return (
+        statement.order_by(desc(models.TimelineEntry.updated_at), desc(models.TimelineEntry.feed_article_id))
+        .offset(skip)
+        .limit(limit + 1)
+    )
+
+
+def feed_article_page_statement(user_id: int, cursor: Optional[str] = None, limit: int = 20, skip: int = 0,
+                                mode: Optional[str] = None):
+    """
+    Keyset pagination over the user's timeline, newest first, keyed on (FeedArticle.updated_at, FeedArticle.id).
+    Selects one row more than `limit` to tell whether there is a next page, see `feed_article_page_from_rows`.
+
+    :param mode: settings.TIMELINE_MODE by default
+    :raise ValueError: on a malformed cursor
+    """
+    if (mode or settings.TIMELINE_MODE) == "materialized":
+        return timeline_entry_page_statement(user_id, cursor, limit, skip)
+    feed_ids = select(models.UserFeedSubscription.feed_id).where(models.UserFeedSubscription.user_id == user_id)
+    statement = (
+        select(models.Article, models.FeedArticle.updated_at, models.FeedArticle.id)
         .join(models.FeedArticle)
-        .filter(models.FeedArticle.feed_id.in_(feed_ids))
-        .order_by(desc(models.FeedArticle.updated_at))
+        .where(models.FeedArticle.feed_id.in_(feed_ids))
+    )
+    if cursor:
+        statement = statement.where(
+            tuple_(models.FeedArticle.updated_at, models.FeedArticle.id) < decode_cursor(cursor))
+    return (
+        statement.order_by(desc(models.FeedArticle.updated_at), desc(models.FeedArticle.id))
         .offset(skip)
-        .limit(limit)
-        .all()
+        .limit(limit + 1)
     )
 
+
+def feed_article_page_from_rows(rows: list, limit: int) -> Tuple[List[Article], Optional[str]]:
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        _, updated_at, feed_article_id = rows[-1]
+        next_cursor = encode_cursor(updated_at, feed_article_id)
+    return [article for article, _, _ in rows], next_cursor
+
+
+def get_feed_article_page(user: models.User, db: Session, cursor: Optional[str] = None, limit: int = 20,
+                          skip: int = 0) -> Tuple[List[Article], Optional[str]]:
+    """
+    Articles are kept up to date by the background scheduler (app/scheduler.py), so this only reads the database.
+
+    :param cursor: `next_cursor` of the previous page, None for the first page
+    :param skip: offset kept for old clients, prefer `cursor`
+    :return: the articles and the cursor of the next page, None on the last page
+    :raise ValueError: on a malformed cursor
+    """
+    rows = db.execute(feed_article_page_statement(user.id, cursor, limit, skip)).all()
+    return feed_article_page_from_rows(rows, limit)
+
+
+def get_feed_articles(user: models.User, db: Session, skip: int = 0, limit: int = 20,
+                      cursor: Optional[str] = None) -> [Article]:
+    articles, _ = get_feed_article_page(user, db, cursor=cursor, limit=limit, skip=skip)
     return articles
 
 
+def mark_articles_seen(user_id: int, article_ids: List[int], db: Session, advance_marker: bool = False):
+    """
+    Record in one statement that the user was shown `article_ids`, those already recorded or unknown are skipped.
+
+    :param advance_marker: also move the user's `ReadMarker` up to the newest of their timeline entries, the mark
+        of this visit, see `get_unread_page`
+    """
+    now = datetime.utcnow()
+    columns = ["user_id", "article_id", "created_at", "updated_at"]
+    article_ids = list(dict.fromkeys(article_ids))
+    for chunk in _chunks(article_ids):
+        selected = select(literal(user_id), models.Article.id, literal(now), literal(now)).where(
+            models.Article.id.in_(chunk))
+        db.execute(_insert_ignore(db, models.RequestedArticle).from_select(columns, selected))
+    if advance_marker:
+        _advance_read_marker(user_id, article_ids, db, now)
+    db.commit()
+
+
+def _advance_read_marker(user_id: int, article_ids: List[int], db: Session, now: datetime):
+    feed_ids = select(models.UserFeedSubscription.feed_id).where(models.UserFeedSubscription.user_id == user_id)
+    shown = [tuple(row) for chunk in _chunks(article_ids) for row in db.execute(
+        select(models.FeedArticle.updated_at, models.FeedArticle.id)
+        .where(models.FeedArticle.feed_id.in_(feed_ids), models.FeedArticle.article_id.in_(chunk))
+        .order_by(desc(models.FeedArticle.updated_at), desc(models.FeedArticle.id))
+        .limit(1))]
+    if not shown:
+        return
+    head = max(shown)
+    marker = db.get(models.ReadMarker, user_id)
+    if marker is None:
+        db.add(models.ReadMarker(user_id=user_id, last_read_at=head[0], last_read_id=head[1], updated_at=now))
+    elif head > (marker.last_read_at, marker.last_read_id):
+        marker.last_read_at, marker.last_read_id, marker.updated_at = head[0], head[1], now
+
+
+def timeline_head_statement(user_id: int):
+    """(FeedArticle.updated_at, FeedArticle.id) of the newest entry of the user's timeline."""
+    feed_ids = select(models.UserFeedSubscription.feed_id).where(models.UserFeedSubscription.user_id == user_id)
+    return (
+        select(models.FeedArticle.updated_at, models.FeedArticle.id)
+        .where(models.FeedArticle.feed_id.in_(feed_ids))
+        .order_by(desc(models.FeedArticle.updated_at), desc(models.FeedArticle.id))
+        .limit(1)
+    )
+
+
+def unread_page_statement(user_id: int, head: Tuple[datetime, int], marker: Optional[models.ReadMarker],
+                          limit: int = 20):
+    """
+    The user's timeline entries above the high-water mark `marker` and up to `head`, newest first, without
+    the articles seen already. Only the entries above the mark are looked at, not the whole history.
+    Selects one row more than `limit`, like `feed_article_page_statement`.
+    """
+    feed_ids = select(models.UserFeedSubscription.feed_id).where(models.UserFeedSubscription.user_id == user_id)
+    seen = select(models.RequestedArticle.id).where(models.RequestedArticle.user_id == user_id,
+                                                    models.RequestedArticle.article_id == models.FeedArticle.article_id)
+    statement = (
+        select(models.Article, models.FeedArticle.updated_at, models.FeedArticle.id)
+        .join(models.FeedArticle)
+        .where(models.FeedArticle.feed_id.in_(feed_ids),
+               tuple_(models.FeedArticle.updated_at, models.FeedArticle.id) <= head,
+               ~seen.exists())
+    )
+    if marker is not None:
+        # the plain bound is the one the (feed_id, updated_at) index can range over
+        statement = statement.where(
+            models.FeedArticle.updated_at >= marker.last_read_at,
+            tuple_(models.FeedArticle.updated_at, models.FeedArticle.id) > (marker.last_read_at, marker.last_read_id))
+    return statement.order_by(desc(models.FeedArticle.updated_at), desc(models.FeedArticle.id)).limit(limit + 1)
+
+
+def get_unread_page(user: models.User, db: Session, limit: int = 20) -> List[Article]:
+    """
+    The newest articles of the user's timeline not seen since their last visit. Nothing is written: once they are
+    shown, record them with `mark_articles_seen(..., advance_marker=True)`, which moves the user's `ReadMarker` up
+    to the newest of them, so only the entries above the mark are ever looked at.
+
+    The mark is one position in the merged timeline: the entries below it that weren't shown, the rest of a long
+    backlog or the older entries of a feed subscribed to later, no longer count as unread. They are still on the
+    regular timeline.
+    """
+    head = db.execute(timeline_head_statement(user.id)).first()
+    if head is None:
+        return []
+    marker = db.get(models.ReadMarker, user.id)
+    rows = db.execute(unread_page_statement(user.id, tuple(head), marker, limit)).all()
+    return [article for article, _, _ in rows[:limit]]
+
+
 def authenticate_user(email: str, password: str, db: Session):
     user = get_user_by_email(email, db)
     if user and pwd_context.verify(password, user.password_hash):
@@ -209,22 +803,54 @@ def verify_pasword(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+def _remember_tag_ids(tag_ids: Dict[str, int]):
+    for name, tag_id in tag_ids.items():
+        tag_id_cache[name] = tag_id
+        tag_id_cache.move_to_end(name)
+    while len(tag_id_cache) > TAG_ID_CACHE_SIZE:
+        tag_id_cache.popitem(last=False)
+
+
+def resolve_tag_ids(tag_names: Iterable[str], db: Session) -> Dict[str, int]:
+    """
+    Normalized name -> id of `tag_names`, missing tags are inserted in one statement. The caller commits.
+    At most a SELECT, an INSERT and a SELECT, nothing for names in `tag_id_cache`.
+    """
+    names = [name for name in dict.fromkeys(normalize_tag(name) for name in tag_names) if name]
+    tag_ids = {name: tag_id_cache[name] for name in names if name in tag_id_cache}
+    _remember_tag_ids(tag_ids)
+
+    missing = [name for name in names if name not in tag_ids]
+    if missing:
+        stored = dict(db.execute(select(Tag.name, Tag.id).where(Tag.name.in_(missing))).all())
+        # inserted by another transaction, safe to cache
+        _remember_tag_ids(stored)
+        tag_ids.update(stored)
+        missing = [name for name in missing if name not in stored]
+    if missing:
+        db.execute(_insert_ignore(db, Tag), [dict(name=name) for name in missing])
+        tag_ids.update(db.execute(select(Tag.name, Tag.id).where(Tag.name.in_(missing))).all())
+    return {name: tag_ids[name] for name in names}
+
+
 def get_or_create_tag(db: Session, tag_name: str) -> Tag:
-    tag = db.query(models.Tag).filter(models.Tag.name == tag_name).first()
-    if not tag:
-        tag = models.Tag(name=tag_name)
-        db.add(tag)
-        db.commit()
-        db.refresh(tag)
-    return tag
+    tag_id = resolve_tag_ids([tag_name], db)[normalize_tag(tag_name)]
+    db.commit()
+    return db.get(Tag, tag_id)
+
 
+def associate_tags_with_article(db: Session, article: Article, tags: List[str]) -> List[str]:
+    """
+    Tag `article` with `tags`, repeated or already associated tags are skipped.
 
-def associate_tags_with_article(db: Session, article: Article, tags: List[str]):
-    for tag_name in tags:
-        tag = get_or_create_tag(db, tag_name)
-        article_tag = models.ArticleTag(article_id=article.id, tag_id=tag.id)
-        db.add(article_tag)
+    :return: the normalized tag names
+    """
+    tag_ids = resolve_tag_ids(tags, db)
+    if tag_ids:
+        db.execute(_insert_ignore(db, models.ArticleTag),
+                   [dict(article_id=article.id, tag_id=tag_id) for tag_id in set(tag_ids.values())])
     db.commit()
+    return list(tag_ids)
 
 
 def get_article_by_url(db: Session, url: str) -> Article:
@@ -236,13 +862,133 @@ def get_summary_by_article_id(db: Session, article_id: int) -> Summary:
 
 
 def get_tags_by_article_id(db: Session, article_id: int) -> List[str]:
-    article_tags = db.query(models.ArticleTag).filter(models.ArticleTag.article_id == article_id).all()
-    return [article_tag.tag.name for article_tag in article_tags]
+    return list(db.scalars(
+        select(Tag.name).join(models.ArticleTag).where(models.ArticleTag.article_id == article_id)))
+
+
+class ArticleBundle(NamedTuple):
+    article: Article
+    summary: Optional[Summary]
+    tags: List[str]
+
+
+def article_bundles_statement(article_ids: Iterable[int]):
+    """Articles of `article_ids` with their summary and tags: three statements however many articles."""
+    return (
+        select(Article)
+        .where(Article.id.in_(list(article_ids)))
+        .options(selectinload(Article.summary), selectinload(Article.tags).joinedload(models.ArticleTag.tag))
+    )
+
+
+def article_bundles_from_articles(articles: Iterable[Article], article_ids: Iterable[int]) -> List[ArticleBundle]:
+    """In the order of `article_ids`, ids without an article are left out."""
+    by_id: Dict[int, Article] = {article.id: article for article in articles}
+    return [
+        ArticleBundle(article, article.summary, [article_tag.tag.name for article_tag in article.tags])
+        for article in (by_id.get(article_id) for article_id in article_ids) if article is not None
+    ]
+
+
+def get_article_bundles(article_ids: List[int], db: Session) -> List[ArticleBundle]:
+    return article_bundles_from_articles(db.scalars(article_bundles_statement(article_ids)), article_ids)
 
 
 def create_summary(db: Session, summary: schemas.SummaryCreate, article_id: int) -> Summary:
-    new_summary = models.Summary(**summary.dict(), article_id=article_id)
-    db.add(new_summary)
+    """
+    Store the summary of the article unless one was stored meanwhile, e.g. by the summary workers while
+    `/cats` waited for its completion.
+
+    :return: the stored summary, this one or the one first in
+    """
+    db.execute(_insert_ignore(db, models.Summary), [dict(**summary.dict(), article_id=article_id)])
+    db.commit()
+    return db.query(models.Summary).filter(models.Summary.article_id == article_id).one()
+
+
+def enqueue_summary_jobs(article_ids: List[int], db: Session):
+    """Queue `article_ids` for app/summarizer.py, articles already queued are skipped. The caller commits."""
+    now = datetime.utcnow()
+    jobs = [
+        dict(article_id=article_id, status="pending", attempts=0, next_attempt_at=now, created_at=now, updated_at=now)
+        for article_id in article_ids
+    ]
+    if jobs:
+        db.execute(_insert_ignore(db, models.SummaryJob), jobs)
+
+
+def claim_summary_job(db: Session, now: datetime) -> Optional[models.SummaryJob]:
+    job = (
+        db.query(models.SummaryJob)
+        .filter(models.SummaryJob.status == "pending", models.SummaryJob.next_attempt_at <= now)
+        .order_by(models.SummaryJob.next_attempt_at)
+        .first()
+    )
+    if job is not None:
+        job.status = "running"
+        job.updated_at = now
+        db.commit()
+    return job
+
+
+def get_claimed_summary_article_ids(article_ids: List[int], db: Session) -> Set[int]:
+    """Those of `article_ids` a summary worker is processing right now."""
+    return set(db.scalars(select(models.SummaryJob.article_id).where(
+        models.SummaryJob.article_id.in_(article_ids), models.SummaryJob.status == "running")))
+
+
+def complete_summary_job(job: models.SummaryJob, db: Session):
+    job.status = "done"
+    job.attempts += 1
+    job.last_error = None
+    job.updated_at = datetime.utcnow()
+    db.commit()
+
+
+def fail_summary_job(job: models.SummaryJob, error: str, db: Session):
+    """Retry with exponential backoff until settings.SUMMARY_MAX_ATTEMPTS."""
+    now = datetime.utcnow()
+    job.attempts += 1
+    job.last_error = error
+    job.updated_at = now
+    if job.attempts >= settings.SUMMARY_MAX_ATTEMPTS:
+        job.status = "failed"
+    else:
+        job.status = "pending"
+        job.next_attempt_at = now + timedelta(seconds=settings.SUMMARY_RETRY_BACKOFF * 2 ** (job.attempts - 1))
+    db.commit()
+
+
+def reset_running_summary_jobs(db: Session) -> int:
+    """Jobs left running by a previous process are pending again."""
+    count = (
+        db.query(models.SummaryJob)
+        .filter(models.SummaryJob.status == "running")
+        .update({models.SummaryJob.status: "pending"})
+    )
+    db.commit()
+    return count
+
+
+def get_llm_result(cache_key: str, db: Session) -> Optional[models.LLMResult]:
+    result = db.query(models.LLMResult).filter(models.LLMResult.cache_key == cache_key).first()
+    if result is not None:
+        result.last_used_at = datetime.utcnow()
+        db.commit()
+    return result
+
+
+def save_llm_result(cache_key: str, model: str, prompt_version: str, tags: List[str], summary: str, db: Session):
+    """Keeps the first result stored for `cache_key`."""
+    now = datetime.utcnow()
+    db.execute(_insert_ignore(db, models.LLMResult), [dict(
+        cache_key=cache_key, model=model, prompt_version=prompt_version, tags=json.dumps(tags), summary=summary,
+        created_at=now, last_used_at=now,
+    )])
+    db.commit()
+
+
+def prune_llm_results(before: datetime, db: Session) -> int:
+    count = db.query(models.LLMResult).filter(models.LLMResult.last_used_at < before).delete()
     db.commit()
-    db.refresh(new_summary)
-    return new_summary
+    return count
@@ -0,0 +1,197 @@
+"""
+`AsyncSession` versions of the `crud` functions used by the FastAPI routes.
+Queries are shared with `crud` where they are non-trivial, bcrypt runs in a worker thread.
+"""
+import asyncio
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import crud, models, schemas
+from app.config import settings
+from app.models import Article
+
+
+async def _first(db: AsyncSession, statement):
+    return (await db.scalars(statement.limit(1))).first()
+
+
+async def get_user_by_email(email: str, db: AsyncSession) -> models.User:
+    return await _first(db, select(models.User).where(models.User.email == email))
+
+
+async def get_user_by_id(user_id: int, db: AsyncSession) -> models.User:
+    return await db.get(models.User, user_id)
+
+
+async def get_user_by_github_id(github_id: str, db: AsyncSession) -> models.User:
+    return await _first(db, select(models.User).where(models.User.github_id == github_id))
+
+
+async def get_user_by_discord_id(discord_id: str, db: AsyncSession) -> models.User:
+    return await _first(db, select(models.User).where(models.User.discord_id == discord_id))
+
+
+USER_LOOKUPS = {"Password": get_user_by_email, "Discord": get_user_by_discord_id, "Github": get_user_by_github_id}
+
+
+async def get_user_by_subject(token_source: str, subject: str, db: AsyncSession) -> Optional[models.User]:
+    """See `crud.get_user_by_subject`."""
+    key = (token_source, subject)
+    user = crud.user_cache.get(key)
+    if user is None and token_source in USER_LOOKUPS:
+        user = await USER_LOOKUPS[token_source](subject, db)
+        if user is not None:
+            user = crud.detached(user)
+            crud.user_cache.set(key, user)
+    return user
+
+
+async def register_user(user: schemas.UserCreate, db: AsyncSession) -> models.User:
+    hashed_password = await asyncio.to_thread(crud.get_password_hash, user.password)
+    db_user = models.User(
+        username=user.username,
+        email=user.email,  # using the email as the username
+        password_hash=hashed_password,
+        created_at=datetime.utcnow(),
+        updated_at=datetime.utcnow(),
+    )
+    db.add(db_user)
+    await db.commit()
+    return db_user
+
+
+async def authenticate_user(email: str, password: str, db: AsyncSession):
+    user = await get_user_by_email(email, db)
+    if user and await asyncio.to_thread(crud.verify_pasword, password, user.password_hash):
+        return user
+    return None
+
+
+async def create_user_with_discord(user_data: dict, token: dict, db: AsyncSession) -> models.User:
+    user = models.User(
+        username=user_data["username"],
+        email=user_data["email"],
+        discord_id=user_data["id"],
+        password_hash="",  # Set an empty password hash for OAuth users
+        created_at=datetime.utcnow(),
+        updated_at=datetime.utcnow(),
+    )
+    db.add(user)
+    await db.flush()
+
+    db.add(models.OAuth2Provider(
+        provider="discord",
+        user_id=user.id,
+        access_token=token["access_token"],
+        refresh_token=token.get("refresh_token"),
+        expires_at=datetime.utcnow() + timedelta(seconds=token["expires_in"]),
+    ))
+    await db.commit()
+    return user
+
+
+async def update_discord_token(user_id: int, token: dict, db: AsyncSession):
+    oauth2_provider = await _first(db, select(models.OAuth2Provider).where(
+        models.OAuth2Provider.user_id == user_id, models.OAuth2Provider.provider == "discord"))
+
+    oauth2_provider.access_token = token["access_token"]
+    oauth2_provider.refresh_token = token.get("refresh_token")
+    oauth2_provider.expires_at = datetime.utcnow() + timedelta(seconds=token["expires_in"])
+    await db.commit()
+
+
+async def get_feed_by_url(url: str, db: AsyncSession) -> models.Feed:
+    return await _first(db, select(models.Feed).where(models.Feed.url == url))
+
+
+async def subscribe_to_feed(feed: schemas.FeedCreate, user: models.User, db: AsyncSession, parsed_feed):
+    """See `crud.subscribe_to_feed`."""
+    # the bulk ingestion of a new feed is dialect specific, reuse it through the sync facade of the session
+    return await db.run_sync(lambda sync_db: crud.subscribe_to_feed(feed, user, sync_db, parsed_feed))
+
+
+async def get_feed_by_id(feed_id: int, db: AsyncSession) -> Optional[models.Feed]:
+    return await db.get(models.Feed, feed_id)
+
+
+async def verify_websub(feed: models.Feed, mode: str, topic: str, lease_seconds: Optional[int],
+                        db: AsyncSession) -> bool:
+    """
+    Answer the hub's verification of a WebSub request: only a subscription we asked for is confirmed.
+    A denial of a pending request forgets the subscription, and the feed stays polled.
+
+    :return: whether to echo the challenge
+    """
+    if feed.websub_hub is None or topic != feed.websub_topic or feed.websub_requested_at is None:
+        return False
+    if mode == "denied":
+        feed.websub_hub = feed.websub_topic = feed.websub_requested_at = feed.websub_lease_expires_at = None
+        await db.commit()
+        return False
+    if mode != "subscribe":
+        return False
+    now = datetime.utcnow()
+    feed.websub_requested_at = None
+    feed.websub_lease_expires_at = now + timedelta(seconds=lease_seconds or settings.WEBSUB_LEASE_SECONDS)
+    await db.commit()
+    return True
+
+
+async def ingest_pushed_feed(feed: models.Feed, parsed_feed, db: AsyncSession) -> List[int]:
+    """See `crud.ingest_pushed_feed`."""
+    return await db.run_sync(lambda sync_db: crud.ingest_pushed_feed(feed, parsed_feed, sync_db))
+
+
+async def unsubscribe_from_feed(feed: schemas.FeedRemove, user: models.User, db: AsyncSession):
+    db_feed = await get_feed_by_url(feed.url, db)
+    if db_feed is not None:
+        subscription = await _first(db, select(models.UserFeedSubscription).where(
+            models.UserFeedSubscription.user_id == user.id, models.UserFeedSubscription.feed_id == db_feed.id))
+        if subscription is not None:
+            await db.delete(subscription)
+            # nothing is pushed from a feed the user no longer follows
+            await db.execute(delete(models.ChannelBinding).where(models.ChannelBinding.user_id == user.id,
+                                                                 models.ChannelBinding.feed_id == db_feed.id))
+            await db.execute(delete(models.TimelineEntry).where(models.TimelineEntry.user_id == user.id,
+                                                                models.TimelineEntry.feed_id == db_feed.id))
+            await db.execute(crud.unbound_deliveries_statement(db_feed.id))
+            await db.commit()
+            crud.subscription_cache.invalidate(user.id)
+            return db_feed
+    return None
+
+
+async def list_subscribed_feeds(user: models.User, db: AsyncSession) -> List[models.Feed]:
+    """Through `crud.subscription_cache`, see `crud.list_subscribed_feeds`."""
+    feeds = crud.subscription_cache.get(user.id)
+    if feeds is None:
+        feeds = [crud.detached(feed) for feed in await db.scalars(select(models.Feed).join(
+            models.UserFeedSubscription).where(models.UserFeedSubscription.user_id == user.id))]
+        crud.subscription_cache.set(user.id, feeds)
+    return feeds
+
+
+async def get_feed_article_page(user: models.User, db: AsyncSession, cursor: Optional[str] = None, limit: int = 20,
+                                skip: int = 0) -> Tuple[List[Article], Optional[str]]:
+    """See `crud.get_feed_article_page`."""
+    rows = (await db.execute(crud.feed_article_page_statement(user.id, cursor, limit, skip))).all()
+    return crud.feed_article_page_from_rows(rows, limit)
+
+
+async def get_unread_page(user: models.User, db: AsyncSession, limit: int = 20) -> List[Article]:
+    """See `crud.get_unread_page`."""
+    return await db.run_sync(lambda sync_db: crud.get_unread_page(user, sync_db, limit))
+
+
+async def mark_articles_seen(user_id: int, article_ids: List[int], db: AsyncSession, advance_marker: bool = False):
+    """See `crud.mark_articles_seen`, the insert ignoring conflicts is dialect specific."""
+    await db.run_sync(lambda sync_db: crud.mark_articles_seen(user_id, article_ids, sync_db, advance_marker))
+
+
+async def get_article_bundles(article_ids: List[int], db: AsyncSession) -> List[crud.ArticleBundle]:
+    """See `crud.get_article_bundles`."""
+    articles = (await db.scalars(crud.article_bundles_statement(article_ids))).all()
+    return crud.article_bundles_from_articles(articles, article_ids)
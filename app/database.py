@@ -1,13 +1,16 @@
+import time
+from contextlib import contextmanager
 from datetime import timedelta, datetime
-from typing import Optional
+from typing import Iterator, Optional
 
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base, Session
 
-from app import models, crud
+from app import models, crud_async
 from app.config import settings
 
 
@@ -23,12 +26,86 @@ else:
 session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
+def async_database_url(url: str) -> str:
+    """The same database through its asyncio driver: aiosqlite for SQLite, asyncpg for Postgres."""
+    scheme, _, rest = url.partition("://")
+    driver = {"sqlite": "sqlite+aiosqlite", "postgres": "postgresql+asyncpg", "postgresql": "postgresql+asyncpg",
+              "postgresql+psycopg2": "postgresql+asyncpg"}.get(scheme, scheme)
+    return f"{driver}://{rest}"
+
+
+# Used by the FastAPI routes, the sync engine above is kept for the bot, the scheduler and alembic
+async_engine = create_async_engine(async_database_url(DATABASE_URL))
+# expire_on_commit=False: attribute access after commit must not trigger implicit IO
+async_session = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+class SessionScope:
+    """
+    `with session_scope() as db:` closes the session, and returns its connection to the pool,
+    as soon as the block is left. Also keeps the pool metrics served on `/metrics`.
+    """
+
+    def __init__(self, session_factory: sessionmaker):
+        self.session_factory = session_factory
+        self.pool = session_factory.kw["bind"].pool
+        self.checkouts = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+        self.checked_out = 0
+        self.checked_out_max = 0
+        event.listen(self.pool, "checkout", self._on_checkout)
+        event.listen(self.pool, "checkin", self._on_checkin)
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        self.checked_out += 1
+        self.checked_out_max = max(self.checked_out_max, self.checked_out)
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        self.checked_out -= 1
+
+    @contextmanager
+    def __call__(self) -> Iterator[Session]:
+        db = self.session_factory()
+        try:
+            start = time.perf_counter()
+            # check the connection out up front, so the time spent waiting for the pool can be measured
+            db.connection()
+            wait = time.perf_counter() - start
+            self.checkouts += 1
+            self.checkout_wait_total += wait
+            self.checkout_wait_max = max(self.checkout_wait_max, wait)
+            yield db
+        finally:
+            db.close()
+
+    def metrics(self) -> dict:
+        # NullPool/StaticPool have no size or overflow
+        size = getattr(self.pool, "size", None)
+        overflow = getattr(self.pool, "overflow", None)
+        return {
+            "pool": type(self.pool).__name__,
+            "size": size() if size else None,
+            "overflow": max(overflow(), 0) if overflow else None,
+            "checked_out": self.checked_out,
+            "checked_out_max": self.checked_out_max,
+            "checkouts": self.checkouts,
+            "checkout_wait_avg": self.checkout_wait_total / self.checkouts if self.checkouts else 0.0,
+            "checkout_wait_max": self.checkout_wait_max,
+        }
+
+
+session_scope = SessionScope(session)
+
+
 def get_db():
-    db = session()
-    try:
+    with session_scope() as db:
+        yield db
+
+
+async def get_async_db():
+    async with async_session() as db:
         yield db
-    finally:
-        db.close()
 
 
 def create_access_token(data: dict, token_source: str, expires_delta: Optional[timedelta] = None):
@@ -43,7 +120,7 @@ def create_access_token(data: dict, token_source: str, expires_delta: Optional[t
 
 
 async def get_current_user(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     token: str = Depends(oauth2_scheme)
 ) -> Optional[models.User]:
     try:
@@ -53,15 +130,7 @@ async def get_current_user(
     except jwt.JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-    if token_source == "Password":
-        user = crud.get_user_by_email(subject, db)
-    elif token_source == "Discord":
-        user = crud.get_user_by_discord_id(subject, db)
-    elif token_source == "Github":
-        user = crud.get_user_by_github_id(subject, db)
-    else:
-        raise HTTPException(status_code=401, detail="Invalid token")
-
+    user = await crud_async.get_user_by_subject(token_source, subject, db)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid token")
     return user
@@ -0,0 +1,161 @@
+import asyncio
+import functools
+import logging
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from app import crud, models
+from app.catnews import bot
+from app.config import settings
+from app.database import session
+from app.utils.message import SendQueue, pack_messages
+
+Target = Tuple[str, str]
+
+
+class DiscordClient:
+    """
+    Sends to the channels and DMs of `ChannelBinding` targets through the py-cord bot.
+    Anything with the same `send` can stand in for it, e.g. in tests.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def send(self, target_type: str, target_id: str, content: str):
+        await self.bot.wait_until_ready()
+        if target_type == "dm":
+            target = self.bot.get_user(int(target_id)) or await self.bot.fetch_user(int(target_id))
+        else:
+            target = self.bot.get_channel(int(target_id)) or await self.bot.fetch_channel(int(target_id))
+        await target.send(content)
+
+
+def article_block(article: models.Article) -> str:
+    return f"**{article.title}**\n{article.url}"
+
+
+class DeliveryWorker:
+    """
+    Drains the `delivery` outbox filled at ingestion for the feeds bound to channels, see `crud.enqueue_deliveries`.
+
+    The due articles of a target go out in batches packed into as few messages as fit, paced per target by a
+    `SendQueue`. Up to `concurrency` targets are sent to at once and a slow or failing one holds up no other.
+    Deliveries are marked sent only after their messages are: a failed batch is retried with backoff and a batch
+    interrupted by a restart is sent again, so an article may reach a channel twice but is never lost.
+    """
+
+    def __init__(
+            self,
+            client=None,
+            session_factory=session,
+            concurrency: int = settings.DELIVERY_CONCURRENCY,
+            batch_size: int = settings.DELIVERY_BATCH_SIZE,
+            poll_interval: float = 5,
+            send_queue: Optional[SendQueue] = None,
+    ):
+        self.client = client
+        self.session_factory = session_factory
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.send_queue = send_queue or SendQueue()
+        self.stats = Counter()
+        self._in_flight: Dict[Target, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        db = self.session_factory()
+        try:
+            recovered = crud.reset_sending_deliveries(db)
+        finally:
+            db.close()
+        if recovered:
+            logging.info(f"Requeued {recovered} interrupted deliveries")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        # batches cut short stay "sending" and are requeued by the next start
+        tasks = [task for task in [self._task, *self._in_flight.values()] if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._in_flight.clear()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                self.dispatch()
+            except Exception as e:
+                logging.error(f"Delivery worker failed: {e}")
+            if self._in_flight:
+                # a free slot is worth claiming again right away
+                await asyncio.wait(list(self._in_flight.values()), timeout=self.poll_interval,
+                                   return_when=asyncio.FIRST_COMPLETED)
+            else:
+                await asyncio.sleep(self.poll_interval)
+
+    def dispatch(self) -> List[asyncio.Task]:
+        """
+        Claim the due deliveries of as many targets as there are free slots, and start sending to each.
+
+        :return: the tasks started, one per target
+        """
+        free = self.concurrency - len(self._in_flight)
+        if free <= 0:
+            return []
+        db = self.session_factory()
+        try:
+            batches = crud.claim_deliveries(db, datetime.utcnow(), free, self.batch_size, busy=self._in_flight)
+        finally:
+            db.close()
+        tasks = []
+        for target, batch in batches.items():
+            task = asyncio.create_task(self._deliver(target, batch))
+            self._in_flight[target] = task
+            task.add_done_callback(lambda _, target=target: self._in_flight.pop(target, None))
+            tasks.append(task)
+        return tasks
+
+    async def run_once(self) -> int:
+        """
+        `dispatch` once and wait for the batches.
+
+        :return: the number of targets sent to
+        """
+        tasks = self.dispatch()
+        await asyncio.gather(*tasks)
+        return len(tasks)
+
+    async def _deliver(self, target: Target, batch: List[Tuple[int, models.Article]]) -> None:
+        delivery_ids = [delivery_id for delivery_id, _ in batch]
+        messages = pack_messages([article_block(article) for _, article in batch], separator="\n\n")
+        try:
+            await self.send_queue.send_all(target, functools.partial(self.client.send, *target), messages)
+        except Exception as e:
+            logging.error(f"Error delivering {len(batch)} articles to {target[0]} {target[1]}: {e}")
+            db = self.session_factory()
+            try:
+                self.stats["given_up"] += crud.fail_deliveries(delivery_ids, str(e), db)
+            finally:
+                db.close()
+            self.stats["errors"] += 1
+            return
+        db = self.session_factory()
+        try:
+            crud.complete_deliveries(delivery_ids, db)
+        finally:
+            db.close()
+        self.stats["sent"] += len(delivery_ids)
+        self.stats["messages"] += len(messages)
+
+    def metrics(self) -> dict:
+        return {"in_flight": len(self._in_flight),
+                **{name: self.stats[name] for name in ("sent", "messages", "errors", "given_up")}}
+
+
+delivery_worker = DeliveryWorker(DiscordClient(bot))
@@ -0,0 +1,298 @@
+import asyncio
+import functools
+import hashlib
+import logging
+from typing import AsyncIterator, Callable, Dict, List, NamedTuple, Optional, Set, Tuple, Union
+from urllib.parse import urlsplit
+
+import feedparser
+import httpx
+
+from app.config import settings
+from app.utils.circuitbreaker import CircuitBreaker
+from app.utils.feedstream import FeedStreamParser
+from app.utils.ratelimit import TokenBucket
+
+USER_AGENT = "CatNews/1.0 (+https://github.com/gantrol/catnews-discord-rss-backend-with-openai)"
+# entries of a streamed feed looked up at once
+STREAM_BATCH = 100
+# the urls among those given that are already stored for the feed being fetched
+KnownUrls = Callable[[List[str]], Set[str]]
+
+
+class FetchResult(NamedTuple):
+    url: str
+    status_code: int
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    content_hash: Optional[str] = None
+    # None when the feed didn't change since the validators were stored
+    parsed_feed: Optional[feedparser.FeedParserDict] = None
+
+    @property
+    def not_modified(self) -> bool:
+        return self.parsed_feed is None
+
+
+class HostUnavailable(httpx.HTTPError):
+    """The circuit breaker of the feed's host is open, no request was made."""
+
+    def __init__(self, host: str, retry_in: float):
+        super().__init__(f"{host} is failing, retry in {retry_in:.0f}s")
+        self.host = host
+        self.retry_in = retry_in
+
+
+def retry_after(response: httpx.Response) -> Optional[float]:
+    try:
+        return float(response.headers.get("Retry-After", ""))
+    except ValueError:
+        return None
+
+
+class HostLimiter:
+    """
+    Politeness towards one host: at most `concurrency` requests in flight, `rate` requests per second
+    with bursts of `burst`, and a circuit breaker that skips the host while it keeps failing.
+    """
+
+    def __init__(self, concurrency: int, rate: float, burst: int, breaker: CircuitBreaker):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.breaker = breaker
+        self.in_flight = 0
+        self.requests = 0
+        self.throttled = 0
+
+    def metrics(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "tokens": round(self.bucket.tokens, 2) if self.bucket else None,
+            "breaker": self.breaker.metrics(),
+        }
+
+
+async def parse_feed(content: bytes) -> feedparser.FeedParserDict:
+    # feedparser is pure python and CPU bound, don't run it on the event loop
+    return await asyncio.to_thread(feedparser.parse, content)
+
+
+class FeedFetcher:
+    """
+    Fetches feeds over one shared, pooled `httpx.AsyncClient`.
+
+    `max_connections` bounds the whole pool and `per_host` bounds the number of
+    in-flight requests to a single host, so one slow aggregator can't take every connection.
+    Each host is also rate limited and skipped while failing, see `HostLimiter`.
+    Concurrent fetches of the same url (and validators) share one request and parse.
+    Bodies larger than `stream_threshold` are parsed incrementally, see `_parse_stream`.
+    """
+
+    def __init__(
+            self,
+            max_connections: int = settings.FEED_FETCH_MAX_CONNECTIONS,
+            per_host: int = settings.FEED_FETCH_PER_HOST,
+            timeout: float = settings.FEED_FETCH_TIMEOUT,
+            transport: Optional[httpx.AsyncBaseTransport] = None,
+            host_rate: float = settings.FEED_FETCH_HOST_RATE,
+            host_burst: int = settings.FEED_FETCH_HOST_BURST,
+            breaker_threshold: int = settings.FEED_FETCH_BREAKER_THRESHOLD,
+            breaker_cooldown: float = settings.FEED_FETCH_BREAKER_COOLDOWN,
+            stream_threshold: int = settings.FEED_STREAM_THRESHOLD,
+            stream_max_entries: int = settings.FEED_STREAM_MAX_ENTRIES,
+    ):
+        self.max_connections = max_connections
+        self.per_host = per_host
+        self.timeout = timeout
+        self.transport = transport
+        self.host_rate = host_rate
+        self.host_burst = host_burst
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.stream_threshold = stream_threshold
+        self.stream_max_entries = stream_max_entries
+        self._client: Optional[httpx.AsyncClient] = None
+        self._hosts: Dict[str, HostLimiter] = {}
+        self._in_flight: Dict[Tuple, asyncio.Task] = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                timeout=httpx.Timeout(self.timeout),
+                headers={"User-Agent": USER_AGENT},
+                follow_redirects=True,
+                transport=self.transport,
+            )
+        return self._client
+
+    def _host(self, url: str) -> HostLimiter:
+        host = urlsplit(url).netloc
+        if host not in self._hosts:
+            self._hosts[host] = HostLimiter(self.per_host, self.host_rate, self.host_burst,
+                                            CircuitBreaker(self.breaker_threshold, self.breaker_cooldown))
+        return self._hosts[host]
+
+    def metrics(self) -> Dict[str, dict]:
+        """Limiter and breaker state by host."""
+        return {host: limiter.metrics() for host, limiter in self._hosts.items()}
+
+    async def fetch(self, url: str, etag: Optional[str] = None, last_modified: Optional[str] = None,
+                    content_hash: Optional[str] = None, known: Optional[KnownUrls] = None) -> FetchResult:
+        """
+        Conditional GET of `url`. The body is only parsed when it changed,
+        i.e. the server didn't answer 304 and its sha256 differs from `content_hash`.
+
+        :param known: where a streamed body stops, see `_parse_stream`
+        """
+        key = (url, etag, last_modified, content_hash)
+        if key in self._in_flight:
+            return await asyncio.shield(self._in_flight[key])
+        task = asyncio.ensure_future(self._fetch(url, etag, last_modified, content_hash, known))
+        self._in_flight[key] = task
+        try:
+            return await task
+        finally:
+            del self._in_flight[key]
+
+    async def _fetch(self, url: str, etag: Optional[str], last_modified: Optional[str],
+                     content_hash: Optional[str], known: Optional[KnownUrls] = None) -> FetchResult:
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        host = self._host(url)
+        digest = hashlib.sha256()
+        async with host.semaphore:
+            # checked once our turn comes, so requests queued behind failing ones are skipped too
+            if not host.breaker.allow():
+                raise HostUnavailable(urlsplit(url).netloc, host.breaker.retry_in())
+            if host.bucket is not None and not host.bucket.try_acquire():
+                host.throttled += 1
+                await host.bucket.acquire()
+            host.in_flight += 1
+            host.requests += 1
+            try:
+                response = await self.client.send(self.client.build_request("GET", url, headers=headers),
+                                                  stream=True)
+                try:
+                    # a missing feed is the feed's problem, throttling and server errors are the host's
+                    if response.status_code == 429 or response.status_code >= 500:
+                        host.breaker.record_failure(retry_after(response))
+                    else:
+                        host.breaker.record_success()
+                    if response.status_code == 304:
+                        return FetchResult(url, 304, etag, last_modified, content_hash)
+                    response.raise_for_status()
+
+                    chunks = response.aiter_bytes()
+                    head, size = [], 0
+                    async for chunk in chunks:
+                        digest.update(chunk)
+                        head.append(chunk)
+                        size += len(chunk)
+                        if size > self.stream_threshold:
+                            parsed_feed, complete = await self._parse_stream(head, chunks, digest, known)
+                            new_content_hash = digest.hexdigest() if complete else None
+                            return FetchResult(url, response.status_code, response.headers.get("ETag", etag),
+                                               response.headers.get("Last-Modified", last_modified),
+                                               new_content_hash, parsed_feed)
+                finally:
+                    await response.aclose()
+            except httpx.TransportError:
+                host.breaker.record_failure()
+                raise
+            finally:
+                host.in_flight -= 1
+
+        new_etag = response.headers.get("ETag", etag)
+        new_last_modified = response.headers.get("Last-Modified", last_modified)
+        new_content_hash = digest.hexdigest()
+        if new_content_hash == content_hash:
+            return FetchResult(url, response.status_code, new_etag, new_last_modified, new_content_hash)
+        parsed_feed = await parse_feed(b"".join(head))
+        return FetchResult(url, response.status_code, new_etag, new_last_modified, new_content_hash, parsed_feed)
+
+    async def _parse_stream(self, head: List[bytes], chunks: AsyncIterator[bytes], digest,
+                            known: Optional[KnownUrls]) -> Tuple[feedparser.FeedParserDict, bool]:
+        """
+        Parse a body larger than `stream_threshold` as it arrives, instead of holding it and all its entries.
+        Feeds list the newest entries first: stop at the first one `known` says is stored already,
+        or after `stream_max_entries`.
+
+        :param head: the chunks read so far
+        :param digest: sha256 of the chunks read so far, updated with the rest
+        :return: the document and whether the whole body was read
+        """
+        parser = FeedStreamParser()
+        entries, pending = [], []
+
+        def keep(batch: list) -> bool:
+            stored = known([entry["link"] for entry in batch if entry.get("link")]) if known else set()
+            for entry in batch:
+                if entry.get("link") in stored or len(entries) >= self.stream_max_entries:
+                    return False
+                entries.append(entry)
+            return True
+
+        async def body():
+            while head:
+                yield head.pop(0)
+            async for chunk in chunks:
+                digest.update(chunk)
+                yield chunk
+
+        complete = True
+        stream = body()
+        async for chunk in stream:
+            pending.extend(parser.feed(chunk))
+            if parser.bozo:
+                # not well-formed past this point, keep what came before
+                keep(pending)
+                complete = False
+                break
+            if len(pending) >= STREAM_BATCH:
+                if not keep(pending):
+                    complete = False
+                    break
+                pending = []
+        else:
+            keep(pending + parser.close())
+        await stream.aclose()
+        return feedparser.FeedParserDict(feed=parser.channel, entries=entries, bozo=int(parser.bozo)), complete
+
+    async def fetch_feed(self, url: str) -> feedparser.FeedParserDict:
+        return (await self.fetch(url)).parsed_feed
+
+    async def fetch_many(self, feeds: List, known: Optional[Callable[..., Set[str]]] = None
+                         ) -> Dict[str, Union[FetchResult, Exception]]:
+        """
+        Conditionally fetch all `feeds` concurrently.
+
+        :param feeds: `models.Feed` or anything else with `url`, `etag`, `last_modified` and `content_hash`
+        :param known: `known(feed, urls)`, the `urls` already stored for `feed`
+        :return: results by url, failures are returned in place of the result instead of being raised
+        """
+        feeds = list({feed.url: feed for feed in feeds}.values())
+        results = await asyncio.gather(
+            *(self.fetch(feed.url, feed.etag, feed.last_modified, feed.content_hash,
+                         functools.partial(known, feed) if known else None) for feed in feeds),
+            return_exceptions=True,
+        )
+        for feed, result in zip(feeds, results):
+            if isinstance(result, Exception):
+                logging.error(f"Error fetching {feed.url}: {result!r}")
+        return {feed.url: result for feed, result in zip(feeds, results)}
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+fetcher = FeedFetcher()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Table, UniqueConstraint
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index, Table, UniqueConstraint
 # from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, declarative_base
 
@@ -41,6 +41,30 @@ class Feed(Base):
     url = Column(String, unique=True, nullable=False)
     created_at = Column(DateTime, nullable=False)
     updated_at = Column(DateTime, nullable=False)
+    # fixed seconds between background refreshes, adapted to the feed's activity when not set
+    refresh_interval = Column(Integer, nullable=True)
+    last_refreshed_at = Column(DateTime, nullable=True)
+    next_refresh_at = Column(DateTime, nullable=True, index=True)
+    # activity of the feed for the polling schedule, see app/utils/polling.py
+    last_new_entry_at = Column(DateTime, nullable=True)
+    # average seconds between new entries
+    entry_interval = Column(Integer, nullable=True)
+    # seconds between polls asked for by the feed's ttl / sy:updatePeriod
+    poll_hint = Column(Integer, nullable=True)
+    # failed refreshes in a row
+    error_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # validators of the last fetched response, for conditional GET
+    etag = Column(String, nullable=True)
+    last_modified = Column(String, nullable=True)
+    content_hash = Column(String(64), nullable=True)
+    # WebSub hub advertised by the feed and the topic url the hub knows it by, see app/websub.py
+    websub_hub = Column(String, nullable=True)
+    websub_topic = Column(String, nullable=True)
+    websub_secret = Column(String(64), nullable=True)
+    # last (un)subscription request not verified by the hub yet
+    websub_requested_at = Column(DateTime, nullable=True)
+    # end of the verified lease: until then the hub pushes the feed and it isn't polled
+    websub_lease_expires_at = Column(DateTime, nullable=True, index=True)
 
 
 class Article(Base):
@@ -48,7 +72,7 @@ class Article(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, nullable=False)
-    url = Column(String, nullable=False)
+    url = Column(String, unique=True, index=True, nullable=False)
     content = Column(String)
     published_at = Column(DateTime, nullable=False)
     created_at = Column(DateTime, nullable=False)
@@ -66,7 +90,12 @@ class FeedArticle(Base):
     created_at = Column(DateTime, nullable=False)
     updated_at = Column(DateTime, nullable=False)
 
-    UniqueConstraint("feed_id", "article_id")
+    __table_args__ = (
+        UniqueConstraint("feed_id", "article_id", name="uq_feed_article_feed_id_article_id"),
+        # the /articles timeline: feed_id IN (...) ORDER BY updated_at DESC
+        Index("ix_feed_article_feed_id_updated_at", "feed_id", "updated_at"),
+        Index("ix_feed_article_article_id", "article_id"),
+    )
 
 
 class UserFeedSubscription(Base):
@@ -78,7 +107,81 @@ class UserFeedSubscription(Base):
     created_at = Column(DateTime, nullable=False)
     updated_at = Column(DateTime, nullable=False)
 
-    UniqueConstraint("user_id", "feed_id")
+    __table_args__ = (
+        UniqueConstraint("user_id", "feed_id", name="uq_user_feed_subscription_user_id_feed_id"),
+        Index("ix_user_feed_subscription_feed_id", "feed_id"),
+    )
+
+
+class ChannelBinding(Base):
+    """A feed a user pushes to a Discord channel or their DMs, see app/delivery.py"""
+    __tablename__ = "channel_binding"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("user.id"), nullable=False)
+    feed_id = Column(Integer, ForeignKey("feed.id"), nullable=False)
+    # "channel" or "dm": a channel id, or the Discord id of the user
+    target_type = Column(String(16), nullable=False)
+    target_id = Column(String(255), nullable=False)
+    guild_id = Column(String(255), nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "feed_id", "target_type", "target_id",
+                         name="uq_channel_binding_user_id_feed_id_target"),
+        # fan-out of a feed's new articles
+        Index("ix_channel_binding_feed_id", "feed_id"),
+    )
+
+
+class Delivery(Base):
+    """Outbox of articles to push to a channel or DM, filled at ingestion and drained by app/delivery.py"""
+    __tablename__ = "delivery"
+
+    id = Column(Integer, primary_key=True, index=True)
+    target_type = Column(String(16), nullable=False)
+    target_id = Column(String(255), nullable=False)
+    article_id = Column(Integer, ForeignKey("article.id"), nullable=False)
+    # the bound feed it was queued for, the worker takes turns between feeds
+    feed_id = Column(Integer, ForeignKey("feed.id"), nullable=True)
+    # pending, sending, sent or failed
+    status = Column(String(16), nullable=False)
+    attempts = Column(Integer, nullable=False)
+    next_attempt_at = Column(DateTime, nullable=False)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+    article = relationship("Article")
+
+    __table_args__ = (
+        # an article reaches a target once, whichever of its bound feeds it came from
+        UniqueConstraint("target_type", "target_id", "article_id", name="uq_delivery_target_article_id"),
+        Index("ix_delivery_status_next_attempt_at", "status", "next_attempt_at"),
+    )
+
+
+class TimelineEntry(Base):
+    """
+    A `FeedArticle` in the timeline of a subscriber of its feed, written at ingestion when settings.TIMELINE_MODE is
+    "materialized", so reading a page of the timeline is a range of one index whatever the number of subscriptions.
+    """
+    __tablename__ = "timeline_entry"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("user.id"), nullable=False)
+    feed_id = Column(Integer, ForeignKey("feed.id"), nullable=False)
+    feed_article_id = Column(Integer, ForeignKey("feed_article.id"), nullable=False)
+    article_id = Column(Integer, ForeignKey("article.id"), nullable=False)
+    # FeedArticle.updated_at, (updated_at, feed_article_id) is the same keyset as the "query" timeline
+    updated_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        # also the range deleted by unsubscribing
+        UniqueConstraint("user_id", "feed_id", "feed_article_id", name="uq_timeline_entry_user_id_feed_article"),
+        Index("ix_timeline_entry_user_id_updated_at", "user_id", "updated_at", "feed_article_id"),
+    )
 
 
 class RequestedArticle(Base):
@@ -90,7 +193,20 @@ class RequestedArticle(Base):
     created_at = Column(DateTime, nullable=False)
     updated_at = Column(DateTime, nullable=False)
 
-    UniqueConstraint("user_id", "article_id")
+    __table_args__ = (
+        UniqueConstraint("user_id", "article_id", name="uq_requested_article_user_id_article_id"),
+    )
+
+
+class ReadMarker(Base):
+    """Where the user's last visit to the timeline stopped, see `crud.get_unread_page`"""
+    __tablename__ = "read_marker"
+
+    user_id = Column(Integer, ForeignKey("user.id"), primary_key=True)
+    # (FeedArticle.updated_at, FeedArticle.id) of the timeline entry
+    last_read_at = Column(DateTime, nullable=False)
+    last_read_id = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
 
 
 class Tag(Base):
@@ -105,7 +221,8 @@ class ArticleTag(Base):
     __tablename__ = "article_tag"
 
     article_id = Column(Integer, ForeignKey("article.id"), primary_key=True)
-    tag_id = Column(Integer, ForeignKey("tag.id"), primary_key=True)
+    # lookups by article_id use the primary key, lookups by tag_id need their own index
+    tag_id = Column(Integer, ForeignKey("tag.id"), primary_key=True, index=True)
 
     article = relationship("Article", back_populates="tags")
     tag = relationship("Tag", back_populates="articles")
@@ -116,5 +233,40 @@ class Summary(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     content = Column(String, nullable=False)
-    article_id = Column(Integer, ForeignKey("article.id"))
+    # one per article, `Article.summary` is a scalar
+    article_id = Column(Integer, ForeignKey("article.id"), index=True, unique=True)
     article = relationship("Article", back_populates="summary")
+
+
+class SummaryJob(Base):
+    """Queue of articles to summarize in the background, see app/summarizer.py"""
+    __tablename__ = "summary_job"
+
+    id = Column(Integer, primary_key=True, index=True)
+    article_id = Column(Integer, ForeignKey("article.id"), unique=True, nullable=False)
+    # pending, running, done or failed
+    status = Column(String(16), nullable=False)
+    attempts = Column(Integer, nullable=False)
+    next_attempt_at = Column(DateTime, nullable=False)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_summary_job_status_next_attempt_at", "status", "next_attempt_at"),
+    )
+
+
+class LLMResult(Base):
+    """Tags and summary by normalized content hash, model and prompt version, see app/summarizer.py"""
+    __tablename__ = "llm_result"
+
+    id = Column(Integer, primary_key=True, index=True)
+    cache_key = Column(String(64), unique=True, index=True, nullable=False)
+    model = Column(String, nullable=False)
+    prompt_version = Column(String, nullable=False)
+    # JSON list
+    tags = Column(String, nullable=False)
+    summary = Column(String, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    last_used_at = Column(DateTime, nullable=False, index=True)
@@ -0,0 +1,230 @@
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app import crud, crud_async, models, schemas
+from app.config import settings
+from app.database import session
+from app.fetcher import FeedFetcher, HostUnavailable, fetcher as default_fetcher
+from app.websub import WebSubSubscriber, subscriber as default_subscriber
+
+
+async def refresh_feeds(feeds: List[models.Feed], db: Session, fetcher: FeedFetcher = default_fetcher) -> Counter:
+    """
+    Conditionally fetch `feeds` concurrently and store the new entries of the changed ones.
+
+    :return: counts of "updated", "not_modified", "skipped" (host circuit open) and "failed" feeds
+    """
+    # large feeds are streamed up to the entries already stored
+    results = await fetcher.fetch_many(feeds, known=lambda feed, urls: crud.get_feed_article_urls(feed, urls, db))
+    stats = Counter()
+    for feed in feeds:
+        result = results[feed.url]
+        try:
+            if isinstance(result, HostUnavailable):
+                # the host is failing, not the feed: come back when its breaker lets a trial through
+                feed.next_refresh_at = datetime.utcnow() + timedelta(seconds=result.retry_in)
+                db.commit()
+                stats["skipped"] += 1
+                continue
+            if isinstance(result, Exception):
+                raise result
+            if result.not_modified:
+                # 304 or identical body: nothing to parse or store, only plan the next poll
+                feed.etag, feed.last_modified = result.etag, result.last_modified
+                crud.schedule_next_refresh(feed, db)
+                stats["not_modified"] += 1
+            else:
+                crud.refresh_feed(feed, db, result.parsed_feed, result.etag, result.last_modified,
+                                  result.content_hash)
+                stats["updated"] += 1
+        except Exception as e:
+            db.rollback()
+            logging.error(f"Error refreshing {feed.url}: {e}")
+            # back off, a broken feed must not be retried every tick
+            crud.schedule_next_refresh(feed, db, failed=True)
+            stats["failed"] += 1
+    return stats
+
+
+def cache_hit_rate(stats: Counter) -> float:
+    fetched = stats["updated"] + stats["not_modified"]
+    return stats["not_modified"] / fetched if fetched else 0.0
+
+
+def is_fresh(feed: models.Feed, now: datetime, ttl: int = settings.FEED_FRESHNESS_TTL) -> bool:
+    if feed.websub_lease_expires_at is not None and feed.websub_lease_expires_at > now:
+        # pushed by its hub as soon as it changes
+        return True
+    return feed.last_refreshed_at is not None and now - feed.last_refreshed_at < timedelta(seconds=ttl)
+
+
+class FeedScheduler:
+    """
+    Refreshes every feed on its own interval in the background,
+    so read paths (`/articles`, `/news`, `/cats`) only hit the database.
+    A feed is refreshed by one caller at a time, others asking for it meanwhile wait for that refresh.
+    Feeds with a WebSub hub are subscribed to and their leases renewed on the same ticks.
+    """
+
+    def __init__(self, session_factory=session, tick: int = settings.FEED_SCHEDULER_TICK,
+                 fetcher: FeedFetcher = default_fetcher, freshness_ttl: int = settings.FEED_FRESHNESS_TTL,
+                 websub: WebSubSubscriber = default_subscriber):
+        self.session_factory = session_factory
+        self.tick = tick
+        self.fetcher = fetcher
+        self.freshness_ttl = freshness_ttl
+        self.websub = websub
+        self._task: Optional[asyncio.Task] = None
+        # url -> done when the refresh in flight of that feed is stored
+        self._refreshing: Dict[str, asyncio.Future] = {}
+        # cumulative refresh_feeds() counts since startup
+        self.stats = Counter()
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.fetcher.aclose()
+        await self.websub.aclose()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logging.error(f"Feed scheduler tick failed: {e}")
+            await asyncio.sleep(self.tick)
+
+    async def refresh(self, feeds: List[models.Feed], db: Session) -> Counter:
+        """
+        `refresh_feeds`, joining the refreshes already in flight instead of fetching those feeds again.
+
+        :return: also counts the "coalesced" feeds
+        """
+        joined = {feed.url: self._refreshing[feed.url] for feed in feeds if feed.url in self._refreshing}
+        own = [feed for feed in feeds if feed.url not in joined]
+        stats = Counter()
+        if own:
+            done = asyncio.get_running_loop().create_future()
+            self._refreshing.update((feed.url, done) for feed in own)
+            try:
+                stats = await refresh_feeds(own, db, self.fetcher)
+            finally:
+                for feed in own:
+                    del self._refreshing[feed.url]
+                done.set_result(None)
+        if joined:
+            # don't hold a pooled connection, nor SQLite's read lock, while the refresh writes
+            db.commit()
+            await asyncio.gather(*(asyncio.shield(future) for future in set(joined.values())))
+            stats["coalesced"] += len(joined)
+        return stats
+
+    async def refresh_user_feeds(self, user_id: int) -> Counter:
+        """
+        Refresh the feeds of `user_id` not refreshed within `freshness_ttl`.
+
+        :return: also counts the "fresh" feeds that were skipped
+        """
+        db = self.session_factory()
+        try:
+            user = crud.get_user_by_id(user_id, db)
+            feeds = crud.list_subscribed_feeds(user, db)
+            now = datetime.utcnow()
+            stale = [feed for feed in feeds if not is_fresh(feed, now, self.freshness_ttl)]
+            stats = await self.refresh(stale, db)
+            stats["fresh"] += len(feeds) - len(stale)
+            return stats
+        finally:
+            db.close()
+
+    async def renew_websub(self) -> int:
+        """
+        Ask the hubs of the feeds without a lease, or with one ending soon, to push them.
+
+        :return: number of requests sent
+        """
+        if not self.websub.enabled:
+            return 0
+        db = self.session_factory()
+        try:
+            feeds = crud.get_websub_renewals(db, datetime.utcnow())
+            requests = [(feed.id, feed.websub_hub, feed.websub_topic, feed.websub_secret) for feed in feeds]
+            for feed in feeds:
+                feed.websub_requested_at = datetime.utcnow()
+            # the hub may verify before answering, the callback must find the request
+            db.commit()
+        finally:
+            db.close()
+        results = await asyncio.gather(*(self.websub.request(*request) for request in requests),
+                                       return_exceptions=True)
+        failed = []
+        for (feed_id, hub, topic, _), result in zip(requests, results):
+            if isinstance(result, Exception):
+                logging.error(f"Error subscribing to {topic} at {hub}: {result}")
+                failed.append(feed_id)
+        if failed:
+            # no verification is coming, ask again on the next tick instead of a day later
+            db = self.session_factory()
+            try:
+                crud.clear_websub_requests(failed, db)
+            finally:
+                db.close()
+        self.stats["websub_requests"] += len(requests)
+        return len(requests)
+
+    async def subscribe(self, feed: schemas.FeedCreate, user: models.User, db) -> models.Feed:
+        """
+        Subscribe `user` to `feed`, for the API and the bot alike. A feed not stored yet is fetched first, and a hub
+        found in it is asked to push the feed right away instead of on the next tick.
+
+        :param db: a `Session` or an `AsyncSession`
+        :raise httpx.HTTPError: a new feed couldn't be fetched
+        """
+        if isinstance(db, AsyncSession):
+            stored = await crud_async.get_feed_by_url(feed.url, db)
+        else:
+            stored = crud.get_feed_by_url(feed.url, db)
+        parsed_feed = None if stored is not None else await self.fetcher.fetch_feed(feed.url)
+        if isinstance(db, AsyncSession):
+            subscribed_feed = await crud_async.subscribe_to_feed(feed, user, db, parsed_feed)
+        else:
+            subscribed_feed = crud.subscribe_to_feed(feed, user, db, parsed_feed)
+        if subscribed_feed.websub_hub is not None and subscribed_feed.websub_lease_expires_at is None:
+            await self.renew_websub()
+        return subscribed_feed
+
+    async def run_once(self) -> int:
+        await self.renew_websub()
+        db = self.session_factory()
+        try:
+            feeds = crud.get_due_feeds(db, datetime.utcnow())
+            if not feeds:
+                return 0
+            stats = await self.refresh(feeds, db)
+            self.stats.update(stats)
+            logging.info(
+                f"Refreshed {len(feeds)} feeds: {stats['updated']} updated, {stats['not_modified']} not modified, "
+                f"{stats['failed']} failed, cache hit rate {cache_hit_rate(stats):.0%} "
+                f"(overall {cache_hit_rate(self.stats):.0%})"
+            )
+            return len(feeds)
+        finally:
+            db.close()
+
+
+scheduler = FeedScheduler()
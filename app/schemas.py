@@ -108,3 +108,13 @@ class Summary(SummaryBase):
 
     class Config:
         orm_mode = True
+
+
+class ArticlesSeen(BaseModel):
+    article_ids: List[int]
+
+
+class ArticleBundle(Article):
+    """`Article` with the stored summary and tags asked for by `/articles?include=summary,tags`"""
+    summary: Optional[str]
+    tags: Optional[List[str]]
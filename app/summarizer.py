@@ -0,0 +1,199 @@
+import asyncio
+import json
+import logging
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app import crud, models, schemas
+from app.config import settings
+from app.database import session
+from app.utils.aiapi import AIClient, TAGS_AND_SUMMARY_PROMPT_VERSION, ai_client
+from app.utils.ratelimit import TokenBucket
+from app.utils.text import content_hash
+
+
+class SummaryCache:
+    """
+    Tags and summaries by normalized content hash, model and prompt version: an in-process LRU in front of
+    the `llm_result` table, so the same story syndicated by several feeds costs one completion.
+    Concurrent requests for the same content wait for the completion already in flight.
+    """
+
+    def __init__(self, maxsize: int = settings.SUMMARY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.stats = Counter()
+        self._entries: "OrderedDict[str, Tuple[List[str], str]]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Task] = {}
+
+    @staticmethod
+    def key(text: str, client: AIClient) -> str:
+        return content_hash(text, client.model, TAGS_AND_SUMMARY_PROMPT_VERSION)
+
+    def _put(self, key: str, result: Tuple[List[str], str]) -> None:
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def get(self, key: str, db: Session) -> Optional[Tuple[List[str], str]]:
+        result = self._entries.get(key)
+        if result is not None:
+            self._entries.move_to_end(key)
+            self.stats["memory_hits"] += 1
+            return result
+        stored = crud.get_llm_result(key, db)
+        if stored is not None:
+            result = json.loads(stored.tags), stored.summary
+            self._put(key, result)
+            self.stats["db_hits"] += 1
+        return result
+
+    async def get_or_generate(self, text: str, db: Session, client: AIClient) -> Tuple[List[str], str]:
+        key = self.key(text, client)
+        result = self.get(key, db)
+        if result is not None:
+            return result
+        if key in self._pending:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(self._pending[key])
+
+        self.stats["misses"] += 1
+        task = asyncio.ensure_future(self._generate(key, text, db, client))
+        self._pending[key] = task
+        try:
+            return await task
+        finally:
+            del self._pending[key]
+
+    async def _generate(self, key: str, text: str, db: Session, client: AIClient) -> Tuple[List[str], str]:
+        tags, summary = await client.generate_tags_and_summary(text)
+        crud.save_llm_result(key, client.model, TAGS_AND_SUMMARY_PROMPT_VERSION, tags, summary, db)
+        self._put(key, (tags, summary))
+        return tags, summary
+
+    def prune(self, db: Session, max_age_days: int = settings.SUMMARY_CACHE_TTL_DAYS) -> int:
+        """Drop stored results unused for `max_age_days`."""
+        return crud.prune_llm_results(datetime.utcnow() - timedelta(days=max_age_days), db)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.stats.clear()
+
+    def metrics(self) -> dict:
+        hits = self.stats["memory_hits"] + self.stats["db_hits"] + self.stats["coalesced"]
+        lookups = hits + self.stats["misses"]
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": hits,
+            "memory_hits": self.stats["memory_hits"],
+            "db_hits": self.stats["db_hits"],
+            "coalesced": self.stats["coalesced"],
+            "misses": self.stats["misses"],
+            "evictions": self.stats["evictions"],
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+
+summary_cache = SummaryCache()
+
+
+async def summarize_article(article: models.Article, db: Session, bundle: Optional[crud.ArticleBundle] = None):
+    """
+    Stored tags and summary of `article`, generating whatever is missing.
+
+    :param bundle: the stored tags and summary if already loaded with `crud.get_article_bundles`
+    :return: (summary_obj, tags)
+    """
+    if bundle is None:
+        tags = crud.get_tags_by_article_id(db, article_id=article.id)
+        summary_obj = crud.get_summary_by_article_id(db, article_id=article.id)
+    else:
+        tags, summary_obj = bundle.tags, bundle.summary
+    if not tags or not summary_obj:
+        generated_tags, summary = await summary_cache.get_or_generate(article.content or article.title, db, ai_client)
+        if not tags:
+            tags = crud.associate_tags_with_article(db, article, generated_tags)
+        if not summary_obj:
+            summary_create = schemas.SummaryCreate(content=summary)
+            summary_obj = crud.create_summary(db, summary_create, article_id=article.id)
+    return summary_obj, tags
+
+
+class SummaryWorkerPool:
+    """
+    Drains the `summary_job` table filled at ingestion when settings.SUMMARIZE_ON_INGEST is set,
+    so `/cats` finds tags and summaries already stored. The table is the queue, so nothing is lost on restart.
+    """
+
+    def __init__(
+            self,
+            session_factory=session,
+            workers: int = settings.SUMMARY_WORKERS,
+            rate_per_minute: float = settings.SUMMARY_RATE_PER_MINUTE,
+            poll_interval: float = 5,
+    ):
+        self.session_factory = session_factory
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.rate_limit = TokenBucket(rate_per_minute / 60)
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        db = self.session_factory()
+        try:
+            recovered = crud.reset_running_summary_jobs(db)
+        finally:
+            db.close()
+        if recovered:
+            logging.info(f"Requeued {recovered} interrupted summary jobs")
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if not await self.run_once():
+                    await asyncio.sleep(self.poll_interval)
+            except Exception as e:
+                logging.error(f"Summary worker failed: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    async def run_once(self) -> bool:
+        """
+        Claim and process one due job.
+
+        :return: False if there was none
+        """
+        db = self.session_factory()
+        try:
+            # claiming doesn't await, so workers of this pool never claim the same job
+            job: Optional[models.SummaryJob] = crud.claim_summary_job(db, datetime.utcnow())
+            if job is None:
+                return False
+            try:
+                await self.rate_limit.acquire()
+                article = db.get(models.Article, job.article_id)
+                await summarize_article(article, db)
+                crud.complete_summary_job(job, db)
+            except Exception as e:
+                db.rollback()
+                logging.error(f"Error summarizing article {job.article_id}: {e}")
+                crud.fail_summary_job(job, str(e), db)
+            return True
+        finally:
+            db.close()
+
+
+summary_workers = SummaryWorkerPool()
@@ -1,40 +1,117 @@
-from typing import Tuple, List
+import asyncio
+import json
+from typing import Tuple, List, Optional
 
-import openai
+import httpx
 from app.config import settings
+from app.utils.text import count_tokens, split_tokens, strip_html, truncate_tokens
 
-openai.api_key = settings.OPEN_AI_KEY
 
+# bump whenever TAGS_AND_SUMMARY_PROMPT changes, cached results of older prompts are not reused
+TAGS_AND_SUMMARY_PROMPT_VERSION = "2"
+TAGS_AND_SUMMARY_PROMPT = """Read the following text and reply with only a JSON object like
+{{"tags": ["tag1", "tag2", "tag3"], "summary": "..."}}
+where "tags" are 3 tags for the text and "summary" is a summary of it.
 
-def generate_tags_and_summary(text: str) -> Tuple[List[str], str]:
-    tags = generate_tags(text)
-    summary = generate_summary(text)
+Text:
+{text}"""
+CHUNK_SUMMARY_PROMPT = """Summarize the following part of a longer article in a few sentences:
+{text}"""
 
+
+def parse_tags_and_summary(completion: str) -> Tuple[List[str], str]:
+    """
+    :raise ValueError: if `completion` isn't the JSON object asked for by `TAGS_AND_SUMMARY_PROMPT`
+    """
+    start, end = completion.find("{"), completion.rfind("}")
+    try:
+        result = json.loads(completion[start:end + 1])
+        tags = [str(tag).strip() for tag in result["tags"] if str(tag).strip()]
+        summary = str(result["summary"]).strip()
+    except (ValueError, KeyError, TypeError):
+        raise ValueError(f"Unexpected completion: {completion!r}")
     return tags, summary
 
 
-def generate_summary(text):
-    summary_response = openai.Completion.create(
-        engine="text-davinci-003",
-        prompt=f"Create a summary of the following text:\n{text}",
-        max_tokens=500,
-        n=1,
-        stop=None,
-        temperature=0.5,
-    )
-    summary = summary_response.choices[0].text.strip()
-    return summary
-
-
-def generate_tags(text):
-    sep = ","
-    tags_response = openai.Completion.create(
-        engine="text-davinci-003",
-        prompt=f"Generate 3 tags for the following text, split with {sep}:\n{text}",
-        max_tokens=50,
-        n=1,
-        stop=None,
-        temperature=0.5,
-    )
-    tags = [tag.strip() for tag in tags_response.choices[0].text.split(sep)]
-    return tags
+class AIClient:
+    """
+    Async client of the OpenAI completions API on a pooled `httpx.AsyncClient`.
+    At most `concurrency` completions are in flight at once, however many commands ask for them.
+    """
+
+    def __init__(
+            self,
+            api_key: Optional[str] = settings.OPEN_AI_KEY,
+            base_url: str = settings.OPEN_AI_BASE_URL,
+            model: str = settings.OPEN_AI_MODEL,
+            concurrency: int = settings.OPEN_AI_CONCURRENCY,
+            input_tokens: int = settings.OPEN_AI_INPUT_TOKENS,
+            map_reduce_tokens: int = settings.OPEN_AI_MAP_REDUCE_TOKENS,
+            max_chunks: int = settings.OPEN_AI_MAX_CHUNKS,
+            timeout: float = settings.OPEN_AI_TIMEOUT,
+            transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.input_tokens = input_tokens
+        self.map_reduce_tokens = map_reduce_tokens
+        self.max_chunks = max_chunks
+        self.timeout = timeout
+        self.transport = transport
+        self._limit = asyncio.Semaphore(concurrency)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=httpx.Timeout(self.timeout),
+                transport=self.transport,
+            )
+        return self._client
+
+    async def complete(self, prompt: str, max_tokens: int) -> str:
+        async with self._limit:
+            response = await self.client.post("/completions", json={
+                "model": self.model,
+                "prompt": prompt,
+                "max_tokens": max_tokens,
+                "n": 1,
+                "temperature": 0.5,
+            })
+        response.raise_for_status()
+        return response.json()["choices"][0]["text"].strip()
+
+    async def generate_tags_and_summary(self, text: str) -> Tuple[List[str], str]:
+        """
+        Tags and summary from one completion instead of one completion each.
+        The prompt gets the text of `text` without markup, cut to `input_tokens`; above `map_reduce_tokens`
+        the summaries of its chunks instead.
+        """
+        text = strip_html(text)
+        if count_tokens(text) > self.map_reduce_tokens:
+            text = await self.summarize_chunks(text)
+        prompt = TAGS_AND_SUMMARY_PROMPT.format(text=truncate_tokens(text, self.input_tokens))
+        return parse_tags_and_summary(await self.complete(prompt, max_tokens=550))
+
+    async def summarize_chunks(self, text: str) -> str:
+        """
+        Summaries of the first `max_chunks` chunks of `input_tokens`, requested concurrently,
+        short enough to fit `input_tokens` together.
+        """
+        chunks = split_tokens(text, self.input_tokens)[:self.max_chunks]
+        max_tokens = max(64, self.input_tokens // len(chunks))
+        summaries = await asyncio.gather(
+            *(self.complete(CHUNK_SUMMARY_PROMPT.format(text=chunk), max_tokens=max_tokens) for chunk in chunks))
+        return "\n".join(summaries)
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+ai_client = AIClient()
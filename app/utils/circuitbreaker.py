@@ -0,0 +1,62 @@
+import time
+from typing import Optional
+
+
+class CircuitBreaker:
+    """
+    Closed until `threshold` failures in a row, then open: calls are refused for `cooldown` seconds.
+    After that it is half open and lets one trial call through per `cooldown`, a success closes it.
+    """
+
+    def __init__(self, threshold: int = 5, cooldown: float = 300):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._open_until: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self._open_until is None:
+            return "closed"
+        return "open" if time.monotonic() < self._open_until else "half_open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open":
+            # the trial call, the next one waits for another cooldown unless this one succeeds
+            self._open_until = time.monotonic() + self.cooldown
+            return True
+        self.rejected += 1
+        return False
+
+    def retry_in(self) -> float:
+        return max(0.0, self._open_until - time.monotonic()) if self._open_until is not None else 0.0
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self._open_until = None
+
+    def record_failure(self, retry_after: Optional[float] = None) -> None:
+        """
+
+        :param retry_after: seconds the other side asked us to wait, opens the breaker at once
+        """
+        self.failures += 1
+        if self.failures >= self.threshold or retry_after:
+            if self.state == "closed":
+                self.opened += 1
+            self._open_until = time.monotonic() + max(self.cooldown if self.failures >= self.threshold else 0,
+                                                      retry_after or 0)
+
+    def metrics(self) -> dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+            "retry_in": round(self.retry_in(), 1),
+        }
@@ -0,0 +1,20 @@
+import base64
+from datetime import datetime
+from typing import Tuple
+
+
+def encode_cursor(updated_at: datetime, row_id: int) -> str:
+    raw = f"{updated_at.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    :raise ValueError: if `cursor` wasn't made by `encode_cursor`
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        updated_at, row_id = raw.split("|")
+        return datetime.fromisoformat(updated_at), int(row_id)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
@@ -0,0 +1,140 @@
+import re
+from html.entities import name2codepoint
+from typing import List, Optional
+from xml.etree.ElementTree import Element, ParseError, XMLPullParser
+
+from feedparser import FeedParserDict
+from feedparser.sanitizer import _sanitize_html
+
+RDF_ABOUT = "{http://www.w3.org/1999/02/22-rdf-syntax-ns#}about"
+CONTAINERS = {"channel", "feed"}
+ENTRIES = {"item", "entry"}
+# feedparser's names of the entry fields `crud._article_from_entry` and `polling` read
+ENTRY_FIELDS = {"title": "title", "link": "link", "description": "summary", "summary": "summary",
+                "encoded": "content", "content": "content", "pubDate": "published", "published": "published",
+                "date": "published", "updated": "updated", "modified": "updated", "guid": "id", "id": "id"}
+# the markup feedparser cleans of scripts, event handlers and the like
+HTML_FIELDS = ("summary", "content")
+CHANNEL_FIELDS = {"title": "title", "ttl": "ttl", "updatePeriod": "sy_updateperiod",
+                  "updateFrequency": "sy_updatefrequency"}
+ENTITY_RE = re.compile(rb"&([A-Za-z][A-Za-z0-9]{1,31});")
+XML_ENTITIES = {"amp", "lt", "gt", "quot", "apos"}
+
+
+def _numeric_entity(match: re.Match) -> bytes:
+    name = match.group(1).decode()
+    if name in XML_ENTITIES or name not in name2codepoint:
+        return match.group(0)
+    return b"&#%d;" % name2codepoint[name]
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _text(element: Element) -> str:
+    return (element.text or "").strip()
+
+
+def _link(element: Element) -> Optional[dict]:
+    # RSS <link>url</link>, Atom <link rel="..." href="url"/>
+    href = element.get("href") or _text(element)
+    if not href:
+        return None
+    return {"rel": element.get("rel", "alternate"), "href": href}
+
+
+class FeedStreamParser:
+    """
+    Incremental RSS 1.0/2.0 and Atom parser for feeds too large to hold in memory.
+
+    `feed()` the body as it arrives and get back the entries completed by that chunk, in a subset of
+    feedparser's format. Every entry is dropped from the tree once returned, so memory doesn't grow
+    with the size of the feed. Channel metadata accumulates in `channel`.
+    """
+
+    def __init__(self):
+        self._parser = XMLPullParser(events=("start", "end"))
+        self._stack: List[Element] = []
+        self.channel = FeedParserDict(links=[])
+        self.bozo = False
+        self._tail = b""
+
+    def feed(self, data: bytes) -> List[FeedParserDict]:
+        if self.bozo:
+            return []
+        data = self._tail + data
+        # an entity reference may be cut in two by the end of the chunk
+        cut = data.rfind(b"&")
+        if cut != -1 and b";" not in data[cut:] and len(data) - cut <= 32:
+            data, self._tail = data[:cut], data[cut:]
+        else:
+            self._tail = b""
+        try:
+            # HTML's named entities are undefined in XML, but common in feeds (&nbsp;, &eacute;)
+            self._parser.feed(ENTITY_RE.sub(_numeric_entity, data))
+        except ParseError:
+            # keep the entries seen so far, like feedparser's bozo documents
+            self.bozo = True
+            return []
+        return self._entries()
+
+    def close(self) -> List[FeedParserDict]:
+        if not self.bozo:
+            try:
+                self._parser.feed(self._tail)
+                self._parser.close()
+            except ParseError:
+                self.bozo = True
+                return []
+        return self._entries()
+
+    def _entries(self) -> List[FeedParserDict]:
+        entries = []
+        for event, element in self._parser.read_events():
+            if event == "start":
+                self._stack.append(element)
+                continue
+            self._stack.pop()
+            parent = self._stack[-1] if self._stack else None
+            name = _local(element.tag)
+            if name in ENTRIES:
+                entries.append(self._entry(element))
+            elif parent is not None and _local(parent.tag) in CONTAINERS:
+                self._channel_field(name, element)
+            else:
+                continue
+            # done with it, e.g. RSS 1.0's <items> table of contents can be as long as the feed
+            if parent is not None:
+                parent.remove(element)
+        return entries
+
+    def _channel_field(self, name: str, element: Element):
+        if name == "link":
+            link = _link(element)
+            if link is not None:
+                self.channel.links.append(link)
+                if link["rel"] == "alternate":
+                    self.channel.setdefault("link", link["href"])
+        elif name in CHANNEL_FIELDS:
+            self.channel.setdefault(CHANNEL_FIELDS[name], _text(element))
+
+    @staticmethod
+    def _entry(element: Element) -> FeedParserDict:
+        entry = FeedParserDict()
+        for child in element:
+            name = _local(child.tag)
+            if name == "link":
+                link = _link(child)
+                if link is not None and link["rel"] == "alternate":
+                    entry.setdefault("link", link["href"])
+            elif name in ENTRY_FIELDS and _text(child):
+                entry.setdefault(ENTRY_FIELDS[name], _text(child))
+        for field in HTML_FIELDS:
+            if field in entry:
+                entry[field] = _sanitize_html(entry[field], "utf-8", "text/html")
+        if "summary" not in entry and "content" in entry:
+            entry["summary"] = entry["content"]
+        if "link" not in entry and element.get(RDF_ABOUT):
+            entry["link"] = element.get(RDF_ABOUT)
+        return entry
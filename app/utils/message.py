@@ -1,8 +1,20 @@
+import asyncio
 import re
-from typing import Optional
+from collections import Counter, OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, Iterable, List, Optional
 
 from discord import Message
 
+from app.utils.ratelimit import TokenBucket
+
+# characters of a message's content
+MESSAGE_LIMIT = 2000
+# Discord lets a bot post about 5 messages per 5 seconds to one channel
+CHANNEL_RATE = 1
+CHANNEL_BURST = 5
+# channels a `SendQueue` keeps pacing state for once they are idle
+MAX_CHANNELS = 10000
+
 
 def extract_url_from_message(message: Message) -> Optional[str]:
     return extract_url_from_string(message.content)
@@ -11,3 +23,93 @@ def extract_url_from_string(string: str) -> Optional[str]:
     urls = re.findall(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+',
                       string)
     return urls[0] if urls else None
+
+
+def split_text(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """
+    `text` in pieces of at most `limit` characters, cut at the last paragraph break, line break or space
+    that fits, so urls and words stay whole.
+    """
+    pieces = []
+    while len(text) > limit:
+        window = text[:limit + 1]
+        for separator in ("\n\n", "\n", " "):
+            cut = window.rfind(separator)
+            if cut > 0:
+                break
+        else:
+            cut = limit
+        pieces.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text:
+        pieces.append(text)
+    return pieces
+
+
+def pack_messages(blocks: Iterable[str], separator: str = "\n", limit: int = MESSAGE_LIMIT) -> List[str]:
+    """
+    `blocks` (e.g. one per article) in order, in as few messages of at most `limit` characters as possible.
+    A block only spans messages when it is longer than `limit` by itself.
+    """
+    messages = []
+    current = ""
+    for block in blocks:
+        for piece in split_text(block, limit):
+            if current and len(current) + len(separator) + len(piece) <= limit:
+                current = f"{current}{separator}{piece}"
+            else:
+                if current:
+                    messages.append(current)
+                current = piece
+    if current:
+        messages.append(current)
+    return messages
+
+
+class SendQueue:
+    """
+    Sends the messages of each channel one at a time and in order, paced by a token bucket per channel so
+    a long answer doesn't run into Discord's rate limit. Channels don't wait for each other.
+    The least recently used channels beyond `max_channels` are forgotten once idle.
+    """
+
+    def __init__(self, rate: float = CHANNEL_RATE, burst: int = CHANNEL_BURST, max_channels: int = MAX_CHANNELS):
+        self.rate = rate
+        self.burst = burst
+        self.max_channels = max_channels
+        self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        self._pending = Counter()
+
+    def _prune(self) -> None:
+        # idle: nothing waiting to be sent and the bucket refilled, so dropping it doesn't loosen the pacing
+        while len(self._buckets) >= self.max_channels:
+            channel, bucket = next(iter(self._buckets.items()))
+            if self._pending[channel] or not bucket.full():
+                return
+            del self._buckets[channel], self._locks[channel]
+
+    async def send(self, channel: Hashable, send: Callable[[str], Awaitable], content: str):
+        """
+
+        :param channel: the rate limit bucket, e.g. the channel id
+        :param send: e.g. `ctx.respond`
+        """
+        if channel not in self._locks:
+            self._prune()
+            self._locks[channel] = asyncio.Lock()
+            self._buckets[channel] = TokenBucket(self.rate, self.burst)
+        self._buckets.move_to_end(channel)
+        self._pending[channel] += 1
+        try:
+            async with self._locks[channel]:
+                await self._buckets[channel].acquire()
+                return await send(content)
+        finally:
+            self._pending[channel] -= 1
+            if not self._pending[channel]:
+                del self._pending[channel]
+
+    async def send_all(self, channel: Hashable, send: Callable[[str], Awaitable], messages: Iterable[str]):
+        for message in messages:
+            await self.send(channel, send, message)
@@ -0,0 +1,71 @@
+from datetime import datetime
+from typing import List, Optional
+
+UPDATE_PERIODS = {"hourly": 3600, "daily": 86400, "weekly": 7 * 86400, "monthly": 30 * 86400,
+                  "yearly": 365 * 86400}
+# weight of the latest observation in the average interval between new entries
+SMOOTHING = 0.3
+MAX_BACKOFF_EXPONENT = 10
+
+
+def hint_interval(feed_info) -> Optional[int]:
+    """
+    Seconds between polls the publisher asks for: RSS `<ttl>` (minutes), else `sy:updatePeriod`
+    divided by `sy:updateFrequency`.
+
+    :param feed_info: `parsed_feed.feed` of feedparser
+    """
+    try:
+        ttl = int(feed_info.get("ttl") or 0)
+    except ValueError:
+        ttl = 0
+    if ttl > 0:
+        return ttl * 60
+    period = UPDATE_PERIODS.get(str(feed_info.get("sy_updateperiod", "")).strip().lower())
+    if period is None:
+        return None
+    try:
+        frequency = max(int(feed_info.get("sy_updatefrequency") or 1), 1)
+    except ValueError:
+        frequency = 1
+    return period // frequency
+
+
+def initial_entry_interval(published: List[datetime]) -> Optional[int]:
+    """Average seconds between the entries of a feed seen for the first time."""
+    if len(published) < 2:
+        return None
+    return max(int((max(published) - min(published)).total_seconds() / (len(published) - 1)), 1)
+
+
+def update_entry_interval(average: Optional[int], last_new_entry_at: Optional[datetime], new_entries: int,
+                          now: datetime) -> Optional[int]:
+    """`average` after `new_entries` new entries were found at `now`."""
+    if not new_entries or last_new_entry_at is None:
+        return average
+    observed = (now - last_new_entry_at).total_seconds() / new_entries
+    if average is None:
+        return max(int(observed), 1)
+    return max(int(average * (1 - SMOOTHING) + observed * SMOOTHING), 1)
+
+
+def next_poll_interval(default: int, minimum: int, maximum: int, entry_interval: Optional[int] = None,
+                       last_new_entry_at: Optional[datetime] = None, hint: Optional[int] = None,
+                       error_count: int = 0, now: Optional[datetime] = None) -> int:
+    """
+    Seconds until the next poll: twice per average interval between new entries, slower while the feed is
+    quieter than usual, never more often than `hint`, within [`minimum`, `maximum`], doubled per failed poll.
+    """
+    interval = default
+    if entry_interval is not None:
+        interval = entry_interval / 2
+        if last_new_entry_at is not None and now is not None:
+            silence = (now - last_new_entry_at).total_seconds()
+            if silence > entry_interval:
+                interval = silence / 2
+    if hint is not None:
+        interval = max(interval, hint)
+    interval = min(max(interval, minimum), maximum)
+    if error_count:
+        interval = min(interval * 2 ** min(error_count, MAX_BACKOFF_EXPONENT), maximum)
+    return int(interval)
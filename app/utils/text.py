@@ -0,0 +1,72 @@
+import hashlib
+import html
+import re
+from typing import List
+
+TAG_RE = re.compile(r"<[^>]+>")
+# dropped with their content
+INVISIBLE_RE = re.compile(r"<(script|style|noscript)\b.*?</\1\s*>|<!--.*?-->", re.IGNORECASE | re.DOTALL)
+WHITESPACE_RE = re.compile(r"\s+")
+WORD_RE = re.compile(r"\w+")
+# one CJK character, a run of word characters or one punctuation mark
+TOKEN_RE = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]|\w+|[^\w\s]")
+CHARS_PER_TOKEN = 4
+
+
+def strip_html(text: str) -> str:
+    text = TAG_RE.sub(" ", INVISIBLE_RE.sub(" ", text or ""))
+    return WHITESPACE_RE.sub(" ", html.unescape(text)).strip()
+
+
+def normalize_tag(name: str) -> str:
+    """`"#Machine  Learning "` -> `"machine learning"`"""
+    return " ".join(str(name).strip().lstrip("#").split()).lower()
+
+
+def content_hash(text: str, *salt: str) -> str:
+    """
+    sha256 of the words of `text`, ignoring markup, case, punctuation and whitespace, so the same story
+    syndicated by different feeds hashes the same. `salt` (model, prompt version...) is part of the hash.
+    """
+    normalized = " ".join(WORD_RE.findall(strip_html(text).lower()))
+    return hashlib.sha256("\0".join((normalized, *salt)).encode()).hexdigest()
+
+
+def _token_spans(text: str):
+    """(end offset, tokens) of each piece of `text`, words cost one token per `CHARS_PER_TOKEN` characters."""
+    for match in TOKEN_RE.finditer(text):
+        yield match.end(), -(-len(match.group()) // CHARS_PER_TOKEN)
+
+
+def count_tokens(text: str) -> int:
+    """
+    Estimate of the number of tokens of `text` for the OpenAI BPE tokenizers: ~4 characters of
+    English per token, one token per CJK character. Good enough for budgets, no tokenizer needed.
+    """
+    return sum(tokens for _, tokens in _token_spans(text))
+
+
+def truncate_tokens(text: str, budget: int) -> str:
+    """The start of `text` with at most `budget` tokens."""
+    total, end = 0, 0
+    for end_offset, tokens in _token_spans(text):
+        if total + tokens > budget:
+            return text[:end].rstrip()
+        total += tokens
+        end = end_offset
+    return text
+
+
+def split_tokens(text: str, size: int) -> List[str]:
+    """`text` in consecutive chunks of at most `size` tokens, split after a sentence where possible."""
+    chunks = []
+    while text:
+        chunk = truncate_tokens(text, size)
+        if len(chunk) < len(text):
+            sentence_end = max(chunk.rfind(". "), chunk.rfind("。"))
+            if sentence_end > len(chunk) // 2:
+                chunk = chunk[:sentence_end + 1]
+            chunk = chunk or text[:1]
+        chunks.append(chunk.strip())
+        text = text[len(chunk):].lstrip()
+    return chunks
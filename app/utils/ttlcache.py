@@ -0,0 +1,50 @@
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Hashable
+
+
+class TTLCache:
+    """
+    At most `maxsize` entries, least recently used first out, each expiring `ttl` seconds after it was set.
+    A `ttl` of 0 disables the cache.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (expires at, value)
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.stats = Counter()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] <= time.monotonic():
+            del self._entries[key]
+            self.stats["expired"] += 1
+            entry = None
+        if entry is None:
+            self.stats["misses"] += 1
+            return default
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        if self._entries.pop(key, None) is not None:
+            self.stats["invalidations"] += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def metrics(self) -> dict:
+        return {"size": len(self._entries), **{name: self.stats[name] for name in
+                                               ("hits", "misses", "expired", "evictions", "invalidations")}}
@@ -0,0 +1,95 @@
+import hashlib
+import hmac
+import secrets
+from typing import Optional, Tuple
+
+import httpx
+
+from app.config import settings
+from app.fetcher import USER_AGENT
+
+# algorithms a hub may sign pushed content with, `X-Hub-Signature: sha256=<hex>`
+SIGNATURE_METHODS = ("sha1", "sha256", "sha384", "sha512")
+
+
+def discover(parsed_feed) -> Optional[Tuple[str, Optional[str]]]:
+    """
+    `(hub, topic)` of a feed advertising a WebSub hub: its `<link rel="hub">` and `<link rel="self">` urls.
+
+    :param parsed_feed: a feedparser document
+    """
+    links = parsed_feed.get("feed", {}).get("links", [])
+    hrefs = {}
+    for link in links:
+        if link.get("href"):
+            hrefs.setdefault(link.get("rel"), link["href"])
+    if "hub" not in hrefs:
+        return None
+    return hrefs["hub"], hrefs.get("self")
+
+
+def new_secret() -> str:
+    return secrets.token_hex(32)
+
+
+def verify_signature(secret: str, body: bytes, signature: Optional[str]) -> bool:
+    """
+
+    :param signature: the `X-Hub-Signature` header of a push
+    """
+    method, _, digest = (signature or "").partition("=")
+    if method not in SIGNATURE_METHODS or not digest:
+        return False
+    expected = hmac.new(secret.encode(), body, getattr(hashlib, method)).hexdigest()
+    return hmac.compare_digest(expected, digest)
+
+
+class WebSubSubscriber:
+    """
+    Asks hubs to push feeds to `{callback_url}/{feed_id}`. A request only starts the subscription,
+    the hub confirms it with a verification request to the callback route, see `/websub/{feed_id}` in main.py.
+    """
+
+    def __init__(self, callback_url: str = settings.WEBSUB_CALLBACK_URL,
+                 lease_seconds: int = settings.WEBSUB_LEASE_SECONDS, timeout: float = settings.FEED_FETCH_TIMEOUT,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.callback_url = callback_url.rstrip("/")
+        self.lease_seconds = lease_seconds
+        self.timeout = timeout
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def enabled(self) -> bool:
+        # hubs can't reach us without a public callback url
+        return bool(self.callback_url)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(timeout=httpx.Timeout(self.timeout), headers={"User-Agent": USER_AGENT},
+                                             transport=self.transport)
+        return self._client
+
+    async def request(self, feed_id: int, hub: str, topic: str, secret: Optional[str] = None,
+                      mode: str = "subscribe") -> None:
+        """
+
+        :param mode: "subscribe" or "unsubscribe"
+        :raise httpx.HTTPError: the hub refused or couldn't be reached
+        """
+        data = {"hub.mode": mode, "hub.topic": topic, "hub.callback": f"{self.callback_url}/{feed_id}"}
+        if mode == "subscribe":
+            data["hub.lease_seconds"] = str(self.lease_seconds)
+            if secret:
+                data["hub.secret"] = secret
+        response = await self.client.post(hub, data=data)
+        response.raise_for_status()
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+subscriber = WebSubSubscriber()
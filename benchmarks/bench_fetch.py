@@ -0,0 +1,96 @@
+"""
+Sequential `feedparser.parse(url)` vs. `FeedFetcher.fetch_many` against a local stub server.
+
+    python -m benchmarks.bench_fetch --feeds 200 --delay 0.05
+"""
+import argparse
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import feedparser
+
+from app.fetcher import FeedFetcher
+from app.models import Feed
+
+
+def make_feed(index: int, entries: int = 20) -> bytes:
+    items = "".join(
+        f"<item><title>Feed {index} article {i}</title><link>http://stub/{index}/{i}</link>"
+        f"<description>Article {i} of feed {index}</description>"
+        f"<pubDate>Mon, 27 Mar 2023 10:00:00 GMT</pubDate></item>"
+        for i in range(entries)
+    )
+    return (f'<?xml version="1.0"?><rss version="2.0"><channel><title>Feed {index}</title>'
+            f'<link>http://stub/{index}</link><description>stub</description>{items}</channel></rss>').encode()
+
+
+def start_stub_server(feeds: int, delay: float) -> ThreadingHTTPServer:
+    documents = {f"/{i}.xml": make_feed(i) for i in range(feeds)}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            time.sleep(delay)
+            body = documents.get(self.path)
+            self.send_response(200 if body else 404)
+            self.send_header("Content-Type", "application/rss+xml")
+            self.send_header("Content-Length", str(len(body or b"")))
+            self.end_headers()
+            self.wfile.write(body or b"")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bench_sequential(urls):
+    start = time.perf_counter()
+    for url in urls:
+        assert feedparser.parse(url).entries
+    return time.perf_counter() - start
+
+
+async def bench_concurrent(urls, per_host: int):
+    # every stub feed is on the same host, only the concurrency cap is measured
+    fetcher = FeedFetcher(per_host=per_host, host_rate=0)
+    try:
+        start = time.perf_counter()
+        results = await fetcher.fetch_many([Feed(url=url) for url in urls])
+        elapsed = time.perf_counter() - start
+    finally:
+        await fetcher.aclose()
+    assert all(not isinstance(result, Exception) for result in results.values())
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--feeds", type=int, default=200)
+    parser.add_argument("--delay", type=float, default=0.05, help="simulated server latency in seconds")
+    parser.add_argument("--per-host", type=int, default=32)
+    args = parser.parse_args()
+
+    server = start_stub_server(args.feeds, args.delay)
+    host, port = server.server_address
+    urls = [f"http://{host}:{port}/{i}.xml" for i in range(args.feeds)]
+    try:
+        sequential = bench_sequential(urls)
+        concurrent = asyncio.run(bench_concurrent(urls, args.per_host))
+    finally:
+        server.shutdown()
+
+    print(f"{args.feeds} feeds, {args.delay * 1000:.0f}ms server latency")
+    print(f"sequential feedparser.parse: {sequential:.2f}s")
+    print(f"FeedFetcher.fetch_many (per_host={args.per_host}): {concurrent:.2f}s")
+    print(f"speedup: {sequential / concurrent:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Per-entry ingestion (the old `update_feed_articles`) vs. `crud.ingest_feed_entries` on one big feed.
+
+    python -m benchmarks.bench_ingest --entries 1000 --database-url sqlite:///bench.db
+"""
+import argparse
+import time
+from datetime import datetime
+
+import feedparser
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, models
+from app.utils.dateutils import date_from_string
+
+
+def legacy_update_feed_articles(feed, entries, db):
+    for entry in entries:
+        db_article = db.query(models.Article).filter(models.Article.url == entry.link).first()
+        if db_article is None:
+            db_article = models.Article(
+                title=entry.title,
+                url=entry.link,
+                content=entry.summary,
+                published_at=date_from_string(entry.published),
+                created_at=datetime.utcnow(),
+                updated_at=datetime.utcnow(),
+            )
+            db.add(db_article)
+            db.commit()
+            db.refresh(db_article)
+
+            feed_article = models.FeedArticle(
+                feed_id=feed.id,
+                article_id=db_article.id,
+                created_at=datetime.utcnow(),
+                updated_at=datetime.utcnow(),
+            )
+            db.add(feed_article)
+            db.commit()
+            db.refresh(feed_article)
+
+
+def bulk_update_feed_articles(feed, entries, db):
+    crud.ingest_feed_entries(feed, entries, db)
+    db.commit()
+
+
+def make_entries(count: int):
+    items = "".join(
+        f"<item><title>Article {i}</title><link>https://example.com/articles/{i}</link>"
+        f"<description>Content of article {i}</description>"
+        f"<pubDate>Mon, 27 Mar 2023 10:00:00 GMT</pubDate></item>"
+        for i in range(count)
+    )
+    return feedparser.parse(f'<rss version="2.0"><channel><title>Bench</title>{items}</channel></rss>').entries
+
+
+def run(func, entries, database_url):
+    engine = create_engine(database_url)
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    db = sessionmaker(bind=engine)()
+    try:
+        feed = models.Feed(title="Bench", url="https://example.com/feed.xml", created_at=datetime.utcnow(),
+                           updated_at=datetime.utcnow())
+        db.add(feed)
+        db.commit()
+        db.refresh(feed)
+        statements.clear()
+
+        start = time.perf_counter()
+        func(feed, entries, db)
+        first = time.perf_counter() - start
+        first_statements = len(statements)
+
+        # the common case: every entry is already stored
+        statements.clear()
+        start = time.perf_counter()
+        func(feed, entries, db)
+        second = time.perf_counter() - start
+        return first, first_statements, second, len(statements)
+    finally:
+        db.close()
+        models.Base.metadata.drop_all(bind=engine)
+        engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=1000)
+    parser.add_argument("--database-url", default="sqlite:///bench_ingest.db")
+    args = parser.parse_args()
+
+    entries = make_entries(args.entries)
+    print(f"{args.entries} entries on {args.database_url}")
+    for name, func in (("per-entry", legacy_update_feed_articles), ("bulk", bulk_update_feed_articles)):
+        first, first_statements, second, second_statements = run(func, entries, args.database_url)
+        print(f"{name:>9}: new feed {first * 1000:8.1f}ms / {first_statements:5} statements, "
+              f"unchanged feed {second * 1000:8.1f}ms / {second_statements:5} statements")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Unread articles of a user: an anti-join of the timeline with the whole read history vs. `crud.get_unread_page`'s
+high-water mark, and recording a page as seen row by row vs. `crud.mark_articles_seen`.
+
+    python -m benchmarks.bench_read_state
+    python -m benchmarks.bench_read_state --feed-articles 100000 --users 1000 --database-url sqlite:///bench.db
+
+Every user follows `--subscriptions` random feeds. The `--sample` users timed have read all of their timeline
+but the newest `--unread` entries, the read history holds one row per entry read, and their last visit ended at
+the newest entry read.
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, desc, insert, select
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, models
+
+BATCH = 50000
+
+
+def anti_join_statement(user_id: int, limit: int):
+    """Unread = the timeline without the articles in the user's read history, all of it."""
+    feed_ids = select(models.UserFeedSubscription.feed_id).where(models.UserFeedSubscription.user_id == user_id)
+    seen = select(models.RequestedArticle.id).where(models.RequestedArticle.user_id == user_id,
+                                                    models.RequestedArticle.article_id == models.FeedArticle.article_id)
+    return (
+        select(models.Article, models.FeedArticle.updated_at, models.FeedArticle.id)
+        .join(models.FeedArticle)
+        .where(models.FeedArticle.feed_id.in_(feed_ids), ~seen.exists())
+        .order_by(desc(models.FeedArticle.updated_at), desc(models.FeedArticle.id))
+        .limit(limit + 1)
+    )
+
+
+def high_water_mark(db, user_id: int, limit: int):
+    """The reads of `crud.get_unread_page`."""
+    head = tuple(db.execute(crud.timeline_head_statement(user_id)).first())
+    marker = db.get(models.ReadMarker, user_id)
+    return db.execute(crud.unread_page_statement(user_id, head, marker, limit)).all()
+
+
+def mark_seen_row_by_row(db, user_id: int, article_ids):
+    for article_id in article_ids:
+        seen = db.query(models.RequestedArticle).filter(models.RequestedArticle.user_id == user_id,
+                                                        models.RequestedArticle.article_id == article_id).first()
+        if seen is None:
+            now = datetime.utcnow()
+            db.add(models.RequestedArticle(user_id=user_id, article_id=article_id, created_at=now, updated_at=now))
+            db.commit()
+
+
+def insert_batches(connection, model, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH:
+            connection.execute(insert(model), batch)
+            batch = []
+    if batch:
+        connection.execute(insert(model), batch)
+
+
+def populate(engine, args, rng: random.Random):
+    start = datetime(2023, 1, 1)
+    per_feed = args.feed_articles // args.feeds
+    with engine.begin() as connection:
+        connection.execute(insert(models.Feed), [
+            dict(id=f + 1, title=f"Feed {f}", url=f"https://example.com/{f}.xml", created_at=start, updated_at=start)
+            for f in range(args.feeds)])
+        # entry i of feed f is the (i * feeds + f)th of all, so the feeds are interleaved in time
+        insert_batches(connection, models.Article, (
+            dict(id=i * args.feeds + f + 1, title=f"Article {f}/{i}", url=f"https://example.com/{f}/{i}",
+                 published_at=start, created_at=start, updated_at=start)
+            for i in range(per_feed) for f in range(args.feeds)))
+        insert_batches(connection, models.FeedArticle, (
+            dict(id=i * args.feeds + f + 1, feed_id=f + 1, article_id=i * args.feeds + f + 1,
+                 created_at=start, updated_at=start + timedelta(seconds=i * args.feeds + f))
+            for i in range(per_feed) for f in range(args.feeds)))
+        connection.execute(insert(models.User), [
+            dict(id=u + 1, username=f"user{u}", email=f"user{u}@example.com", password_hash="", created_at=start,
+                 updated_at=start) for u in range(args.users)])
+        subscriptions = {u + 1: rng.sample(range(1, args.feeds + 1), args.subscriptions) for u in range(args.users)}
+        insert_batches(connection, models.UserFeedSubscription, (
+            dict(user_id=user_id, feed_id=feed_id, created_at=start, updated_at=start)
+            for user_id, feed_ids in subscriptions.items() for feed_id in feed_ids))
+
+        newest_read = {}
+        for user_id in rng.sample(sorted(subscriptions), args.sample):
+            entries = sorted(
+                (i * args.feeds + feed_id for i in range(per_feed) for feed_id in subscriptions[user_id]),
+                reverse=True)
+            insert_batches(connection, models.RequestedArticle, (
+                dict(user_id=user_id, article_id=entry, created_at=start, updated_at=start)
+                for entry in entries[args.unread:]))
+            newest_read[user_id] = entries[args.unread]
+    return newest_read
+
+
+def timed(function, users):
+    times = []
+    for user_id in users:
+        begin = time.perf_counter()
+        function(user_id)
+        times.append((time.perf_counter() - begin) * 1000)
+    return statistics.mean(times), sorted(times)[int(len(times) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--feed-articles", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--feeds", type=int, default=1000)
+    parser.add_argument("--subscriptions", type=int, default=20, help="feeds followed by each user")
+    parser.add_argument("--sample", type=int, default=100, help="users timed")
+    parser.add_argument("--unread", type=int, default=30, help="newest entries the timed users haven't read")
+    parser.add_argument("--page", type=int, default=20)
+    parser.add_argument("--database-url", default="sqlite:///bench_read_state.db")
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    begin = time.perf_counter()
+    newest_read = populate(engine, args, random.Random(42))
+    sample = list(newest_read)
+    db = sessionmaker(bind=engine)()
+    for user_id, article_id in newest_read.items():
+        # the mark of the last visit, set the way `/news` and `POST /articles/seen` set it
+        crud.mark_articles_seen(user_id, [article_id], db, advance_marker=True)
+    history = db.query(models.RequestedArticle).count()
+    print(f"{args.feed_articles} feed articles, {args.users} users following {args.subscriptions} feeds each, "
+          f"{history} rows of read history, built in {time.perf_counter() - begin:.0f}s on {args.database_url}")
+
+    try:
+        for name, function in (
+                ("anti-join, whole history", lambda user_id: db.execute(anti_join_statement(user_id, args.page)).all()),
+                ("high-water mark", lambda user_id: high_water_mark(db, user_id, args.page))):
+            mean, p95 = timed(function, sample)
+            print(f"  unread page, {name:24}: mean {mean:8.2f}ms, p95 {p95:8.2f}ms")
+
+        pages = {user_id: [row[0].id for row in high_water_mark(db, user_id, args.page)][:args.page]
+                 for user_id in sample}
+        half = len(sample) // 2
+        for name, users, function in (
+                ("row by row", sample[:half], lambda user_id: mark_seen_row_by_row(db, user_id, pages[user_id])),
+                ("bulk", sample[half:], lambda user_id: crud.mark_articles_seen(user_id, pages[user_id], db))):
+            mean, p95 = timed(function, users)
+            print(f"  page of {args.page} seen, {name:18}: mean {mean:8.2f}ms, p95 {p95:8.2f}ms")
+    finally:
+        db.close()
+        models.Base.metadata.drop_all(bind=engine)
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Peak memory and time of fetching a very large feed (50MB by default): the whole body through feedparser vs.
+`FeedFetcher`'s incremental parsing, on first sight and on a refresh finding `--new` new entries on top.
+
+    python -m benchmarks.bench_stream
+    python -m benchmarks.bench_stream --megabytes 200 --new 20
+
+Memory is measured with tracemalloc, which slows both sides down by the same factor.
+"""
+import argparse
+import asyncio
+import time
+import tracemalloc
+
+import feedparser
+import httpx
+
+from app.fetcher import FeedFetcher
+
+CHUNK = 64 * 1024
+PARAGRAPH = ("Shelters across the region reported a sharp rise in cat adoptions over the holidays, "
+             "and volunteers spent the weekend cleaning up the riverbank near the old mill. ") * 10
+
+
+def make_archive(megabytes: int, new: int = 0) -> bytes:
+    """An RSS archive of about `megabytes`, newest first, with `new` entries on top of the same archive."""
+    item = ("<item><title>Article {i}</title><link>https://archive.example.com/{i}</link>"
+            "<description>&lt;p&gt;{text}&amp;nbsp;{i}&lt;/p&gt;</description>"
+            "<pubDate>Mon, 27 Mar 2023 10:00:00 GMT</pubDate></item>")
+    size = len(item.format(i=0, text=PARAGRAPH))
+    total = megabytes * 1024 * 1024 // size
+    items = "".join(item.format(i=i, text=PARAGRAPH) for i in range(total + new - 1, -1, -1))
+    return (f'<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel><title>Archive</title>'
+            f'<link>https://archive.example.com/</link><description>bench</description>{items}</channel></rss>'
+            ).encode()
+
+
+def serve(document: bytes) -> httpx.MockTransport:
+    async def handler(request: httpx.Request) -> httpx.Response:
+        async def body():
+            for i in range(0, len(document), CHUNK):
+                yield document[i:i + CHUNK]
+
+        return httpx.Response(200, content=body())
+
+    return httpx.MockTransport(handler)
+
+
+def measure(function):
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = function()
+        return result, time.perf_counter() - start, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def fetch(document: bytes, known=None):
+    async def run():
+        fetcher = FeedFetcher(transport=serve(document), host_rate=0)
+        try:
+            return await fetcher.fetch("https://archive.example.com/feed.xml", known=known)
+        finally:
+            await fetcher.aclose()
+
+    return asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--megabytes", type=int, default=50)
+    parser.add_argument("--new", type=int, default=10, help="entries published since the first fetch")
+    parser.add_argument("--skip-feedparser", action="store_true", help="feedparser takes minutes at 50MB")
+    args = parser.parse_args()
+
+    archive = make_archive(args.megabytes)
+    refreshed = make_archive(args.megabytes, args.new)
+    print(f"{len(refreshed) / 1024 / 1024:.0f}MB feed, {refreshed.count(b'<item>')} entries")
+
+    if not args.skip_feedparser:
+        parsed, elapsed, peak = measure(lambda: feedparser.parse(refreshed))
+        print(f"  feedparser.parse:        {len(parsed.entries):6} entries, {elapsed:6.2f}s, "
+              f"peak {peak / 1024 / 1024:7.1f}MB")
+
+    result, elapsed, peak = measure(lambda: fetch(archive))
+    print(f"  streamed, first fetch:   {len(result.parsed_feed.entries):6} entries, {elapsed:6.2f}s, "
+          f"peak {peak / 1024 / 1024:7.1f}MB")
+
+    # what the first fetch would have stored, had it kept every entry
+    stored = {f"https://archive.example.com/{i}" for i in range(archive.count(b"<item>"))}
+    result, elapsed, peak = measure(lambda: fetch(refreshed, known=lambda urls: stored.intersection(urls)))
+    print(f"  streamed, refresh:       {len(result.parsed_feed.entries):6} entries, {elapsed:6.2f}s, "
+          f"peak {peak / 1024 / 1024:7.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Timeline pages in the "query" mode (`feed_article` rows of the subscribed feeds) vs. the "materialized" mode
+(`timeline_entry` rows written at ingestion) at 10, 100 and 1,000 subscriptions, and what ingestion pays for it.
+
+    python -m benchmarks.bench_timeline
+    python -m benchmarks.bench_timeline --entries 200 --subscribers 5000 --database-url sqlite:///bench.db
+"""
+import argparse
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, models
+from app.config import settings
+
+SUBSCRIPTIONS = (10, 100, 1000)
+PAGE = 20
+
+
+def populate(engine, feeds: int, entries: int, subscribers: int):
+    start = datetime(2023, 1, 1)
+    with engine.begin() as connection:
+        connection.execute(insert(models.Feed), [
+            dict(id=f + 1, title=f"Feed {f}", url=f"https://example.com/{f}.xml", created_at=start, updated_at=start)
+            for f in range(feeds)])
+        # entry i of feed f is the (i * feeds + f)th of all, so the feeds are interleaved in time
+        rows = [dict(id=i * feeds + f + 1, title=f"Article {f}/{i}", url=f"https://example.com/{f}/{i}",
+                     published_at=start, created_at=start, updated_at=start)
+                for i in range(entries) for f in range(feeds)]
+        connection.execute(insert(models.Article), rows)
+        connection.execute(insert(models.FeedArticle), [
+            dict(id=row["id"], feed_id=(row["id"] - 1) % feeds + 1, article_id=row["id"], created_at=start,
+                 updated_at=start + timedelta(seconds=row["id"])) for row in rows])
+        # one reader per subscription count, following the first feeds, and the other subscribers of feed 1
+        users = [f"reader{count}" for count in SUBSCRIPTIONS] + [f"subscriber{u}" for u in range(subscribers)]
+        connection.execute(insert(models.User), [
+            dict(id=u + 1, username=name, email=f"{name}@example.com", password_hash="", created_at=start,
+                 updated_at=start) for u, name in enumerate(users)])
+        subscriptions = [dict(user_id=r + 1, feed_id=f + 1, created_at=start, updated_at=start)
+                         for r, count in enumerate(SUBSCRIPTIONS) for f in range(count)]
+        subscriptions += [dict(user_id=len(SUBSCRIPTIONS) + u + 1, feed_id=1, created_at=start, updated_at=start)
+                          for u in range(subscribers)]
+        connection.execute(insert(models.UserFeedSubscription), subscriptions)
+
+
+def timed_pages(db, user_id: int, mode: str, repeat: int):
+    """Mean milliseconds of the first page and of the page after 10 others."""
+    first, deep = [], []
+    for _ in range(repeat):
+        cursor = None
+        for page in range(11):
+            begin = time.perf_counter()
+            rows = db.execute(crud.feed_article_page_statement(user_id, cursor, PAGE, mode=mode)).all()
+            elapsed = (time.perf_counter() - begin) * 1000
+            _, cursor = crud.feed_article_page_from_rows(rows, PAGE)
+            if page == 0:
+                first.append(elapsed)
+        deep.append(elapsed)
+    return statistics.mean(first), statistics.mean(deep)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--feeds", type=int, default=1000)
+    parser.add_argument("--entries", type=int, default=100, help="per feed")
+    parser.add_argument("--subscribers", type=int, default=1000, help="of the feed refreshed in the ingestion run")
+    parser.add_argument("--new", type=int, default=20, help="new entries of the ingestion run")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--database-url", default="sqlite:///bench_timeline.db")
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    populate(engine, args.feeds, args.entries, args.subscribers)
+    db = sessionmaker(bind=engine)()
+    try:
+        begin = time.perf_counter()
+        crud.fill_timelines(db)
+        db.commit()
+        print(f"{args.feeds} feeds of {args.entries} entries on {args.database_url}, "
+              f"{db.query(models.TimelineEntry).count()} timeline entries materialized in "
+              f"{time.perf_counter() - begin:.1f}s")
+
+        for user_id, count in enumerate(SUBSCRIPTIONS, start=1):
+            for mode in ("query", "materialized"):
+                first, deep = timed_pages(db, user_id, mode, args.repeat)
+                print(f"  {count:5} subscriptions, {mode:12}: first page {first:8.2f}ms, 11th page {deep:8.2f}ms")
+
+        feed = db.get(models.Feed, 1)
+        for batch, mode in enumerate(("query", "materialized")):
+            settings.TIMELINE_MODE = mode
+            entries = [{"title": f"New {batch}/{i}", "link": f"https://example.com/new/{batch}/{i}"}
+                       for i in range(args.new)]
+            begin = time.perf_counter()
+            crud.ingest_feed_entries(feed, entries, db)
+            db.commit()
+            print(f"  ingest {args.new} entries of a feed with {args.subscribers + len(SUBSCRIPTIONS)} subscribers, "
+                  f"{mode:12}: {(time.perf_counter() - begin) * 1000:8.2f}ms")
+    finally:
+        db.close()
+        models.Base.metadata.drop_all(bind=engine)
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
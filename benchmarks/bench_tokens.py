@@ -0,0 +1,82 @@
+"""
+Prompt tokens per article: the full `article.content` in the prompt vs. the stripped, truncated or
+map-reduced input of `AIClient.generate_tags_and_summary`, against a stub completions API.
+
+    python -m benchmarks.bench_tokens
+    python -m benchmarks.bench_tokens --corpus exported_feed.xml --input-tokens 1000
+
+The bundled benchmarks/corpus/feed_entries.xml is generated to look like what feedparser hands over
+for link blogs, WordPress posts, newsletters, RSSHub routes and long-form essays; any RSS/Atom file works.
+Latency is simulated as `--latency` per completion plus `--ms-per-token` per prompt token.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import feedparser
+import httpx
+
+from app.utils.aiapi import AIClient, TAGS_AND_SUMMARY_PROMPT
+from app.utils.text import count_tokens
+
+CORPUS = os.path.join(os.path.dirname(__file__), "corpus", "feed_entries.xml")
+
+
+class RecordingOpenAI:
+    def __init__(self, latency: float, ms_per_token: float):
+        self.latency = latency
+        self.ms_per_token = ms_per_token
+        self.prompt_tokens = 0
+        self.completions = 0
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        tokens = count_tokens(json.loads(request.content)["prompt"])
+        self.prompt_tokens += tokens
+        self.completions += 1
+        await asyncio.sleep(self.latency + tokens * self.ms_per_token / 1000)
+        text = json.dumps({"tags": ["a", "b", "c"], "summary": "A summary."})
+        return httpx.Response(200, json={"choices": [{"text": text}]})
+
+
+async def run(contents, stub, **kwargs) -> float:
+    client = AIClient(api_key="bench", transport=httpx.MockTransport(stub), **kwargs)
+    start = time.perf_counter()
+    try:
+        for content in contents:
+            await client.generate_tags_and_summary(content)
+    finally:
+        await client.aclose()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", default=CORPUS)
+    parser.add_argument("--input-tokens", type=int, default=1500)
+    parser.add_argument("--map-reduce-tokens", type=int, default=4500)
+    parser.add_argument("--max-chunks", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--ms-per-token", type=float, default=0.05)
+    args = parser.parse_args()
+
+    contents = [entry.get("summary") or entry.get("title", "") for entry in feedparser.parse(args.corpus).entries]
+
+    # before: the raw content went into the prompt as is
+    raw_tokens = sum(count_tokens(TAGS_AND_SUMMARY_PROMPT.format(text=content)) for content in contents)
+    simulated = (args.latency * len(contents) + raw_tokens * args.ms_per_token / 1000)
+
+    stub = RecordingOpenAI(args.latency, args.ms_per_token)
+    elapsed = asyncio.run(run(contents, stub, input_tokens=args.input_tokens,
+                              map_reduce_tokens=args.map_reduce_tokens, max_chunks=args.max_chunks))
+
+    print(f"{len(contents)} entries from {args.corpus}")
+    print(f"  raw content: {raw_tokens:8} prompt tokens, {len(contents):3} completions, {simulated:6.2f}s")
+    print(f"  prepared:    {stub.prompt_tokens:8} prompt tokens, {stub.completions:3} completions, {elapsed:6.2f}s")
+    print(f"  saved:       {raw_tokens - stub.prompt_tokens:8} prompt tokens "
+          f"({1 - stub.prompt_tokens / raw_tokens:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,26 @@
 import logging
 import os
 import secrets
-from typing import List
+from typing import List, Optional
 
+import httpx
 from dotenv import load_dotenv
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from requests_oauthlib import OAuth2Session
-from sqlalchemy.orm import Session
-from starlette.responses import RedirectResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.responses import PlainTextResponse, RedirectResponse, Response
 
-from app import crud, models, schemas
+from app import crud, crud_async, models, schemas, websub
 from app.catnews import bot, DISCORD_BOT_TOKEN
-from app.config import Settings
-from app.crud import authenticate_user
-from app.database import create_access_token, get_db, engine, get_current_user
+from app.config import Settings, settings
+from app.database import create_access_token, get_async_db, engine, get_current_user, session_scope
+from app.delivery import delivery_worker
+from app.fetcher import parse_feed
+from app.scheduler import scheduler
 from app.schemas import UserCreate, Token, Feed
+from app.summarizer import summary_cache, summary_workers
+from app.utils.aiapi import ai_client
 import asyncio
 
 SCOPE = ["identify", "email", "guilds.join", "guilds.members.read"]
@@ -31,6 +36,28 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 async def startup_event():
     asyncio.create_task(bot.start(DISCORD_BOT_TOKEN))
     logging.info("start bot")
+    scheduler.start()
+    logging.info("start feed scheduler")
+    delivery_worker.start()
+    logging.info("start delivery worker")
+    with session_scope() as db:
+        pruned = summary_cache.prune(db)
+        timeline_entries = crud.prepare_timelines(db)
+    if pruned:
+        logging.info(f"pruned {pruned} unused summary cache entries")
+    if timeline_entries:
+        logging.info(f"{settings.TIMELINE_MODE} timeline mode: {timeline_entries} timeline entries written or deleted")
+    if settings.SUMMARIZE_ON_INGEST:
+        summary_workers.start()
+        logging.info("start summary workers")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await scheduler.stop()
+    await delivery_worker.stop()
+    await summary_workers.stop()
+    await ai_client.aclose()
 
 
 @app.get("/")
@@ -41,11 +68,11 @@ async def hello():
 # TODO: 认证邮箱……
 # Registration and authentication endpoints
 @app.post("/auth/register", status_code=status.HTTP_201_CREATED, response_model=Token)
-async def register(user: UserCreate, db: Session = Depends(get_db)):
-    existing_user = crud.get_user_by_email(user.email, db)
+async def register(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    existing_user = await crud_async.get_user_by_email(user.email, db)
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    user = crud.register_user(user, db)
+    user = await crud_async.register_user(user, db)
     access_token = create_access_token(data={"sub": user.email}, token_source="Password")
     return {"access_token": access_token, "token_type": "bearer", "token_source": "Password"}
 
@@ -55,7 +82,7 @@ async def register(user: UserCreate, db: Session = Depends(get_db)):
 @app.post("/auth/token", response_model=Token)
 async def login(
         form_data: OAuth2PasswordRequestForm = Depends(),
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_async_db),
 ):
     """
 
@@ -63,7 +90,7 @@ async def login(
     :param db:
     :return:
     """
-    user = authenticate_user(form_data.username, form_data.password, db)
+    user = await crud_async.authenticate_user(form_data.username, form_data.password, db)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -90,7 +117,7 @@ async def auth_discord():
 
 
 @app.get("/auth/discord/callback")
-async def auth_discord_callback(code: str, state: str, db: Session = Depends(get_db)):
+async def auth_discord_callback(code: str, state: str, db: AsyncSession = Depends(get_async_db)):
     discord_session = OAuth2Session(
         os.getenv("CLIENT_ID_DISCORD"),
         redirect_uri=os.getenv("REDIRECT_URI_DISCORD"),
@@ -106,11 +133,11 @@ async def auth_discord_callback(code: str, state: str, db: Session = Depends(get
 
     user_data = discord_session.get("https://discord.com/api/users/@me").json()
 
-    user = crud.get_user_by_discord_id(user_data["id"], db)
+    user = await crud_async.get_user_by_discord_id(user_data["id"], db)
     if not user:
-        user = crud.create_user_with_discord(user_data, token, db)
+        user = await crud_async.create_user_with_discord(user_data, token, db)
     else:
-        crud.update_discord_token(user.id, token, db)
+        await crud_async.update_discord_token(user.id, token, db)
     return RedirectResponse(Settings.DISCORD_REDIRECT_URL)
 
 
@@ -142,37 +169,125 @@ async def auth_github_callback(code: str):
     return {"user_data": user_data, "token": token}
 
 
+@app.get("/metrics")
+async def metrics():
+    return {"db_pool": session_scope.metrics(), "summary_cache": summary_cache.metrics(),
+            "feed_hosts": scheduler.fetcher.metrics(), "user_cache": crud.user_cache.metrics(),
+            "subscription_cache": crud.subscription_cache.metrics(), "deliveries": delivery_worker.metrics()}
+
+
 @app.post("/feeds", status_code=status.HTTP_201_CREATED, response_model=Feed)
 async def add_subscription(feed: schemas.FeedCreate, current_user: models.User = Depends(get_current_user),
-                           db: Session = Depends(get_db)):
-    subscribed_feed = crud.subscribe_to_feed(feed, current_user, db)
-    return subscribed_feed
+                           db: AsyncSession = Depends(get_async_db)):
+    try:
+        return await scheduler.subscribe(feed, current_user, db)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=400, detail=f"Error fetching {feed.url}: {e}")
 
 
 @app.post("/feeds/unsubscribe", status_code=status.HTTP_200_OK)
 async def remove_subscription(feed: schemas.FeedRemove, current_user: models.User = Depends(get_current_user),
-                              db: Session = Depends(get_db)):
-    unsubscribed_feed = crud.unsubscribe_from_feed(feed, current_user, db)
+                              db: AsyncSession = Depends(get_async_db)):
+    unsubscribed_feed = await crud_async.unsubscribe_from_feed(feed, current_user, db)
     if unsubscribed_feed:
         return unsubscribed_feed
     else:
         raise HTTPException(status_code=404, detail="Feed not found")
 
 
+@app.get("/websub/{feed_id}", response_class=PlainTextResponse)
+async def verify_websub(feed_id: int, mode: str = Query(alias="hub.mode"), topic: str = Query(alias="hub.topic"),
+                        challenge: str = Query("", alias="hub.challenge"),
+                        lease_seconds: Optional[int] = Query(None, alias="hub.lease_seconds"),
+                        db: AsyncSession = Depends(get_async_db)):
+    """WebSub verification of intent: echo the challenge of the subscriptions we asked for."""
+    feed = await crud_async.get_feed_by_id(feed_id, db)
+    confirmed = feed is not None and await crud_async.verify_websub(feed, mode, topic, lease_seconds, db)
+    if mode == "denied":
+        return ""
+    if not confirmed:
+        raise HTTPException(status_code=404, detail="Subscription not requested")
+    return challenge
+
+
+@app.post("/websub/{feed_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def receive_websub(feed_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Content pushed by the hub of a feed, stored like the entries of a polled one."""
+    feed = await crud_async.get_feed_by_id(feed_id, db)
+    if feed is None or feed.websub_hub is None:
+        # Gone: the hub may drop the subscription
+        raise HTTPException(status_code=410, detail="Not subscribed")
+    body = await request.body()
+    if not websub.verify_signature(feed.websub_secret or "", body, request.headers.get("X-Hub-Signature")):
+        # still acknowledged, a hub must not retry forged content
+        logging.warning(f"Ignored a WebSub push for {feed.url} with a wrong signature")
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+    parsed_feed = await parse_feed(body)
+    await crud_async.ingest_pushed_feed(feed, parsed_feed, db)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
 @app.get("/feeds", response_model=List[schemas.Feed])
-async def list_subscriptions(current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def list_subscriptions(current_user: models.User = Depends(get_current_user),
+                             db: AsyncSession = Depends(get_async_db)):
     # TODO: 分页
-    subscribed_feeds = crud.list_subscribed_feeds(current_user, db)
+    subscribed_feeds = await crud_async.list_subscribed_feeds(current_user, db)
     return subscribed_feeds
 
 
-@app.get("/articles", response_model=List[schemas.Article])
+ARTICLE_INCLUDES = {"summary", "tags"}
+
+
+@app.get("/articles", response_model=List[schemas.ArticleBundle], response_model_exclude_unset=True)
 async def get_feed_articles(
-        skip: int = 0, limit: int = 20, current_user: models.User = Depends(get_current_user),
-        db: Session = Depends(get_db)
-) -> [schemas.Article]:
-    articles: [models.Article] = crud.get_feed_articles(current_user, db, skip=skip, limit=limit)
-    return articles
+        response: Response, cursor: Optional[str] = None, skip: int = 0, limit: int = 20, refresh: bool = False,
+        include: Optional[str] = None, unread: bool = False,
+        current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)
+) -> [schemas.ArticleBundle]:
+    """
+
+    :param cursor: the `X-Next-Cursor` response header of the previous page
+    :param skip: offset kept for old clients, prefer `cursor`
+    :param refresh: fetch the subscribed feeds before reading, instead of waiting for the background scheduler
+    :param include: comma separated `summary` and/or `tags`, stored ones only, loaded for the whole page at once
+    :param unread: the newest articles not marked seen instead, mark them with `POST /articles/seen` and the next
+        request gives the next ones without a cursor
+    """
+    includes = set(include.split(",")) if include else set()
+    if includes - ARTICLE_INCLUDES:
+        raise HTTPException(status_code=400, detail=f"include must be a subset of {sorted(ARTICLE_INCLUDES)}")
+    if refresh:
+        await scheduler.refresh_user_feeds(current_user.id)
+    if unread:
+        articles, next_cursor = await crud_async.get_unread_page(current_user, db, limit), None
+    else:
+        try:
+            articles, next_cursor = await crud_async.get_feed_article_page(current_user, db, cursor=cursor,
+                                                                           limit=limit, skip=skip)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    if not includes:
+        return [schemas.ArticleBundle(**schemas.Article.from_orm(article).dict()) for article in articles]
+
+    results = []
+    for bundle in await crud_async.get_article_bundles([article.id for article in articles], db):
+        extras = {}
+        if "summary" in includes:
+            extras["summary"] = bundle.summary.content if bundle.summary else None
+        if "tags" in includes:
+            extras["tags"] = bundle.tags
+        results.append(schemas.ArticleBundle(**schemas.Article.from_orm(bundle.article).dict(), **extras))
+    return results
+
+
+@app.post("/articles/seen", status_code=status.HTTP_204_NO_CONTENT)
+async def mark_articles_seen(seen: schemas.ArticlesSeen, current_user: models.User = Depends(get_current_user),
+                             db: AsyncSession = Depends(get_async_db)):
+    """Record that the articles were shown, they no longer come up in `GET /articles?unread=true`."""
+    await crud_async.mark_articles_seen(current_user.id, seen.article_ids, db, advance_marker=True)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
 if __name__ == "__main__":
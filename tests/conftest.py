@@ -1,9 +1,19 @@
+import asyncio
+import json
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List
+
+import httpx
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, Session
-from app import models, schemas
-from app.database import get_db
+from sqlalchemy.pool import NullPool
+from app import crud, models, schemas, summarizer
+from app.database import async_database_url, get_async_db, get_db
+from app.utils.aiapi import AIClient
 from main import app
 
 DATABASE_URL = "sqlite:///./test.db"
@@ -13,6 +23,10 @@ TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engin
 
 models.Base.metadata.create_all(bind=engine)
 
+# NullPool: TestClient may run each request on its own event loop
+async_engine = create_async_engine(async_database_url(DATABASE_URL), poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 
 def db_session() -> Session:
     session = TestingSessionLocal()
@@ -22,9 +36,15 @@ def db_session() -> Session:
         session.close()
 
 
+async def async_db_session() -> AsyncSession:
+    async with TestingAsyncSessionLocal() as session:
+        yield session
+
+
 @pytest.fixture(scope="module")
 def test_app():
     app.dependency_overrides[get_db] = db_session
+    app.dependency_overrides[get_async_db] = async_db_session
     client = TestClient(app)
     yield client
     app.dependency_overrides.clear()
@@ -41,3 +61,197 @@ def access_token(test_app):
     assert response.json()["token_type"] == "bearer"
     access_token = response.json()["access_token"]
     yield access_token
+
+
+SAMPLE_RSS = """<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0">
+<channel>
+  <title>Sample Feed</title>
+  <link>https://example.com/</link>
+  <description>Sample</description>
+  <item>
+    <title>Second article</title>
+    <link>https://example.com/articles/2</link>
+    <description>Second article content</description>
+    <pubDate>Tue, 28 Mar 2023 10:00:00 GMT</pubDate>
+  </item>
+  <item>
+    <title>First article</title>
+    <link>https://example.com/articles/1</link>
+    <description>First article content</description>
+    <pubDate>Mon, 27 Mar 2023 10:00:00 GMT</pubDate>
+  </item>
+</channel>
+</rss>
+"""
+
+
+@pytest.fixture
+def sample_rss():
+    return SAMPLE_RSS
+
+
+@pytest.fixture
+def db():
+    models.Base.metadata.create_all(bind=engine)
+    session = TestingSessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        # the in-process caches would outlive the rows
+        summarizer.summary_cache.clear()
+        crud.tag_id_cache.clear()
+        crud.user_cache.clear()
+        crud.subscription_cache.clear()
+        # leave empty tables behind for the module scoped `test_app`
+        models.Base.metadata.drop_all(bind=engine)
+        models.Base.metadata.create_all(bind=engine)
+
+
+def create_feed(db, url: str = "https://example.com/feed.xml", title: str = "Sample Feed", **kwargs) -> models.Feed:
+    now = datetime.utcnow()
+    feed = models.Feed(title=title, url=url, created_at=now, updated_at=now, **kwargs)
+    db.add(feed)
+    db.commit()
+    db.refresh(feed)
+    return feed
+
+
+def add_article(db, url: str = "https://example.com/1", content: str = None) -> models.Article:
+    now = datetime.utcnow()
+    article = models.Article(title="Article", url=url, content=content, published_at=now, created_at=now,
+                             updated_at=now)
+    db.add(article)
+    db.commit()
+    db.refresh(article)
+    return article
+
+
+def add_articles(db, numbers, feed: models.Feed = None, updated_at: datetime = None,
+                 summarized: bool = False) -> List[models.Article]:
+    """
+    Add "Article {number}" for each number, in that order
+
+    :param feed: link the articles to it, all with the same `updated_at`
+    :param summarized: give every article a summary and the tags cats, news and ai
+    """
+    updated_at = updated_at or datetime.utcnow()
+    articles = []
+    for number in numbers:
+        article = models.Article(title=f"Article {number}", url=f"https://example.com/{number}",
+                                 content=f"Content {number}", published_at=updated_at, created_at=updated_at,
+                                 updated_at=updated_at)
+        db.add(article)
+        db.flush()
+        if feed is not None:
+            # the same updated_at for every row, the id breaks the tie
+            db.add(models.FeedArticle(feed_id=feed.id, article_id=article.id, created_at=updated_at,
+                                      updated_at=updated_at))
+        articles.append(article)
+    if summarized:
+        tags = [models.Tag(name=name) for name in ("cats", "news", "ai")]
+        db.add_all(tags)
+        db.flush()
+        for article in articles:
+            db.add(models.Summary(content=f"Summary of {article.title}", article_id=article.id))
+            db.add_all(models.ArticleTag(article_id=article.id, tag_id=tag.id) for tag in tags)
+    db.commit()
+    return articles
+
+
+class FakeAuthor:
+    def __init__(self, author_id):
+        self.id = author_id
+
+
+class FakeContext:
+    """Just enough of a discord ApplicationContext for the bot commands"""
+
+    def __init__(self, author_id):
+        self.author = FakeAuthor(author_id)
+        self.channel_id = 1
+        self.deferred = False
+        self.responses = []
+
+    async def defer(self):
+        self.deferred = True
+
+    async def respond(self, message):
+        self.responses.append(message)
+
+
+@pytest.fixture
+def reader(db):
+    """A user and the three feeds they read, not subscribed to yet."""
+    now = datetime.utcnow()
+    user = models.User(username="reader", email="reader@example.com", password_hash="", created_at=now,
+                       updated_at=now)
+    feeds = [models.Feed(title=f"Feed {i}", url=f"https://example.com/{i}.xml", created_at=now, updated_at=now)
+             for i in range(3)]
+    db.add_all([user, *feeds])
+    db.commit()
+    return user, feeds
+
+
+@pytest.fixture
+def subscribed_reader(db, reader):
+    """`reader` subscribed to their feeds."""
+    user, feeds = reader
+    now = datetime.utcnow()
+    db.add_all([models.UserFeedSubscription(user_id=user.id, feed_id=feed.id, created_at=now, updated_at=now)
+                for feed in feeds])
+    db.commit()
+    return user, feeds
+
+
+@pytest.fixture
+def count_statements():
+    """
+    Counts the SQL statements executed on the test engine inside a `with count_statements() as statements:`,
+    `count_statements(parameters=True)` records (statement, parameters) pairs, e.g. for `EXPLAIN QUERY PLAN`.
+    """
+    @contextmanager
+    def counter(parameters: bool = False):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, statement_parameters, context, executemany):
+            statements.append((statement, statement_parameters) if parameters else statement)
+
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+    return counter
+
+
+class StubOpenAI:
+    """Answers /completions like OpenAI would, after `latency` seconds, or `latency(request)` seconds if callable."""
+
+    def __init__(self, latency=0.1, status_code: int = 200):
+        self.latency = latency
+        self.status_code = status_code
+        self.requests = []
+        self.in_flight = 0
+        self.peak = 0
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(json.loads(request.content))
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        await asyncio.sleep(self.latency(self.requests[-1]) if callable(self.latency) else self.latency)
+        self.in_flight -= 1
+        if self.status_code != 200:
+            return httpx.Response(self.status_code)
+        text = json.dumps({"tags": ["cats", "news", "ai"], "summary": "A summary."})
+        return httpx.Response(200, json={"choices": [{"text": f"\n{text}"}]})
+
+
+@pytest.fixture
+def openai_stub(monkeypatch):
+    """A `StubOpenAI` behind the `ai_client` used by app/summarizer.py."""
+    stub = StubOpenAI()
+    monkeypatch.setattr(summarizer, "ai_client", AIClient(api_key="test", transport=httpx.MockTransport(stub)))
+    return stub
@@ -0,0 +1,101 @@
+import asyncio
+import time
+from datetime import datetime
+
+import httpx
+import pytest
+
+from app import catnews, crud, models
+from app.utils.aiapi import AIClient, CHUNK_SUMMARY_PROMPT, parse_tags_and_summary
+from app.utils.text import count_tokens, split_tokens, strip_html, truncate_tokens
+from tests.conftest import StubOpenAI
+
+
+def test_parse_tags_and_summary():
+    assert parse_tags_and_summary('Sure!\n{"tags": ["a", " b "], "summary": " s "}') == (["a", "b"], "s")
+    with pytest.raises(ValueError):
+        parse_tags_and_summary("a, b, c")
+
+
+def test_text_preprocessing():
+    html = '<p>Cats &amp; dogs</p><script>track()</script><img src="a.png"><!-- ad -->\n<b>agree</b>.'
+    assert strip_html(html) == "Cats & dogs agree ."
+    assert count_tokens("Cats & dogs") == 3 and count_tokens("猫新闻") == 3
+    assert truncate_tokens("one two three four", 2) == "one two"
+
+    text = "A cat sat. " * 100
+    chunks = split_tokens(text, 40)
+    assert all(count_tokens(chunk) <= 40 and chunk.endswith(".") for chunk in chunks)
+    assert " ".join(chunks) == text.strip()
+
+
+def run_client(stub: StubOpenAI, text: str, **kwargs):
+    async def main():
+        client = AIClient(api_key="test", transport=httpx.MockTransport(stub), **kwargs)
+        try:
+            return await client.generate_tags_and_summary(text)
+        finally:
+            await client.aclose()
+
+    return asyncio.run(main())
+
+
+def test_long_input_is_truncated():
+    stub = StubOpenAI(latency=0)
+    text = "<div>" + "<p>A rather long paragraph about cats.</p>" * 200 + "</div>"
+
+    assert run_client(stub, text, input_tokens=100, map_reduce_tokens=10000) == (["cats", "news", "ai"], "A summary.")
+    [request] = stub.requests
+    assert "<p>" not in request["prompt"]
+    assert count_tokens(request["prompt"]) < 100 + 100 < count_tokens(text)
+
+
+def test_very_long_input_is_summarized_in_chunks():
+    stub = StubOpenAI(latency=0.05)
+    text = "A rather long sentence about cats. " * 200
+
+    assert run_client(stub, text, input_tokens=100, map_reduce_tokens=300, max_chunks=4)[1] == "A summary."
+    chunk_prompts = [request for request in stub.requests if request["prompt"].startswith(CHUNK_SUMMARY_PROMPT[:20])]
+    assert len(chunk_prompts) == 4 and len(stub.requests) == 5
+    assert all(request["max_tokens"] == 64 for request in chunk_prompts)
+    # the chunks are summarized concurrently, the final completion waits for them
+    assert stub.peak == 4
+
+
+def test_concurrency_limit():
+    stub = StubOpenAI()
+
+    async def main():
+        client = AIClient(api_key="test", concurrency=2, transport=httpx.MockTransport(stub))
+        try:
+            return await asyncio.gather(*(client.generate_tags_and_summary(f"text {i}") for i in range(6)))
+        finally:
+            await client.aclose()
+
+    results = asyncio.run(main())
+
+    assert results == [(["cats", "news", "ai"], "A summary.")] * 6
+    assert stub.peak == 2
+
+
+def test_cats_page_latency(db, openai_stub):
+    # well above the time spent storing the results
+    openai_stub.latency = 0.3
+    now = datetime.utcnow()
+    articles = [models.Article(title=f"Article {i}", url=f"https://example.com/{i}", content=f"Content {i}",
+                               published_at=now, created_at=now, updated_at=now) for i in range(3)]
+    db.add_all(articles)
+    db.commit()
+
+    async def main():
+        start = time.perf_counter()
+        results = [result async for _, result in catnews.iter_tag_summaries(articles, db)]
+        return results, time.perf_counter() - start
+
+    results, elapsed = asyncio.run(main())
+
+    # one completion per article, all in flight together: the page takes about one round trip, not 3 x 2
+    assert len(openai_stub.requests) == 3
+    assert elapsed < 2 * openai_stub.latency
+    assert [summary.content for summary, tags in results] == ["A summary."] * 3
+    assert crud.get_tags_by_article_id(db, articles[0].id) == ["cats", "news", "ai"]
@@ -0,0 +1,131 @@
+import feedparser
+import pytest
+from fastapi import status
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import main
+from app import crud, models
+
+EXAMPLE_RSS_URL = "https://example.com/feed.xml"
+
+
+@pytest.fixture
+def offline_fetch(monkeypatch, sample_rss):
+    async def fetch_feed(url):
+        return feedparser.parse(sample_rss)
+
+    monkeypatch.setattr(main.scheduler.fetcher, "fetch_feed", fetch_feed)
+
+
+def test_subscription_flow(test_app, access_token, offline_fetch):
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    response = test_app.post("/feeds", json={"url": EXAMPLE_RSS_URL}, headers=headers)
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()["title"] == "Sample Feed"
+    # subscribing twice keeps one subscription
+    test_app.post("/feeds", json={"url": EXAMPLE_RSS_URL}, headers=headers)
+
+    response = test_app.get("/feeds", headers=headers)
+    assert [feed["url"] for feed in response.json()] == [EXAMPLE_RSS_URL]
+
+    response = test_app.get("/articles", params={"limit": 1}, headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert [article["title"] for article in response.json()] == ["Second article"]
+    # reading doesn't mark anything seen
+    unread = test_app.get("/articles", params={"unread": True}, headers=headers).json()
+    assert [article["title"] for article in unread] == ["Second article", "First article"]
+    assert test_app.get("/articles", params={"unread": True}, headers=headers).json() == unread
+    seen = test_app.post("/articles/seen", json={"article_ids": [response.json()[0]["id"], 12345]},
+                         headers=headers)
+    assert seen.status_code == status.HTTP_204_NO_CONTENT
+    # nothing newer since this visit, the older article is left to the regular timeline
+    assert test_app.get("/articles", params={"unread": True}, headers=headers).json() == []
+    response = test_app.get("/articles", params={"limit": 1, "cursor": response.headers["X-Next-Cursor"]},
+                            headers=headers)
+    assert [article["title"] for article in response.json()] == ["First article"]
+    assert "X-Next-Cursor" not in response.headers
+
+    response = test_app.get("/articles", params={"cursor": "bogus"}, headers=headers)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    response = test_app.post("/feeds/unsubscribe", json={"url": EXAMPLE_RSS_URL}, headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert test_app.get("/feeds", headers=headers).json() == []
+
+
+def test_articles_include_summary_and_tags(test_app, access_token, offline_fetch, db):
+    headers = {"Authorization": f"Bearer {access_token}"}
+    test_app.post("/feeds", json={"url": EXAMPLE_RSS_URL}, headers=headers)
+    article = crud.get_article_by_url(db, "https://example.com/articles/2")
+    db.add(models.Summary(content="A summary.", article_id=article.id))
+    crud.associate_tags_with_article(db, article, ["cats", "news"])
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        response = test_app.get("/articles", params={"include": "summary,tags"}, headers=headers)
+    finally:
+        event.remove(Engine, "before_cursor_execute", before_cursor_execute)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert [(a["title"], a["summary"], sorted(a["tags"])) for a in response.json()] == [
+        ("Second article", "A summary.", ["cats", "news"]), ("First article", None, [])]
+    # page, then articles, summaries and tags of the whole page, the user is cached since POST /feeds
+    assert len(statements) == 4
+
+    response = test_app.get("/articles", params={"include": "tags"}, headers=headers)
+    assert "summary" not in response.json()[0] and "tags" in response.json()[0]
+    assert "tags" not in test_app.get("/articles", headers=headers).json()[0]
+    response = test_app.get("/articles", params={"include": "comments"}, headers=headers)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    test_app.post("/feeds/unsubscribe", json={"url": EXAMPLE_RSS_URL}, headers=headers)
+
+
+def test_user_and_feed_list_cache(test_app, offline_fetch, db):
+    user = {"username": "cacheuser", "email": "cacheuser@example.com", "password": "cachepassword"}
+    headers = {"Authorization": f"Bearer {test_app.post('/auth/register', json=user).json()['access_token']}"}
+    test_app.post("/feeds", json={"url": EXAMPLE_RSS_URL}, headers=headers)
+    assert [feed["url"] for feed in test_app.get("/feeds", headers=headers).json()] == [EXAMPLE_RSS_URL]
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        response = test_app.get("/feeds", headers=headers)
+        # the bot shares the cache of the routes
+        user = crud.get_user_by_subject("Password", "cacheuser@example.com", db)
+    finally:
+        event.remove(Engine, "before_cursor_execute", before_cursor_execute)
+
+    assert [feed["url"] for feed in response.json()] == [EXAMPLE_RSS_URL]
+    assert user.email == "cacheuser@example.com"
+    assert statements == []
+    assert crud.list_subscribed_feeds(user, db, cached=True)[0].url == EXAMPLE_RSS_URL
+
+    # unsubscribing drops the cached list
+    test_app.post("/feeds/unsubscribe", json={"url": EXAMPLE_RSS_URL}, headers=headers)
+    assert test_app.get("/feeds", headers=headers).json() == []
+    assert crud.list_subscribed_feeds(user, db, cached=True) == []
+    assert test_app.get("/metrics").json()["subscription_cache"]["invalidations"] >= 1
+
+
+def test_invalid_token(test_app):
+    response = test_app.get("/feeds", headers={"Authorization": "Bearer invalid"})
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_metrics(test_app):
+    response = test_app.get("/metrics")
+    assert response.status_code == status.HTTP_200_OK
+    assert {"size", "overflow", "checked_out", "checkout_wait_avg"} <= set(response.json()["db_pool"])
+    assert {"hits", "misses", "evictions"} <= set(response.json()["summary_cache"])
+    assert isinstance(response.json()["feed_hosts"], dict)
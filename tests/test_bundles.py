@@ -0,0 +1,46 @@
+import asyncio
+
+from app import catnews, crud
+from tests.conftest import add_articles
+
+
+def test_get_tags_by_article_id_is_one_statement(db, count_statements):
+    [article] = add_articles(db, range(1), summarized=True)
+    article_id = article.id
+    with count_statements() as statements:
+        assert sorted(crud.get_tags_by_article_id(db, article_id)) == ["ai", "cats", "news"]
+    assert len(statements) == 1
+
+
+def test_article_bundles(db, count_statements):
+    articles = add_articles(db, range(10), summarized=True)
+    db.expire_all()
+    ids = [article.id for article in reversed(articles)] + [12345]
+
+    for page in (ids[:2], ids):
+        db.expire_all()
+        with count_statements() as statements:
+            bundles = crud.get_article_bundles(page, db)
+            assert [bundle.article.id for bundle in bundles] == [i for i in page if i != 12345]
+            assert all(bundle.summary.content == f"Summary of {bundle.article.title}" for bundle in bundles)
+            assert all(sorted(bundle.tags) == ["ai", "cats", "news"] for bundle in bundles)
+        # articles, summaries, tags: the same for 2 or 10 articles
+        assert len(statements) == 3
+
+
+def test_cats_page_statements(db, count_statements, openai_stub):
+    articles = add_articles(db, range(3), summarized=True)
+    # as loaded by the page query
+    for article in articles:
+        db.refresh(article)
+
+    async def main():
+        return {article.title: result async for article, result in catnews.iter_tag_summaries(articles, db)}
+
+    with count_statements() as statements:
+        results = asyncio.run(main())
+
+    assert {title: summary.content for title, (summary, tags) in results.items()} == {
+        f"Article {i}": f"Summary of Article {i}" for i in range(3)}
+    assert len(statements) == 3
+    assert openai_stub.requests == []
@@ -0,0 +1,185 @@
+import asyncio
+import time
+from datetime import datetime
+
+from app import crud, models, schemas
+from app.delivery import DeliveryWorker
+from app.utils.message import SendQueue
+from tests.conftest import TestingSessionLocal
+
+FEED_URL = "https://example.com/feed.xml"
+
+
+class FakeDiscord:
+    """Records what would be posted, `failing` targets raise and `delays` hold up sending to a target."""
+
+    def __init__(self, failing=(), delays=None):
+        self.failing = set(failing)
+        self.delays = delays or {}
+        self.sent = []
+
+    async def send(self, target_type: str, target_id: str, content: str):
+        await asyncio.sleep(self.delays.get(target_id, 0))
+        if target_id in self.failing:
+            raise RuntimeError("403 Forbidden: Missing Access")
+        self.sent.append((target_type, target_id, content))
+
+    def articles(self, target_id: str) -> list:
+        return [line for target_type, target, content in self.sent if target == target_id
+                for line in content.split("\n") if line.startswith("https://")]
+
+
+def worker(client, **kwargs) -> DeliveryWorker:
+    return DeliveryWorker(client, session_factory=TestingSessionLocal, send_queue=SendQueue(rate=1000, burst=1000),
+                          **kwargs)
+
+
+def create_subscriber(db, name: str) -> models.User:
+    now = datetime.utcnow()
+    user = models.User(username=name, email=f"{name}@example.com", discord_id=name, password_hash="",
+                       created_at=now, updated_at=now)
+    feed = crud.get_feed_by_url(FEED_URL, db)
+    if feed is None:
+        feed = models.Feed(title="Feed", url=FEED_URL, created_at=now, updated_at=now)
+    db.add_all([user, feed])
+    db.commit()
+    db.add(models.UserFeedSubscription(user_id=user.id, feed_id=feed.id, created_at=now, updated_at=now))
+    db.commit()
+    return user
+
+
+def publish(db, *ids):
+    # newest first, like a feed
+    entries = [{"title": f"Article {i}", "link": f"https://example.com/{i}"} for i in reversed(ids)]
+    crud.ingest_feed_entries(crud.get_feed_by_url(FEED_URL, db), entries, db)
+    db.commit()
+
+
+def test_new_articles_are_pushed_to_bound_channels(db):
+    alice, bob = create_subscriber(db, "alice"), create_subscriber(db, "bob")
+    publish(db, 0)
+    assert crud.bind_feed(FEED_URL, alice, "channel", "100", db, guild_id="1")
+    assert crud.bind_feed(FEED_URL, alice, "dm", "alice", db)
+    # the same channel through another user's binding gets every article once
+    assert crud.bind_feed(FEED_URL, bob, "channel", "100", db, guild_id="1")
+    assert crud.bind_feed("https://example.com/other.xml", bob, "channel", "100", db) is None
+    discord = FakeDiscord()
+
+    publish(db, 0, 1, 2, 3)
+    assert asyncio.run(worker(discord).run_once()) == 2
+
+    # only what was published since the binding, batched in one message per target
+    assert len(discord.sent) == 2
+    assert discord.articles("100") == discord.articles("alice") == [f"https://example.com/{i}" for i in (1, 2, 3)]
+    assert asyncio.run(worker(discord).run_once()) == 0
+
+    assert crud.unbind_feed(FEED_URL, alice, "channel", "100", db)
+    crud.unsubscribe_from_feed(schemas.FeedRemove(url=FEED_URL), alice, db)
+    publish(db, 4)
+    asyncio.run(worker(discord).run_once())
+    assert discord.articles("100")[-1] == "https://example.com/4"
+    assert discord.articles("alice")[-1] == "https://example.com/3"
+
+
+def test_failed_deliveries_are_retried(db):
+    alice = create_subscriber(db, "alice")
+    for channel in ("100", "200"):
+        crud.bind_feed(FEED_URL, alice, "channel", channel, db)
+    discord = FakeDiscord(failing={"200"})
+
+    publish(db, 1, 2)
+    asyncio.run(worker(discord).run_once())
+
+    assert discord.articles("100") == ["https://example.com/1", "https://example.com/2"]
+    failed = db.query(models.Delivery).filter(models.Delivery.target_id == "200").all()
+    assert {(d.status, d.attempts) for d in failed} == {("pending", 1)}
+    assert all(d.next_attempt_at > datetime.utcnow() for d in failed)
+    assert asyncio.run(worker(discord).run_once()) == 0
+
+    discord.failing.clear()
+    db.query(models.Delivery).update({models.Delivery.next_attempt_at: datetime.utcnow()})
+    db.commit()
+    # claimed by a process that stopped before sending
+    crud.claim_deliveries(db, datetime.utcnow(), 10, 10)
+    assert asyncio.run(worker(discord).run_once()) == 0
+    assert crud.reset_sending_deliveries(db) == 2
+
+    assert asyncio.run(worker(discord).run_once()) == 1
+    assert discord.articles("200") == ["https://example.com/1", "https://example.com/2"]
+
+
+def test_busy_and_slow_channels_hold_up_no_other(db):
+    alice = create_subscriber(db, "alice")
+    crud.bind_feed(FEED_URL, alice, "channel", "slow", db)
+    publish(db, *range(45))
+    # bound after the backlog, with a single new article
+    crud.bind_feed(FEED_URL, alice, "channel", "quiet", db)
+    publish(db, 45)
+    discord = FakeDiscord(delays={"slow": 0.5})
+    delivery = worker(discord, concurrency=2, batch_size=20, poll_interval=0.01)
+
+    async def main():
+        delivery.start()
+        start = time.perf_counter()
+        while not discord.articles("quiet"):
+            await asyncio.sleep(0.01)
+        # published while the first batch of the slow channel is still being sent
+        publish(db, 46)
+        while len(discord.articles("quiet")) < 2:
+            await asyncio.sleep(0.01)
+        quiet = time.perf_counter() - start
+        while len(discord.articles("slow")) < 47:
+            await asyncio.sleep(0.01)
+        await delivery.stop()
+        return quiet
+
+    quiet = asyncio.run(main())
+
+    assert quiet < 0.4
+    # 47 articles in batches of 20, each batch in as few messages as fit
+    assert [target for _, target, _ in discord.sent].count("slow") == 3
+    assert discord.articles("slow") == [f"https://example.com/{i}" for i in range(47)]
+
+
+def test_a_widely_bound_feed_holds_up_no_other(db):
+    alice = create_subscriber(db, "alice")
+    for channel in range(50):
+        crud.bind_feed(FEED_URL, alice, "channel", str(channel), db)
+    now = datetime.utcnow()
+    other = models.Feed(title="Other", url="https://example.com/other.xml", created_at=now, updated_at=now)
+    db.add(other)
+    db.commit()
+    db.add(models.UserFeedSubscription(user_id=alice.id, feed_id=other.id, created_at=now, updated_at=now))
+    db.commit()
+    crud.bind_feed(other.url, alice, "dm", "alice", db)
+
+    publish(db, 1)
+    # queued after the 50 channels of the first feed
+    crud.ingest_feed_entries(other, [{"title": "Other", "link": "https://example.com/other/1"}], db)
+    db.commit()
+
+    batches = crud.claim_deliveries(db, datetime.utcnow(), 5, 10)
+
+    assert len(batches) == 5
+    assert ("dm", "alice") in batches
+
+
+def test_unbound_targets_get_no_pending_deliveries(db):
+    alice, bob = create_subscriber(db, "alice"), create_subscriber(db, "bob")
+    for user in (alice, bob):
+        crud.bind_feed(FEED_URL, user, "channel", "100", db)
+    crud.bind_feed(FEED_URL, alice, "channel", "200", db)
+    crud.bind_feed(FEED_URL, bob, "dm", "bob", db)
+    publish(db, 1)
+
+    crud.unbind_feed(FEED_URL, alice, "channel", "200", db)
+    crud.unbind_feed(FEED_URL, alice, "channel", "100", db)
+    # still bound by bob
+    assert {d.target_id for d in db.query(models.Delivery)} == {"100", "bob"}
+
+    crud.unsubscribe_from_feed(schemas.FeedRemove(url=FEED_URL), bob, db)
+    discord = FakeDiscord()
+    asyncio.run(worker(discord).run_once())
+
+    assert discord.sent == []
+    assert db.query(models.Delivery).count() == 0
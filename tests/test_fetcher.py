@@ -0,0 +1,239 @@
+import asyncio
+import hashlib
+import time
+
+import feedparser
+import httpx
+import pytest
+
+from app.fetcher import FeedFetcher, HostUnavailable
+from app.models import Feed
+
+
+def test_fetch_many(sample_rss):
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/missing.xml":
+            return httpx.Response(404)
+        return httpx.Response(200, text=sample_rss)
+
+    async def main():
+        fetcher = FeedFetcher(transport=httpx.MockTransport(handler))
+        try:
+            return await fetcher.fetch_many([Feed(url="https://example.com/a.xml"),
+                                             Feed(url="https://example.com/missing.xml")])
+        finally:
+            await fetcher.aclose()
+
+    results = asyncio.run(main())
+
+    assert results["https://example.com/a.xml"].parsed_feed.feed.title == "Sample Feed"
+    assert len(results["https://example.com/a.xml"].parsed_feed.entries) == 2
+    assert isinstance(results["https://example.com/missing.xml"], httpx.HTTPStatusError)
+
+
+def test_per_host_limit(sample_rss):
+    in_flight = {}
+    peak = {}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        in_flight[host] = in_flight.get(host, 0) + 1
+        peak[host] = max(peak.get(host, 0), in_flight[host])
+        await asyncio.sleep(0.01)
+        in_flight[host] -= 1
+        return httpx.Response(200, text=sample_rss)
+
+    async def main():
+        fetcher = FeedFetcher(per_host=2, transport=httpx.MockTransport(handler))
+        feeds = [Feed(url=f"https://{host}/{i}.xml") for host in ("a.example.com", "b.example.com") for i in range(10)]
+        try:
+            return await fetcher.fetch_many(feeds)
+        finally:
+            await fetcher.aclose()
+
+    results = asyncio.run(main())
+
+    assert len(results) == 20
+    assert peak == {"a.example.com": 2, "b.example.com": 2}
+
+
+def test_conditional_get(sample_rss):
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, text=sample_rss, headers={"ETag": '"v1"', "Last-Modified": "Mon, 27 Mar 2023"})
+
+    async def main():
+        fetcher = FeedFetcher(transport=httpx.MockTransport(handler))
+        try:
+            first = await fetcher.fetch("https://example.com/a.xml")
+            second = await fetcher.fetch("https://example.com/a.xml", first.etag, first.last_modified,
+                                         first.content_hash)
+            unchanged = await fetcher.fetch("https://example.com/a.xml", content_hash=first.content_hash)
+            return first, second, unchanged
+        finally:
+            await fetcher.aclose()
+
+    first, second, unchanged = asyncio.run(main())
+
+    assert not first.not_modified and first.etag == '"v1"'
+    assert requests[1].headers["If-Modified-Since"] == "Mon, 27 Mar 2023"
+    assert second.status_code == 304 and second.not_modified
+    assert second.content_hash == first.content_hash
+    # no validators sent, but the body hash matches
+    assert unchanged.status_code == 200 and unchanged.not_modified
+
+
+def test_circuit_breaker(sample_rss):
+    requests = []
+    healthy = False
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.url.host == "down.example.com" and not healthy:
+            return httpx.Response(503)
+        return httpx.Response(200, text=sample_rss)
+
+    async def main():
+        nonlocal healthy
+        fetcher = FeedFetcher(transport=httpx.MockTransport(handler), breaker_threshold=3, breaker_cooldown=0.2)
+        try:
+            for _ in range(5):
+                with pytest.raises(httpx.HTTPError):
+                    await fetcher.fetch("https://down.example.com/feed.xml")
+            skipped = fetcher.metrics()["down.example.com"]["breaker"]
+            assert (await fetcher.fetch("https://up.example.com/feed.xml")).parsed_feed.entries
+
+            await asyncio.sleep(0.25)
+            healthy = True
+            assert (await fetcher.fetch("https://down.example.com/feed.xml")).parsed_feed.entries
+            return skipped, fetcher.metrics()
+        finally:
+            await fetcher.aclose()
+
+    skipped, metrics = asyncio.run(main())
+
+    # 3 failures open the breaker, the next 2 fetches don't reach the host
+    assert skipped["state"] == "open" and skipped["rejected"] == 2
+    assert len(requests) == 3 + 1 + 1
+    assert metrics["down.example.com"]["breaker"]["state"] == "closed"
+    assert metrics["up.example.com"]["breaker"]["failures"] == 0
+
+
+def test_retry_after_opens_breaker(sample_rss):
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(429, headers={"Retry-After": "120"})
+
+    async def main():
+        fetcher = FeedFetcher(transport=httpx.MockTransport(handler))
+        try:
+            with pytest.raises(httpx.HTTPStatusError):
+                await fetcher.fetch("https://example.com/feed.xml")
+            with pytest.raises(HostUnavailable) as e:
+                await fetcher.fetch("https://example.com/feed.xml")
+            return e.value
+        finally:
+            await fetcher.aclose()
+
+    error = asyncio.run(main())
+
+    assert error.host == "example.com" and 110 < error.retry_in <= 120
+
+
+def test_host_rate_limit(sample_rss):
+    sent = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        sent.append(time.monotonic())
+        return httpx.Response(200, text=sample_rss)
+
+    async def main():
+        fetcher = FeedFetcher(transport=httpx.MockTransport(handler), host_rate=20, host_burst=2)
+        try:
+            await fetcher.fetch_many([Feed(url=f"https://example.com/{i}.xml") for i in range(6)])
+            return fetcher.metrics()["example.com"]
+        finally:
+            await fetcher.aclose()
+
+    metrics = asyncio.run(main())
+
+    # a burst of 2, then one request per 50ms
+    assert sent[-1] - sent[0] >= 0.18
+    assert metrics["requests"] == 6 and metrics["throttled"] == 4
+
+
+def archive(entries: int) -> bytes:
+    items = "".join(f"<item><title>Article {i}&nbsp;&eacute;</title><link>https://example.com/{i}</link>"
+                    f"<description>&lt;p&gt;Content {i}&lt;/p&gt;</description>"
+                    f"<pubDate>Mon, 27 Mar 2023 10:00:00 GMT</pubDate></item>" for i in range(entries - 1, -1, -1))
+    return (f'<?xml version="1.0" encoding="UTF-8"?><rss version="2.0" xmlns:atom="http://www.w3.org/2005/Atom">'
+            f'<channel><title>Archive</title><atom:link rel="hub" href="https://hub.example.com/"/>{items}'
+            f'</channel></rss>').encode()
+
+
+def fetch_streamed(document: bytes, **kwargs):
+    async def handler(request: httpx.Request) -> httpx.Response:
+        async def body():
+            for i in range(0, len(document), 1000):
+                yield document[i:i + 1000]
+
+        return httpx.Response(200, content=body())
+
+    async def main():
+        fetcher = FeedFetcher(transport=httpx.MockTransport(handler), stream_threshold=4000,
+                              stream_max_entries=kwargs.pop("max_entries", 1000))
+        try:
+            return await fetcher.fetch("https://example.com/archive.xml", **kwargs)
+        finally:
+            await fetcher.aclose()
+
+    return asyncio.run(main())
+
+
+def test_large_feed_is_streamed():
+    document = archive(300)
+
+    result = fetch_streamed(document)
+
+    expected = feedparser.parse(document)
+    assert result.content_hash == hashlib.sha256(document).hexdigest()
+    assert result.parsed_feed.feed.title == "Archive"
+    assert result.parsed_feed.feed.links == [{"rel": "hub", "href": "https://hub.example.com/"}]
+    assert [(entry.title, entry.link, entry.summary, entry.published) for entry in result.parsed_feed.entries] == [
+        (entry.title, entry.link, entry.summary, entry.published) for entry in expected.entries]
+
+
+def test_streamed_html_is_sanitized_like_feedparser():
+    unsafe = ('<item><title>Unsafe</title><link>https://example.com/unsafe</link>'
+              '<description>&lt;p onclick="x()"&gt;Hi&lt;/p&gt;&lt;script&gt;alert(1)&lt;/script&gt;</description>'
+              '<content:encoded><![CDATA[<img src="a.png" onerror="x()"><b>Bold</b>]]></content:encoded></item>')
+    document = archive(300).replace(b'xmlns:atom=', b'xmlns:content="http://purl.org/rss/1.0/modules/content/" '
+                                                   b'xmlns:atom=').replace(b"<item>", unsafe.encode() + b"<item>", 1)
+
+    entry = fetch_streamed(document).parsed_feed.entries[0]
+
+    expected = feedparser.parse(document).entries[0]
+    assert entry.summary == expected.summary == '<p>Hi</p>'
+    assert entry.content == expected.content[0].value
+
+
+def test_streaming_stops_at_stored_entries():
+    lookups = []
+    stored = {f"https://example.com/{i}" for i in range(290)}
+
+    def known(urls):
+        lookups.append(len(urls))
+        return stored.intersection(urls)
+
+    result = fetch_streamed(archive(1000), known=known)
+
+    assert [entry.link for entry in result.parsed_feed.entries] == [
+        f"https://example.com/{i}" for i in range(999, 289, -1)]
+    # the rest of the body was never read, so its hash is unknown
+    assert result.content_hash is None
+    assert sum(lookups) < 1000
+
+    assert len(fetch_streamed(archive(1000), max_entries=50).parsed_feed.entries) == 50
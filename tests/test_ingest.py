@@ -0,0 +1,49 @@
+import feedparser
+
+from app import crud, models
+from tests.conftest import create_feed
+
+
+def test_ingest_feed_entries(db, sample_rss, count_statements):
+    feed = create_feed(db, "https://example.com/feed.xml")
+    db.refresh(feed)
+    entries = feedparser.parse(sample_rss).entries
+
+    with count_statements() as statements:
+        new_article_ids = crud.ingest_feed_entries(feed, entries, db)
+        db.commit()
+
+    assert len(new_article_ids) == 2
+    # lookup, insert articles, lookup again, lookup links, insert links, lookup channel bindings
+    assert len([s for s in statements if not s.startswith(("BEGIN", "COMMIT"))]) == 6
+    assert db.query(models.FeedArticle).filter(models.FeedArticle.feed_id == feed.id).count() == 2
+
+    assert crud.ingest_feed_entries(feed, entries, db) == []
+    db.commit()
+    assert db.query(models.Article).count() == 2
+    assert db.query(models.FeedArticle).count() == 2
+
+
+def test_ingest_links_known_articles_to_another_feed(db, sample_rss):
+    entries = feedparser.parse(sample_rss).entries
+    crud.ingest_feed_entries(create_feed(db, "https://example.com/feed.xml"), entries, db)
+    mirror = create_feed(db, "https://mirror.example.com/feed.xml")
+
+    assert crud.ingest_feed_entries(mirror, entries, db) == []
+    db.commit()
+
+    assert db.query(models.Article).count() == 2
+    assert db.query(models.FeedArticle).filter(models.FeedArticle.feed_id == mirror.id).count() == 2
+
+
+def test_ingest_keeps_entries_around_a_malformed_date(db):
+    feed = create_feed(db, "https://example.com/feed.xml")
+    entries = [{"title": f"Article {i}", "link": f"https://example.com/{i}", "published": published}
+               for i, published in enumerate(["Mon, 06 Sep 2021 16:45:00 GMT", "not a date", None])]
+
+    assert len(crud.ingest_feed_entries(feed, entries, db)) == 3
+    db.commit()
+
+    articles = {article.title: article for article in db.query(models.Article)}
+    assert articles["Article 0"].published_at.year == 2021
+    assert articles["Article 1"].published_at == articles["Article 1"].created_at
@@ -0,0 +1,162 @@
+import asyncio
+import time
+from datetime import datetime
+
+from sqlalchemy.orm import sessionmaker
+
+from app import catnews, models
+from app.database import SessionScope
+from app.utils.message import MESSAGE_LIMIT, SendQueue, pack_messages, split_text
+from tests.conftest import FakeContext
+
+
+def test_split_text():
+    paragraph = " ".join(["word"] * 300)
+    text = f"{paragraph}\n\n{paragraph}\nhttps://example.com/{'a' * 100}"
+
+    pieces = split_text(text, limit=1000)
+
+    assert all(len(piece) <= 1000 for piece in pieces)
+    assert " ".join(pieces).split() == text.split()
+    # cut at the paragraph break, and never inside the url
+    assert pieces[1].startswith("word") and pieces[-1].endswith("a" * 100)
+    assert split_text("x" * 2500) == ["x" * 2000, "x" * 500]
+
+
+def test_pack_messages():
+    lines = [f"- Article {i}: https://example.com/{i}" for i in range(200)]
+
+    messages = pack_messages(lines)
+
+    assert all(len(message) <= MESSAGE_LIMIT for message in messages)
+    assert "\n".join(messages).split("\n") == lines
+    assert len(messages) == -(-len("\n".join(lines)) // MESSAGE_LIMIT)
+    assert pack_messages(["a", "b" * 30, "c"], separator="\n\n", limit=30) == ["a", "b" * 30, "c"]
+
+
+def test_send_queue_paces_each_channel():
+    sent = []
+
+    def sender(channel):
+        async def send(content):
+            sent.append((channel, content, time.monotonic()))
+
+        return send
+
+    async def main():
+        queue = SendQueue(rate=20, burst=2)
+        start = time.monotonic()
+        await asyncio.gather(queue.send_all("a", sender("a"), [f"a{i}" for i in range(6)]),
+                             queue.send_all("b", sender("b"), ["b0", "b1"]))
+        return start
+
+    start = asyncio.run(main())
+
+    assert [content for channel, content, _ in sent if channel == "a"] == [f"a{i}" for i in range(6)]
+    # a burst of 2, then one message per 50ms, while channel b isn't held up
+    assert sent[-1][2] - start >= 0.18
+    assert max(at for channel, _, at in sent if channel == "b") - start < 0.05
+
+
+def test_send_queue_forgets_idle_channels():
+    async def send(content):
+        pass
+
+    async def main(queue, channels):
+        for channel in channels:
+            await queue.send(channel, send, "hi")
+            await asyncio.sleep(0.01)
+
+    queue = SendQueue(rate=1000, burst=1, max_channels=2)
+    asyncio.run(main(queue, range(100)))
+    assert list(queue._buckets) == list(queue._locks) == [98, 99]
+
+    # still paced: its bucket is empty for another second
+    queue = SendQueue(rate=1, burst=1, max_channels=1)
+    asyncio.run(main(queue, ["a", "b"]))
+    assert list(queue._buckets) == ["a", "b"]
+
+
+def create_news(db, monkeypatch, title="Article {i}"):
+    now = datetime.utcnow()
+    user = models.User(username="discord", email="discord@example.com", discord_id="42", password_hash="",
+                       created_at=now, updated_at=now)
+    feed = models.Feed(title="Feed", url="https://example.com/feed.xml", created_at=now, updated_at=now)
+    db.add_all([user, feed])
+    db.commit()
+    db.add(models.UserFeedSubscription(user_id=user.id, feed_id=feed.id, created_at=now, updated_at=now))
+    for i in range(catnews.NEWS_PAGE_SIZE):
+        article = models.Article(title=title.format(i=i), url=f"https://example.com/{i}", content=f"Content {i}",
+                                 published_at=now, created_at=now, updated_at=now)
+        db.add(article)
+        db.flush()
+        db.add(models.FeedArticle(feed_id=feed.id, article_id=article.id, created_at=now, updated_at=now))
+    db.commit()
+    monkeypatch.setattr(catnews, "session_scope",
+                        SessionScope(sessionmaker(autocommit=False, autoflush=False, bind=db.get_bind())))
+
+
+def test_news_fits_discord_limits(db, monkeypatch):
+    create_news(db, monkeypatch, title="Article {i} " + "very long title " * 80)
+    ctx = FakeContext("42")
+
+    asyncio.run(catnews.get_news.callback(ctx, 1))
+
+    assert all(len(message) <= MESSAGE_LIMIT for message in ctx.responses)
+    assert len(ctx.responses) == catnews.NEWS_PAGE_SIZE
+    assert ctx.responses[-1].endswith("Page 1 finished")
+    assert all(f"https://example.com/{i}" in "".join(ctx.responses) for i in range(catnews.NEWS_PAGE_SIZE))
+
+
+def test_cats_streams_in_completion_order(db, monkeypatch, openai_stub):
+    create_news(db, monkeypatch)
+    monkeypatch.setattr(catnews, "send_queue", SendQueue())
+    latencies = {"Content 0": 0.6, "Content 1": 0.1, "Content 2": 0.3}
+    openai_stub.latency = lambda request: next(v for k, v in latencies.items() if k in request["prompt"])
+    ctx = FakeContext("42")
+    sent_at = []
+
+    async def respond(message):
+        sent_at.append(time.perf_counter())
+        ctx.responses.append(message)
+
+    ctx.respond = respond
+
+    async def main():
+        start = time.perf_counter()
+        await catnews.get_cats.callback(ctx, 1)
+        return start
+
+    start = asyncio.run(main())
+
+    assert ctx.deferred
+    assert [response.split("\n")[0] for response in ctx.responses] == [
+        "Title: Article 1", "Title: Article 2", "Title: Article 0", "Page 1 finished"]
+    # the first summary is sent as soon as the fastest completion is back, not once the page is
+    assert sent_at[0] - start < 0.3
+
+
+class FakePermissions:
+    def __init__(self, manage_channels):
+        self.manage_channels = manage_channels
+
+
+class FakeChannel:
+    def __init__(self, manage_channels):
+        self.manage_channels = manage_channels
+
+    def permissions_for(self, member):
+        return FakePermissions(self.manage_channels)
+
+
+def test_binding_a_channel_needs_manage_channels(db, monkeypatch):
+    create_news(db, monkeypatch)
+    url = "https://example.com/feed.xml"
+    for manage_channels in (False, True):
+        ctx = FakeContext("42")
+        ctx.guild_id, ctx.channel = 7, FakeChannel(manage_channels)
+
+        asyncio.run(catnews.bind.callback(ctx, url))
+
+        assert (db.query(models.ChannelBinding).count() == 1) == manage_channels
+    assert ctx.responses == [f"New articles of {url} will be posted here."]
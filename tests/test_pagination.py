@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import crud, models
+from app.catnews import get_news_page, NEWS_PAGE_SIZE
+from tests.conftest import add_articles
+
+
+@pytest.fixture
+def timeline(db):
+    now = datetime.utcnow()
+    user = models.User(username="reader", email="reader@example.com", password_hash="", created_at=now,
+                       updated_at=now)
+    feed = models.Feed(title="Feed", url="https://example.com/feed.xml", created_at=now, updated_at=now)
+    db.add_all([user, feed])
+    db.commit()
+    db.add(models.UserFeedSubscription(user_id=user.id, feed_id=feed.id, created_at=now, updated_at=now))
+    add_articles(db, range(7), feed, now)
+    return user, feed
+
+
+def test_cursor_pagination(db, timeline):
+    user, feed = timeline
+    titles = []
+    cursor = None
+    while True:
+        articles, cursor = crud.get_feed_article_page(user, db, cursor=cursor, limit=3)
+        titles += [article.title for article in articles]
+        if cursor is None:
+            break
+
+    assert titles == [f"Article {number}" for number in reversed(range(7))]
+
+
+def test_cursor_pagination_is_stable_while_ingesting(db, timeline):
+    user, feed = timeline
+    first_page, cursor = crud.get_feed_article_page(user, db, limit=3)
+    add_articles(db, range(7, 10), feed, datetime.utcnow() + timedelta(minutes=1))
+
+    second_page, _ = crud.get_feed_article_page(user, db, cursor=cursor, limit=3)
+
+    assert [article.title for article in first_page] == ["Article 6", "Article 5", "Article 4"]
+    assert [article.title for article in second_page] == ["Article 3", "Article 2", "Article 1"]
+
+
+def test_invalid_cursor(db, timeline):
+    user, _ = timeline
+    with pytest.raises(ValueError):
+        crud.get_feed_article_page(user, db, cursor="not-a-cursor")
+
+
+def test_news_pages(db, timeline):
+    user, _ = timeline
+    pages = [[article.title for article in get_news_page(user, db, page)] for page in (3, 1, 2, 4)]
+
+    assert NEWS_PAGE_SIZE == 3
+    assert pages == [["Article 0"], ["Article 6", "Article 5", "Article 4"], ["Article 3", "Article 2", "Article 1"],
+                     []]
+
+
+def test_unread_timeline(db, timeline):
+    user, feed = timeline
+    # seen on the regular timeline
+    crud.mark_articles_seen(user.id, [article.id for article in crud.get_feed_articles(user, db, limit=1)], db)
+
+    articles = crud.get_unread_page(user, db, limit=3)
+    # until they are marked, the same page again
+    assert crud.get_unread_page(user, db, limit=3) == articles
+    assert [article.title for article in articles] == ["Article 5", "Article 4", "Article 3"]
+    crud.mark_articles_seen(user.id, [article.id for article in articles], db, advance_marker=True)
+
+    # the mark is where this visit stopped, not held back by the older entries left unread
+    marker = db.get(models.ReadMarker, user.id)
+    shown = db.query(models.FeedArticle).filter(models.FeedArticle.article_id == articles[0].id).one()
+    assert (marker.last_read_at, marker.last_read_id) == (shown.updated_at, shown.id)
+    assert crud.get_unread_page(user, db, limit=3) == []
+    assert [article.title for article in crud.get_feed_articles(user, db)][-3:] == [
+        "Article 2", "Article 1", "Article 0"]
+
+    add_articles(db, range(7, 9), feed, datetime.utcnow() + timedelta(minutes=1))
+    assert [article.title for article in crud.get_unread_page(user, db, limit=3)] == ["Article 8", "Article 7"]
+    assert db.query(models.RequestedArticle).filter(models.RequestedArticle.user_id == user.id).count() == 4
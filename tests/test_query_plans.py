@@ -0,0 +1,49 @@
+from datetime import datetime
+
+from app import crud, models
+
+
+def explain(db, statement: str, parameters=()) -> str:
+    return "\n".join(row[-1] for row in db.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}",
+                                                                        tuple(parameters)))
+
+
+def test_articles_query_uses_index(db, subscribed_reader, count_statements):
+    user, _ = subscribed_reader
+
+    with count_statements(parameters=True) as executed:
+        crud.get_feed_articles(user, db)
+    statement, parameters = next((s, p) for s, p in executed if "JOIN feed_article" in s and "FROM article" in s)
+    plan = explain(db, statement, parameters)
+
+    assert "SCAN feed_article" not in plan
+    assert "SEARCH feed_article USING INDEX" in plan or "SEARCH feed_article USING COVERING INDEX" in plan
+    assert "SEARCH article USING INTEGER PRIMARY KEY" in plan
+
+
+def test_article_url_lookup_uses_index(db):
+    plan = explain(db, "SELECT id FROM article WHERE url = ?", ("https://example.com/1",))
+
+    assert "USING COVERING INDEX ix_article_url" in plan or "USING INDEX ix_article_url" in plan
+
+
+def test_unread_query_only_searches_above_the_mark(db, subscribed_reader, count_statements):
+    user, feeds = subscribed_reader
+    now = datetime.utcnow()
+    article = models.Article(title="Article", url="https://example.com/1", published_at=now, created_at=now,
+                             updated_at=now)
+    db.add(article)
+    db.flush()
+    db.add(models.FeedArticle(feed_id=feeds[0].id, article_id=article.id, created_at=now, updated_at=now))
+    db.add(models.ReadMarker(user_id=user.id, last_read_at=now, last_read_id=0, updated_at=now))
+    db.commit()
+
+    with count_statements(parameters=True) as executed:
+        crud.get_unread_page(user, db)
+    statement, parameters = next((s, p) for s, p in executed if "requested_article" in s and "FROM article" in s)
+    plan = explain(db, statement, parameters)
+
+    # a range of each subscribed feed above the mark, and a lookup of each of its entries in the read history
+    assert "ix_feed_article_feed_id_updated_at (feed_id=? AND updated_at>?" in plan
+    assert "SCAN requested_article" not in plan
+    assert "requested_article USING COVERING INDEX" in plan
@@ -0,0 +1,246 @@
+import asyncio
+from collections import Counter
+from datetime import datetime, timedelta
+
+import feedparser
+import httpx
+import pytest
+
+from app import crud, models, schemas
+from app.config import settings
+from app.fetcher import FeedFetcher
+from app.scheduler import FeedScheduler
+from app.utils import polling
+from tests.conftest import create_feed, TestingSessionLocal
+from tests.test_fetcher import archive
+
+
+def test_refresh_due_feeds(db, sample_rss):
+    fetched = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        fetched.append(str(request.url))
+        return httpx.Response(200, text=sample_rss)
+
+    due = create_feed(db)
+    create_feed(db, url="https://example.com/fresh.xml", next_refresh_at=datetime.utcnow() + timedelta(hours=1))
+    fetcher = FeedFetcher(transport=httpx.MockTransport(handler))
+
+    refreshed = asyncio.run(FeedScheduler(session_factory=TestingSessionLocal, fetcher=fetcher).run_once())
+
+    assert refreshed == 1
+    assert fetched == [due.url]
+    db.refresh(due)
+    assert due.last_refreshed_at is not None
+    assert due.next_refresh_at > datetime.utcnow()
+    assert db.query(models.FeedArticle).filter(models.FeedArticle.feed_id == due.id).count() == 2
+
+
+def test_not_modified_feed_skips_ingestion(db, sample_rss, monkeypatch):
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, text=sample_rss, headers={"ETag": '"v1"'})
+
+    feed = create_feed(db)
+    scheduler = FeedScheduler(session_factory=TestingSessionLocal,
+                              fetcher=FeedFetcher(transport=httpx.MockTransport(handler)))
+    asyncio.run(scheduler.run_once())
+    db.refresh(feed)
+    assert feed.etag == '"v1"' and feed.content_hash
+
+    def fail_update(*args, **kwargs):
+        raise AssertionError("unchanged feed must not be ingested")
+
+    monkeypatch.setattr(crud, "ingest_feed_entries", fail_update)
+    db.query(models.Feed).update({models.Feed.next_refresh_at: None})
+    db.commit()
+    asyncio.run(scheduler.run_once())
+
+    assert scheduler.stats == {"updated": 1, "not_modified": 1}
+
+
+def test_failed_refresh_is_rescheduled(db):
+    feed = create_feed(db)
+    fetcher = FeedFetcher(transport=httpx.MockTransport(lambda request: httpx.Response(503)))
+
+    asyncio.run(FeedScheduler(session_factory=TestingSessionLocal, fetcher=fetcher).run_once())
+
+    db.refresh(feed)
+    assert feed.next_refresh_at > datetime.utcnow()
+
+
+def test_get_feed_articles_reads_database_only(db, monkeypatch):
+    def fail_parse(url):
+        raise AssertionError("read path must not fetch feeds")
+
+    monkeypatch.setattr(feedparser, "parse", fail_parse)
+    user = models.User(username="reader", email="reader@example.com", password_hash="",
+                       created_at=datetime.utcnow(), updated_at=datetime.utcnow())
+    db.add(user)
+    feed = create_feed(db)
+    db.add(models.UserFeedSubscription(user_id=user.id, feed_id=feed.id, created_at=datetime.utcnow(),
+                                       updated_at=datetime.utcnow()))
+    db.commit()
+
+    assert crud.get_feed_articles(user, db) == []
+    # nor does subscribing, a new feed is fetched by the caller
+    with pytest.raises(ValueError):
+        crud.subscribe_to_feed(schemas.FeedCreate(url="https://example.com/new.xml"), user, db, None)
+
+
+def test_concurrent_user_refreshes_share_one_fetch(db, sample_rss):
+    requests = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, text=sample_rss)
+
+    feed = create_feed(db)
+    now = datetime.utcnow()
+    users = [models.User(username=f"reader{i}", email=f"reader{i}@example.com", password_hash="", created_at=now,
+                         updated_at=now) for i in range(100)]
+    db.add_all(users)
+    db.flush()
+    db.add_all(models.UserFeedSubscription(user_id=user.id, feed_id=feed.id, created_at=now, updated_at=now)
+               for user in users)
+    db.commit()
+    user_ids = [user.id for user in users]
+    scheduler = FeedScheduler(session_factory=TestingSessionLocal,
+                              fetcher=FeedFetcher(transport=httpx.MockTransport(handler)))
+
+    async def refresh_all():
+        return await asyncio.gather(*(scheduler.refresh_user_feeds(user_id) for user_id in user_ids))
+
+    stats = sum(asyncio.run(refresh_all()), Counter())
+
+    assert len(requests) == 1
+    assert stats["updated"] == 1 and stats["coalesced"] + stats["fresh"] == 99
+    assert db.query(models.FeedArticle).count() == 2
+
+    # within the freshness window nobody fetches
+    stats = sum(asyncio.run(refresh_all()), Counter())
+    assert len(requests) == 1 and stats["fresh"] == 100
+
+
+def test_concurrent_fetches_of_one_url_share_one_request(sample_rss):
+    requests = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, text=sample_rss)
+
+    async def main():
+        fetcher = FeedFetcher(transport=httpx.MockTransport(handler))
+        try:
+            return await asyncio.gather(*(fetcher.fetch_feed("https://example.com/feed.xml") for _ in range(10)))
+        finally:
+            await fetcher.aclose()
+
+    parsed_feeds = asyncio.run(main())
+
+    assert len(requests) == 1
+    assert all(parsed_feed is parsed_feeds[0] for parsed_feed in parsed_feeds)
+
+
+def test_poll_interval_follows_feed_activity():
+    now = datetime(2023, 3, 28, 12)
+    bounds = dict(default=900, minimum=300, maximum=86400, now=now)
+
+    # posts every 20 minutes: poll twice as often, but not below the minimum
+    assert polling.next_poll_interval(entry_interval=1200, last_new_entry_at=now, **bounds) == 600
+    assert polling.next_poll_interval(entry_interval=120, last_new_entry_at=now, **bounds) == 300
+    # quieter than usual for two days: slow down, within the maximum
+    assert polling.next_poll_interval(entry_interval=3600, last_new_entry_at=now - timedelta(days=2), **bounds) == 86400
+    # no history yet
+    assert polling.next_poll_interval(**bounds) == 900
+    # the publisher asks for at most hourly polls
+    assert polling.next_poll_interval(entry_interval=1200, last_new_entry_at=now, hint=3600, **bounds) == 3600
+    # failures back off exponentially
+    assert polling.next_poll_interval(error_count=3, **bounds) == 900 * 8
+    assert polling.next_poll_interval(error_count=30, **bounds) == 86400
+
+
+def test_hint_interval():
+    assert polling.hint_interval({"ttl": "60"}) == 3600
+    assert polling.hint_interval({"sy_updateperiod": "hourly", "sy_updatefrequency": "2"}) == 1800
+    assert polling.hint_interval({"sy_updateperiod": "daily"}) == 86400
+    assert polling.hint_interval({"ttl": "soon"}) is None
+    assert polling.hint_interval({}) is None
+
+
+def test_refresh_schedules_by_activity(db, sample_rss):
+    feed = create_feed(db)
+    crud.refresh_feed(feed, db, feedparser.parse(sample_rss.replace("<channel>", "<channel><ttl>120</ttl>")))
+
+    db.refresh(feed)
+    # the two sample entries are a day apart
+    assert feed.entry_interval == 86400 and feed.poll_hint == 7200
+    assert feed.last_new_entry_at == datetime(2023, 3, 28, 10)
+    # silent since 2023: polled at the maximum interval
+    assert feed.next_refresh_at - feed.last_refreshed_at == timedelta(seconds=settings.FEED_REFRESH_MAX_INTERVAL)
+
+    # a new entry an hour later
+    feed.last_new_entry_at = datetime.utcnow() - timedelta(hours=1)
+    crud.refresh_feed(feed, db, feedparser.parse(sample_rss.replace("/articles/2", "/articles/3")))
+    db.refresh(feed)
+    assert feed.entry_interval == pytest.approx(86400 * 0.7 + 3600 * 0.3, abs=2)
+    assert feed.error_count == 0
+
+
+def test_failed_refreshes_back_off(db):
+    feed = create_feed(db)
+    fetcher = FeedFetcher(transport=httpx.MockTransport(lambda request: httpx.Response(503)))
+    scheduler = FeedScheduler(session_factory=TestingSessionLocal, fetcher=fetcher)
+
+    intervals = []
+    for _ in range(3):
+        db.query(models.Feed).update({models.Feed.next_refresh_at: None})
+        db.commit()
+        asyncio.run(scheduler.run_once())
+        db.refresh(feed)
+        intervals.append((feed.next_refresh_at - feed.last_refreshed_at).total_seconds())
+
+    assert feed.error_count == 3
+    assert intervals == [settings.FEED_REFRESH_INTERVAL * 2 ** n for n in (1, 2, 3)]
+
+
+def test_failing_host_is_skipped(db):
+    failing = create_feed(db)
+    skipped = create_feed(db, url="https://example.com/other.xml")
+    fetcher = FeedFetcher(transport=httpx.MockTransport(lambda request: httpx.Response(503)), per_host=1,
+                          breaker_threshold=1, breaker_cooldown=600)
+    scheduler = FeedScheduler(session_factory=TestingSessionLocal, fetcher=fetcher)
+
+    asyncio.run(scheduler.run_once())
+
+    db.refresh(failing)
+    db.refresh(skipped)
+    assert scheduler.stats["failed"] == 1 and scheduler.stats["skipped"] == 1
+    assert failing.error_count == 1
+    # not the feed's fault: no backoff, retried once the breaker lets a trial through
+    assert skipped.error_count == 0 and skipped.last_refreshed_at is None
+    assert skipped.next_refresh_at > datetime.utcnow() + timedelta(seconds=590)
+
+
+def test_large_feed_refresh_stops_at_stored_entries(db, monkeypatch):
+    feed = create_feed(db)
+    crud.refresh_feed(feed, db, feedparser.parse(archive(200)))
+    feed.next_refresh_at = None
+    db.commit()
+    document = archive(230)
+    fetcher = FeedFetcher(transport=httpx.MockTransport(lambda request: httpx.Response(200, content=document)),
+                          stream_threshold=4000)
+    known = []
+    monkeypatch.setattr(crud, "get_feed_article_urls",
+                        lambda feed, urls, db, lookup=crud.get_feed_article_urls: known.append(len(urls)) or
+                        lookup(feed, urls, db))
+
+    stats = asyncio.run(FeedScheduler(session_factory=TestingSessionLocal, fetcher=fetcher).run_once())
+
+    assert stats == 1
+    assert db.query(models.FeedArticle).filter(models.FeedArticle.feed_id == feed.id).count() == 230
+    # streamed, looking up the stored entries
+    assert known
@@ -0,0 +1,42 @@
+import asyncio
+from datetime import datetime
+
+from sqlalchemy.orm import sessionmaker
+
+from app import catnews, models
+from app.database import SessionScope
+from tests.conftest import FakeContext
+
+COMMANDS = 10_000
+CONCURRENCY = 10
+
+
+def test_bot_commands_return_connections(db, monkeypatch):
+    db.add(models.User(username="discord", email="discord@example.com", discord_id="42", password_hash="",
+                       created_at=datetime.utcnow(), updated_at=datetime.utcnow()))
+    db.commit()
+    scope = SessionScope(sessionmaker(autocommit=False, autoflush=False, bind=db.get_bind()))
+    monkeypatch.setattr(catnews, "session_scope", scope)
+    handled = []
+
+    async def command(command_db, current_user):
+        await asyncio.sleep(0)
+        handled.append(current_user.discord_id)
+
+    async def soak():
+        semaphore = asyncio.Semaphore(CONCURRENCY)
+
+        async def one(i):
+            async with semaphore:
+                await catnews.login_check_helper(FakeContext("42" if i % 2 else "unknown"), command)
+
+        await asyncio.gather(*(one(i) for i in range(COMMANDS)))
+
+    asyncio.run(soak())
+    metrics = scope.metrics()
+
+    assert len(handled) == COMMANDS // 2
+    assert metrics["checkouts"] == COMMANDS
+    assert metrics["checked_out"] == 0
+    assert metrics["checked_out_max"] <= CONCURRENCY
+    assert metrics["overflow"] == 0
@@ -0,0 +1,140 @@
+import asyncio
+from datetime import datetime
+
+import feedparser
+import httpx
+
+from app import catnews, crud, models, summarizer
+from app.config import settings
+from app.summarizer import SummaryWorkerPool, summarize_article
+from app.utils.aiapi import AIClient
+from tests.conftest import add_article, create_feed, StubOpenAI, TestingSessionLocal
+
+
+def ingest(db, sample_rss, monkeypatch) -> models.Feed:
+    monkeypatch.setattr(settings, "SUMMARIZE_ON_INGEST", True)
+    feed = create_feed(db)
+    crud.ingest_feed_entries(feed, feedparser.parse(sample_rss).entries, db)
+    db.commit()
+    return feed
+
+
+def test_ingested_articles_are_summarized(db, sample_rss, monkeypatch, openai_stub):
+    ingest(db, sample_rss, monkeypatch)
+    assert db.query(models.SummaryJob).filter(models.SummaryJob.status == "pending").count() == 2
+    workers = SummaryWorkerPool(session_factory=TestingSessionLocal, rate_per_minute=6000)
+
+    async def drain():
+        return await asyncio.gather(*(workers.run_once() for _ in range(3)))
+
+    processed = asyncio.run(drain())
+
+    assert sorted(processed) == [False, True, True]
+    assert db.query(models.SummaryJob).filter(models.SummaryJob.status == "done").count() == 2
+    assert db.query(models.Summary).count() == 2
+
+    # /cats is now a database read
+    article = db.query(models.Article).first()
+    summary_obj, tags = asyncio.run(summarize_article(article, db))
+    assert summary_obj.content == "A summary." and tags == ["cats", "news", "ai"]
+    assert len(openai_stub.requests) == 2
+
+
+def test_failed_jobs_are_retried_with_backoff(db, sample_rss, monkeypatch):
+    stub = StubOpenAI(latency=0, status_code=500)
+    monkeypatch.setattr(summarizer, "ai_client", AIClient(api_key="test", transport=httpx.MockTransport(stub)))
+    monkeypatch.setattr(settings, "SUMMARY_MAX_ATTEMPTS", 2)
+    ingest(db, sample_rss, monkeypatch)
+    workers = SummaryWorkerPool(session_factory=TestingSessionLocal, rate_per_minute=6000)
+
+    assert asyncio.run(workers.run_once())
+    job = db.query(models.SummaryJob).filter(models.SummaryJob.attempts == 1).one()
+    assert job.status == "pending" and job.next_attempt_at > datetime.utcnow() and "500" in job.last_error
+
+    # backing off: only the other job is due
+    assert asyncio.run(workers.run_once())
+    assert not asyncio.run(workers.run_once())
+
+    db.query(models.SummaryJob).update({models.SummaryJob.next_attempt_at: datetime.utcnow()})
+    db.commit()
+    asyncio.run(workers.run_once())
+    asyncio.run(workers.run_once())
+    db.expire_all()
+    assert [job.status for job in db.query(models.SummaryJob)] == ["failed", "failed"]
+
+
+def test_running_jobs_survive_restart(db, sample_rss, monkeypatch):
+    ingest(db, sample_rss, monkeypatch)
+    crud.claim_summary_job(db, datetime.utcnow())
+
+    assert crud.reset_running_summary_jobs(db) == 1
+    assert db.query(models.SummaryJob).filter(models.SummaryJob.status == "pending").count() == 2
+
+
+def test_duplicate_content_reuses_the_cached_result(db, openai_stub):
+    first = add_article(db, "https://example.com/a", "<p>The cat   sat on the mat.</p>")
+    syndicated = add_article(db, "https://mirror.example.org/a", "the cat sat on the <b>mat</b>.")
+
+    asyncio.run(summarize_article(first, db))
+    summary_obj, tags = asyncio.run(summarize_article(syndicated, db))
+
+    assert len(openai_stub.requests) == 1
+    assert summary_obj.content == "A summary." and tags == ["cats", "news", "ai"]
+    assert summarizer.summary_cache.metrics()["memory_hits"] == 1
+
+    # a fresh process finds it in the table
+    summarizer.summary_cache.clear()
+    other = add_article(db, "https://example.net/a", "The cat sat on the mat.")
+    asyncio.run(summarize_article(other, db))
+    assert len(openai_stub.requests) == 1
+    assert summarizer.summary_cache.metrics()["db_hits"] == 1
+
+
+def test_concurrent_duplicates_share_one_completion(db, openai_stub):
+    articles = [add_article(db, f"https://example.com/{i}", "Same story") for i in range(3)]
+
+    async def summarize_all():
+        return await asyncio.gather(*(summarize_article(a, db) for a in articles))
+
+    asyncio.run(summarize_all())
+    assert len(openai_stub.requests) == 1
+    assert summarizer.summary_cache.metrics()["coalesced"] == 2
+
+
+def test_summary_cache_evicts_least_recently_used(db, openai_stub, monkeypatch):
+    cache = summarizer.SummaryCache(maxsize=2)
+    monkeypatch.setattr(summarizer, "summary_cache", cache)
+    for i in range(3):
+        asyncio.run(summarize_article(add_article(db, f"https://example.com/{i}", f"Story {i}"), db))
+
+    assert cache.metrics()["evictions"] == 1 and cache.metrics()["size"] == 2
+    assert cache.prune(db, max_age_days=0) == 3
+
+
+def test_racing_summaries_store_one(db, openai_stub):
+    story = add_article(db, "https://example.com/a", "A story")
+
+    async def summarize_twice():
+        return await asyncio.gather(summarize_article(story, db), summarize_article(story, db))
+
+    (first, _), (second, _) = asyncio.run(summarize_twice())
+
+    assert db.query(models.Summary).count() == 1
+    assert first.id == second.id
+    db.expire_all()
+    assert story.summary.content == "A summary."
+
+
+def test_cats_leaves_claimed_articles_to_the_workers(db, sample_rss, monkeypatch, openai_stub):
+    ingest(db, sample_rss, monkeypatch)
+    job = crud.claim_summary_job(db, datetime.utcnow())
+    articles = db.query(models.Article).order_by(models.Article.id).all()
+
+    async def page():
+        return {article.id: result async for article, result in catnews.iter_tag_summaries(articles, db)}
+
+    results = asyncio.run(page())
+
+    assert results[job.article_id] is None
+    assert len(openai_stub.requests) == 1
+    assert db.query(models.Summary).filter(models.Summary.article_id == job.article_id).count() == 0
@@ -0,0 +1,45 @@
+from app import crud, models
+from tests.conftest import add_article
+
+
+def test_repeated_tags_are_normalized_and_associated_once(db):
+    article = add_article(db)
+
+    tags = crud.associate_tags_with_article(db, article, ["Cats", " cats ", "#AI", "ai", "Machine  Learning", ""])
+    # associating again is a no-op instead of a primary key violation
+    crud.associate_tags_with_article(db, article, ["cats", "News"])
+
+    assert tags == ["cats", "ai", "machine learning"]
+    assert sorted(crud.get_tags_by_article_id(db, article.id)) == ["ai", "cats", "machine learning", "news"]
+    assert db.query(models.Tag).count() == 4
+
+
+def test_tag_resolution_statements(db, count_statements):
+    first, second = add_article(db), add_article(db, "https://example.com/2")
+    first_id, second_id = first.id, second.id
+
+    with count_statements() as statements:
+        crud.associate_tags_with_article(db, first, ["cats", "news", "ai"])
+    # known tags, missing tags, the tags just inserted, the associations
+    assert len(statements) == 4
+
+    crud.tag_id_cache.clear()
+    db.refresh(second)
+    with count_statements() as statements:
+        crud.associate_tags_with_article(db, second, ["cats", "news", "ai"])
+    assert len(statements) == 2
+
+    db.refresh(first)
+    with count_statements() as statements:
+        crud.associate_tags_with_article(db, first, ["cats", "news", "ai", "cats"])
+    assert len(statements) == 1
+    assert crud.get_tags_by_article_id(db, second_id) == crud.get_tags_by_article_id(db, first_id)
+
+
+def test_tag_id_cache_is_bounded(db, monkeypatch):
+    monkeypatch.setattr(crud, "TAG_ID_CACHE_SIZE", 2)
+    crud.resolve_tag_ids(["a", "b", "c"], db)
+    db.commit()
+    crud.resolve_tag_ids(["a", "b", "c"], db)
+
+    assert list(crud.tag_id_cache) == ["b", "c"]
@@ -0,0 +1,73 @@
+from datetime import datetime
+
+from app import crud, models, schemas
+from app.config import settings
+from tests.test_query_plans import explain
+
+
+def entries(feed: int, numbers) -> list:
+    return [{"title": f"Article {feed}/{i}", "link": f"https://example.com/{feed}/{i}"} for i in numbers]
+
+
+def walk(user, db, mode: str) -> list:
+    titles, cursor = [], None
+    while True:
+        rows = db.execute(crud.feed_article_page_statement(user.id, cursor, limit=4, mode=mode)).all()
+        articles, cursor = crud.feed_article_page_from_rows(rows, 4)
+        titles += [article.title for article in articles]
+        if cursor is None:
+            return titles
+
+
+def test_materialized_timeline_matches_query(db, reader, monkeypatch):
+    monkeypatch.setattr(settings, "TIMELINE_MODE", "materialized")
+    user, feeds = reader
+    # stored before the subscriptions, copied into the timeline by subscribing
+    crud.ingest_feed_entries(feeds[0], entries(0, range(5)), db)
+    db.commit()
+    for feed in feeds:
+        crud.subscribe_to_feed(schemas.FeedCreate(url=feed.url), user, db, None)
+    # written to the timeline at ingestion
+    for batch in range(2):
+        for i, feed in enumerate(feeds):
+            crud.ingest_feed_entries(feed, entries(i, range(5 + batch * 3, 8 + batch * 3)), db)
+            db.commit()
+
+    materialized = walk(user, db, "materialized")
+
+    assert len(materialized) == 5 + 6 * 3
+    assert materialized == walk(user, db, "query")
+    assert [article.title for article in crud.get_feed_articles(user, db, limit=3)] == materialized[:3]
+
+    crud.unsubscribe_from_feed(schemas.FeedRemove(url=feeds[0].url), user, db)
+    assert walk(user, db, "materialized") == walk(user, db, "query")
+    assert db.query(models.TimelineEntry).filter(models.TimelineEntry.feed_id == feeds[0].id).count() == 0
+
+
+def test_prepare_timelines(db, reader, monkeypatch):
+    user, feeds = reader
+    for i, feed in enumerate(feeds):
+        crud.subscribe_to_feed(schemas.FeedCreate(url=feed.url), user, db, None)
+        crud.ingest_feed_entries(feed, entries(i, range(4)), db)
+        db.commit()
+    assert db.query(models.TimelineEntry).count() == 0
+
+    monkeypatch.setattr(settings, "TIMELINE_MODE", "materialized")
+    assert crud.prepare_timelines(db) == 12
+    assert crud.prepare_timelines(db) == 0
+    assert walk(user, db, "materialized") == walk(user, db, "query")
+
+    monkeypatch.setattr(settings, "TIMELINE_MODE", "query")
+    assert crud.prepare_timelines(db) == 12
+    assert db.query(models.TimelineEntry).count() == 0
+
+
+def test_materialized_page_is_an_index_range(db):
+    statement = crud.timeline_entry_page_statement(1, crud.encode_cursor(datetime.utcnow(), 10))
+    compiled = statement.compile(db.get_bind())
+
+    plan = explain(db, str(compiled), [compiled.params[name] for name in compiled.positiontup])
+
+    assert "ix_timeline_entry_user_id_updated_at (user_id=? AND (updated_at,feed_article_id)<(?,?))" in plan
+    # read in index order, no sort of the whole timeline
+    assert "TEMP B-TREE" not in plan
@@ -0,0 +1,183 @@
+import asyncio
+import hashlib
+import hmac
+from datetime import datetime, timedelta
+from urllib.parse import parse_qsl, urlsplit
+
+import feedparser
+import httpx
+
+from app import crud, models, schemas, websub
+from app.fetcher import FeedFetcher
+from app.scheduler import FeedScheduler, is_fresh
+from app.websub import WebSubSubscriber
+from tests.conftest import create_feed, TestingSessionLocal
+
+FEED_URL = "https://example.com/feed.xml"
+HUB_URL = "https://hub.example.com/"
+
+
+def hub_feed(*links: str) -> str:
+    items = "".join(f"<item><title>Article {i}</title><link>https://example.com/articles/{i}</link>"
+                    f"<pubDate>Mon, 27 Mar 2023 1{i}:00:00 GMT</pubDate></item>" for i in links)
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0" xmlns:atom="http://www.w3.org/2005/Atom">
+<channel>
+  <title>Pushed Feed</title>
+  <link>https://example.com/</link>
+  <atom:link rel="hub" href="{HUB_URL}"/>
+  <atom:link rel="self" href="{FEED_URL}" type="application/rss+xml"/>
+  {items}
+</channel>
+</rss>
+"""
+
+
+class StubHub:
+    """Accepts subscription requests, then verifies and publishes through the app like a WebSub hub would."""
+
+    def __init__(self):
+        self.requests = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(dict(parse_qsl(request.content.decode())))
+        return httpx.Response(202)
+
+    def verify(self, client, topic=None, mode="subscribe", lease_seconds=3600):
+        subscription = self.requests[-1]
+        return client.get(urlsplit(subscription["hub.callback"]).path, params={
+            "hub.mode": mode, "hub.topic": topic or subscription["hub.topic"], "hub.challenge": "c4t",
+            "hub.lease_seconds": lease_seconds})
+
+    def publish(self, client, body: str, secret=None):
+        subscription = self.requests[-1]
+        secret = secret or subscription["hub.secret"]
+        signature = hmac.new(secret.encode(), body.encode(), hashlib.sha256).hexdigest()
+        return client.post(urlsplit(subscription["hub.callback"]).path, content=body,
+                           headers={"Content-Type": "application/rss+xml", "X-Hub-Signature": f"sha256={signature}"})
+
+
+def pushed_feed(db) -> models.Feed:
+    feed = create_feed(db, FEED_URL, title="Pushed Feed")
+    crud.refresh_feed(feed, db, feedparser.parse(hub_feed("1")))
+    return feed
+
+
+def test_discover(sample_rss):
+    assert websub.discover(feedparser.parse(hub_feed())) == (HUB_URL, FEED_URL)
+    assert websub.discover(feedparser.parse(sample_rss)) is None
+
+
+def test_verify_signature():
+    signature = "sha1=" + hmac.new(b"secret", b"body", hashlib.sha1).hexdigest()
+
+    assert websub.verify_signature("secret", b"body", signature)
+    assert not websub.verify_signature("secret", b"forged", signature)
+    assert not websub.verify_signature("secret", b"body", "md5=" + hashlib.md5(b"body").hexdigest())
+    assert not websub.verify_signature("secret", b"body", None)
+
+
+def test_push_subscription(test_app, db):
+    hub = StubHub()
+    scheduler = FeedScheduler(session_factory=TestingSessionLocal, websub=WebSubSubscriber(
+        callback_url="https://catnews.example.com/websub", transport=httpx.MockTransport(hub)))
+    feed = pushed_feed(db)
+    assert (feed.websub_hub, feed.websub_topic) == (HUB_URL, FEED_URL)
+
+    assert asyncio.run(scheduler.renew_websub()) == 1
+    # waiting for the hub's verification, not asked again
+    assert asyncio.run(scheduler.renew_websub()) == 0
+    assert hub.requests == [{"hub.mode": "subscribe", "hub.topic": FEED_URL,
+                             "hub.callback": f"https://catnews.example.com/websub/{feed.id}",
+                             "hub.lease_seconds": "864000", "hub.secret": feed.websub_secret}]
+
+    assert hub.verify(test_app, topic="https://example.com/other.xml").status_code == 404
+    response = hub.verify(test_app)
+    assert response.status_code == 200 and response.text == "c4t"
+
+    db.refresh(feed)
+    now = datetime.utcnow()
+    assert now + timedelta(seconds=3500) < feed.websub_lease_expires_at < now + timedelta(seconds=3700)
+    assert is_fresh(feed, now)
+    db.query(models.Feed).update({models.Feed.next_refresh_at: None})
+    db.commit()
+    assert crud.get_due_feeds(db, now) == []
+
+    assert hub.publish(test_app, hub_feed("2")).status_code == 204
+    assert hub.publish(test_app, hub_feed("3"), secret="forged").status_code == 204
+    urls = db.query(models.Article.url).join(models.FeedArticle).filter(models.FeedArticle.feed_id == feed.id)
+    assert sorted(url for url, in urls) == ["https://example.com/articles/1", "https://example.com/articles/2"]
+
+    # renewed within WEBSUB_RENEW_BEFORE of the lease's end
+    assert asyncio.run(scheduler.renew_websub()) == 1
+    assert len(hub.requests) == 2
+
+
+def test_denied_subscription_falls_back_to_polling(test_app, db):
+    hub = StubHub()
+    scheduler = FeedScheduler(session_factory=TestingSessionLocal, websub=WebSubSubscriber(
+        callback_url="https://catnews.example.com/websub", transport=httpx.MockTransport(hub)))
+    feed = pushed_feed(db)
+    asyncio.run(scheduler.renew_websub())
+
+    assert hub.verify(test_app, mode="denied").status_code == 200
+
+    db.refresh(feed)
+    assert feed.websub_hub is None and feed.websub_lease_expires_at is None
+    assert asyncio.run(scheduler.renew_websub()) == 0
+    assert hub.publish(test_app, hub_feed("2")).status_code == 410
+
+
+def test_denial_without_a_pending_request_is_ignored(test_app, db):
+    hub = StubHub()
+    scheduler = FeedScheduler(session_factory=TestingSessionLocal, websub=WebSubSubscriber(
+        callback_url="https://catnews.example.com/websub", transport=httpx.MockTransport(hub)))
+    feed = pushed_feed(db)
+    asyncio.run(scheduler.renew_websub())
+    assert hub.verify(test_app).status_code == 200
+
+    # anyone can call the callback, only the hub we asked may turn push off
+    assert hub.verify(test_app, mode="denied").status_code == 200
+
+    db.refresh(feed)
+    assert feed.websub_hub == HUB_URL and feed.websub_lease_expires_at is not None
+    assert hub.publish(test_app, hub_feed("2")).status_code == 204
+
+
+def test_subscribing_asks_a_new_hub_right_away(db):
+    hub = StubHub()
+    feeds = FeedFetcher(transport=httpx.MockTransport(lambda request: httpx.Response(200, text=hub_feed("1"))))
+    scheduler = FeedScheduler(session_factory=TestingSessionLocal, fetcher=feeds, websub=WebSubSubscriber(
+        callback_url="https://catnews.example.com/websub", transport=httpx.MockTransport(hub)))
+    now = datetime.utcnow()
+    user = models.User(username="reader", email="reader@example.com", password_hash="", created_at=now,
+                       updated_at=now)
+    db.add(user)
+    db.commit()
+
+    # the bot's session, the API's is async
+    feed = asyncio.run(scheduler.subscribe(schemas.FeedCreate(url=FEED_URL), user, db))
+
+    assert feed.websub_hub == HUB_URL
+    assert [request["hub.topic"] for request in hub.requests] == [FEED_URL]
+    asyncio.run(scheduler.subscribe(schemas.FeedCreate(url=FEED_URL), user, db))
+    assert len(hub.requests) == 1
+
+
+def test_failed_request_is_retried(db):
+    calls = []
+
+    def unavailable(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        return httpx.Response(503)
+
+    scheduler = FeedScheduler(session_factory=TestingSessionLocal, websub=WebSubSubscriber(
+        callback_url="https://catnews.example.com/websub", transport=httpx.MockTransport(unavailable)))
+    feed = pushed_feed(db)
+
+    assert asyncio.run(scheduler.renew_websub()) == 1
+    db.refresh(feed)
+    assert feed.websub_requested_at is None
+    # not held back for WEBSUB_RENEW_BEFORE as if the hub were verifying
+    assert asyncio.run(scheduler.renew_websub()) == 1
+    assert len(calls) == 2